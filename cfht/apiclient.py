@@ -0,0 +1,161 @@
+import http.client
+import json
+import os
+import random
+import ssl
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Mapping, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+from logger import log
+from .ratelimiter import RateLimiter
+
+JsonObj = Mapping[str, any]
+ConnectionKey = Tuple[str, str]
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ApiClient:
+    """
+    HTTP client for JSON APIs which keeps connections alive between requests.
+
+    Requests which fail due to connection errors, timeouts or server errors are retried with jittered exponential
+    backoff, and all requests made through the client can be limited to a maximum rate. Errors are raised as
+    urllib.error.URLError (or HTTPError) so callers can handle them the same way as errors from urlopen.
+    """
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, retries: int = 2,
+                 backoff: float = 0.5, max_backoff: float = 10.0, requests_per_second: Optional[float] = None,
+                 max_idle_connections: int = 4):
+        """
+        :param connect_timeout: Timeout in seconds for establishing a connection
+        :param read_timeout: Timeout in seconds for each read from an established connection
+        :param retries: Default number of times a failed request is retried
+        :param backoff: Base delay in seconds before the first retry, doubled for each retry after that
+        :param max_backoff: Maximum delay in seconds between retries
+        :param requests_per_second: Rate limit shared by all requests from this client, or None for no limit
+        :param max_idle_connections: Maximum number of idle connections kept open per host
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(requests_per_second, 1) if requests_per_second else None
+        self.max_idle_connections = max_idle_connections
+        self.lock = threading.Lock()
+        self.idle_connections: Dict[ConnectionKey, List[http.client.HTTPConnection]] = defaultdict(list)
+        self.pid = os.getpid()
+        self.ssl_context = None
+
+    def json_request(self, url: str, data: JsonObj, headers: Mapping[str, str] = None,
+                     retries: Optional[int] = None) -> JsonObj:
+        """
+        POSTs a JSON object to a url and returns the decoded JSON response.
+        :param url: The url to send the request to
+        :param data: The JSON object to send
+        :param headers: Extra HTTP headers for the request
+        :param retries: Override the number of retries for this request
+        :return: The decoded response
+        """
+        http_headers = {'Content-Type': 'application/json'}
+        if headers:
+            http_headers.update(headers)
+        response = self.request('POST', url, json.dumps(data).encode('utf-8'), http_headers, retries)
+        return json.loads(response.decode('utf-8'))
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None, headers: Mapping[str, str] = None,
+                retries: Optional[int] = None) -> bytes:
+        """
+        Sends an HTTP request, retrying with backoff on failure.
+        :return: The body of the response
+        """
+        if retries is None:
+            retries = self.retries
+        for attempt in range(retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                return self.__attempt(method, url, body, headers or {})
+            except URLError as err:
+                retryable = not isinstance(err, HTTPError) or err.code in RETRY_STATUSES
+                if attempt == retries or not retryable:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                log.warning('Request to %s failed (%s), retrying in %.1f s', url, err.reason, delay)
+                time.sleep(delay)
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        with self.lock:
+            connections = [connection for idle in self.idle_connections.values() for connection in idle]
+            self.idle_connections.clear()
+        for connection in connections:
+            connection.close()
+
+    def __attempt(self, method: str, url: str, body: Optional[bytes], headers: Mapping[str, str]) -> bytes:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection, reused = self.__get_connection(key)
+        try:
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection, so try once more on a new connection
+                connection.close()
+                connection, reused = self.__get_connection(key, new=True)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            response_body = response.read()
+        except (OSError, http.client.HTTPException) as err:
+            connection.close()
+            raise URLError(err)
+        if response.will_close:
+            connection.close()
+        else:
+            self.__release_connection(key, connection)
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return response_body
+
+    def __get_connection(self, key: ConnectionKey, new=False) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            if self.pid != os.getpid():
+                # Connections can't be shared with a forked process, so forget (without closing) the parent's
+                self.idle_connections.clear()
+                self.pid = os.getpid()
+            if not new and self.idle_connections[key]:
+                return self.idle_connections[key].pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            connection = http.client.HTTPSConnection(netloc, timeout=self.connect_timeout, context=self.ssl_context)
+        else:
+            connection = http.client.HTTPConnection(netloc, timeout=self.connect_timeout)
+        try:
+            connection.connect()
+        except OSError as err:
+            connection.close()
+            raise URLError(err)
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def __release_connection(self, key: ConnectionKey, connection: http.client.HTTPConnection):
+        with self.lock:
+            if len(self.idle_connections[key]) < self.max_idle_connections:
+                self.idle_connections[key].append(connection)
+                return
+        connection.close()
@@ -11,10 +11,12 @@ from trigger.common import Exposure
 from trigger.drstrigger import DrsTrigger
 from trigger.exposureconfig import SpirouExposureConfig
 from trigger.fileselector import FileSelector
-from .dbinterface import DatabaseHeaderConverter, QsoDatabase
+from .dbinterface import DatabaseHeaderConverter, ExposureStatusCache, QsoDatabase
+from .dboutbox import DatabaseOutbox
 from .director import director_message
-from .distribution import ProductDistributorFactory, distribute_raw_file
+from .distribution import ProductDistributorFactory, distribute_raw_file, recover_raw_distribution
 from .fileselector import CfhtFileSelector
+from .pathconfig import DATABASE_OUTBOX
 from .sessionlink import setup_symlink
 from .steps import CfhtStep
 
@@ -26,6 +28,8 @@ class CfhtHandler(ICustomHandler):
         self.director_warnings = realtime
         self.updating_database = CfhtStep.DATABASE in steps and not trace
         self.distributing_raw = CfhtStep.DISTRAW in steps and not trace
+        if self.distributing_raw:
+            recover_raw_distribution()
         distribute = CfhtStep.DISTRIBUTE in steps
         distql = CfhtStep.DISTQL in steps
         if distribute and distql:
@@ -33,6 +37,8 @@ class CfhtHandler(ICustomHandler):
         distributing_products = (distribute or distql) and not trace
         self.distributor_factory = ProductDistributorFactory(distql or realtime, distributing_products)
         self.database = QsoDatabase() if distributing_products or self.updating_database else None
+        self.exposure_statuses = ExposureStatusCache(self.database) if distributing_products else None
+        self.database_outbox = DatabaseOutbox(self.database, Path(DATABASE_OUTBOX)) if self.updating_database else None
         self.realtime = realtime
 
     def handle_recipe_failure(self, error: RecipeFailure):
@@ -45,40 +51,45 @@ class CfhtHandler(ICustomHandler):
         ignore_error = error.command_string.startswith(ignore_modules)
         ignore_error = True
         if self.director_warnings and not ignore_error:
-            director_message(str(error), level='warning')
+            recipe = error.command_string.split()[0] if error.command_string else error.reason
+            director_message(str(error), level='warning', key='failures of ' + recipe)
 
     def exposure_pre_process(self, exposure: Exposure):
         if self.distributing_raw:
-            distribute_raw_file(exposure.raw)
+            self.checkpoints.run(exposure, 'distribute raw', distribute_raw_file, exposure.raw)
 
     def exposure_preprocess_done(self, exposure: Exposure):
         if self.updating_database:
-            self.__update_db_with_headers(exposure.odometer, exposure.preprocessed, preprocessed_only=True)
+            self.checkpoints.run(exposure, 'database preprocessed', self.__update_db_with_headers, exposure.odometer,
+                                 exposure.preprocessed, preprocessed_only=True)
 
     def exposure_post_process(self, exposure: Exposure, result: Dict):
         config = SpirouExposureConfig.from_file(exposure.preprocessed)
         if config.object:
             if self.updating_database:
-                self.__update_db_with_headers(exposure.odometer, result.get('extracted_path'), result.get('ccf_path'))
-            if self.database:
-                exposure_status = self.database.get_exposure(exposure.odometer)
+                self.checkpoints.run(exposure, 'database', self.__update_db_with_headers, exposure.odometer,
+                                     result.get('extracted_path'), result.get('ccf_path'))
+            if self.exposure_statuses:
+                exposure_status = self.exposure_statuses.get_exposure(exposure.odometer)
             else:
                 exposure_status = None
             distributor = self.distributor_factory.get_exposure_distributor(exposure_status)
-            distributor.distribute_product(exposure, 'e')
-            distributor.distribute_product(exposure, 's')
+            letters = ['e', 's']
             if result.get('is_telluric_corrected'):
-                distributor.distribute_product(exposure, 't')
+                letters.append('t')
             if result.get('is_ccf_calculated'):
-                distributor.distribute_product(exposure, 'v')
+                letters.append('v')
+            for letter in letters:
+                self.checkpoints.run(exposure, 'distribute ' + letter, distributor.distribute_product, exposure, letter)
 
     def sequence_post_process(self, sequence: Sequence[Exposure], result: Dict):
         config = SpirouExposureConfig.from_file(sequence[0].preprocessed)
         if config.object and config.object.instrument_mode.is_polarimetry():
             # TODO: this needs to use a list of obsids rather than range, order and gapless-ness not guaranteed
             if result.get('is_polar_done'):
-                if self.database:
-                    exposures_status = self.database.get_exposure_range(sequence[0].odometer, sequence[-1].odometer)
+                if self.exposure_statuses:
+                    exposures_status = self.exposure_statuses.get_exposure_range(sequence[0].odometer,
+                                                                                 sequence[-1].odometer)
                 else:
                     exposures_status = None
                 distributor = self.distributor_factory.get_sequence_distributor(exposures_status)
@@ -92,6 +103,12 @@ class CfhtHandler(ICustomHandler):
                 calibrations_complete = result.get('calibrations_complete')
                 # TODO: fire off calibrations done processing notices
 
+    def prefetch_exposure_statuses(self, exposures: Iterable[Exposure]):
+        if self.exposure_statuses:
+            odometers = [exposure.odometer for exposure in exposures if exposure.obsid.endswith('o')]
+            if odometers:
+                self.exposure_statuses.prefetch(min(odometers), max(odometers))
+
     def __update_db_with_headers(self, odometer: int, path: Path, ccf_path: Path = None, preprocessed_only=False):
         if not self.updating_database:
             return
@@ -108,7 +125,7 @@ class CfhtHandler(ICustomHandler):
                     db_headers.update(DatabaseHeaderConverter.ccf_header_to_db(hdu_list[1].header))
         except FileNotFoundError as err:
             log.warning('File not found during database update: %s', err.filename)
-        self.database.send_pipeline_headers(db_headers, in_progress=preprocessed_only)
+        self.database_outbox.add(db_headers, in_progress=preprocessed_only)
 
 
 class CfhtDrsTrigger(DrsTrigger):
@@ -123,6 +140,10 @@ class CfhtDrsTrigger(DrsTrigger):
         handler = CfhtHandler(realtime, trace, steps)
         super().__init__(steps, trace, handler)
 
+    def reduce(self, exposures_in_order: Iterable[Exposure]):
+        self.custom_handler.prefetch_exposure_statuses(exposures_in_order)
+        super().reduce(exposures_in_order)
+
     def exposure_from_path(self, path: Path) -> Exposure:
         return setup_symlink(path)
 
@@ -1,12 +1,12 @@
-import json
+import time
 from collections import defaultdict, OrderedDict
-from typing import Dict, Mapping, List, Union, Tuple, Collection
+from typing import Dict, Mapping, List, Optional, Union, Tuple, Collection
 from urllib.error import URLError
-from urllib.request import Request, urlopen
 
 from astropy.io import fits
 
 from logger import log
+from .apiclient import ApiClient
 
 FitsHeaderValue = Union[str, int, float, complex, bool]
 FitsHeaderCard = Union[FitsHeaderValue, Tuple[FitsHeaderValue, str]]
@@ -14,10 +14,14 @@ FitsHeaderDict = Dict[str, FitsHeaderCard]
 JsonObj = Mapping[str, any]
 
 KEY_FILE = '/h/spirou/bin/.cfht_access'
+API_REQUESTS_PER_SECOND = 5
+
+api_client = ApiClient(requests_per_second=API_REQUESTS_PER_SECOND)
 
 
 class QsoDatabase:
-    def __init__(self):
+    def __init__(self, client: Optional[ApiClient] = None):
+        self.client = client if client is not None else api_client
         try:
             with open(KEY_FILE, 'r') as file_read:
                 self.bearer_token = file_read.read().strip()
@@ -29,6 +33,12 @@ class QsoDatabase:
         if not self.bearer_token:
             log.warning('No bearer token loaded, cannot send values to the database')
             return
+        try:
+            self.post_pipeline_headers(header_dict, in_progress, retries=2)
+        except URLError:
+            log.error('Error sending values %s to database', header_dict, exc_info=True)
+
+    def post_pipeline_headers(self, header_dict: FitsHeaderDict, in_progress=False, retries=0):
         data = {
             'bearer_token': self.bearer_token,
             **header_dict
@@ -36,10 +46,7 @@ class QsoDatabase:
         url = 'https://op-api.cfht.hawaii.edu/op-cli/op-spirou-update-pipeline'
         if in_progress:
             url = url + "-in-progress"
-        try:
-            self.json_request(url, data, retries=2)
-        except URLError:
-            log.error('Error sending values %s to database', header_dict, exc_info=True)
+        self.json_request(url, data, retries=retries)
 
     def get_exposure(self, obsid: int) -> JsonObj:
         result = self.get_exposure_range(obsid, obsid)
@@ -57,30 +64,117 @@ class QsoDatabase:
         except URLError:
             log.error('Error fetching exposures for obsid range %s-%s', first, last, exc_info=True)
 
+    def get_exposure_range_by_obsid(self, first: int, last: int) -> Optional[Dict[int, JsonObj]]:
+        try:
+            exposures = self.get_exposures({
+                'obsid_range': {
+                    'first': first,
+                    'last': last
+                }
+            })
+        except URLError:
+            log.error('Error fetching exposures for obsid range %s-%s', first, last, exc_info=True)
+            return None
+        if first == last:
+            return {first: exposures[0]['exposure_status']} if exposures else {}
+        statuses = {}
+        for exposure in exposures:
+            obsid = exposure.get('obsid', exposure['exposure_status'].get('obsid'))
+            if obsid is None:
+                # Without an obsid the statuses can't be matched up to the range, so ask for each obsid separately
+                log.warning('Exposure statuses missing obsid, fetching obsids %s-%s one at a time', first, last)
+                return self.__get_exposures_by_obsid(first, last)
+            if first <= int(obsid) <= last:
+                statuses[int(obsid)] = exposure['exposure_status']
+        return statuses
+
+    def __get_exposures_by_obsid(self, first: int, last: int) -> Dict[int, JsonObj]:
+        statuses = {}
+        for obsid in range(first, last + 1):
+            status = self.get_exposure(obsid)
+            if status is not None:
+                statuses[obsid] = status
+        return statuses
+
     def get_exposures_status(self, request_data: JsonObj) -> List[JsonObj]:
+        return [exposure['exposure_status'] for exposure in self.get_exposures(request_data)]
+
+    def get_exposures(self, request_data: JsonObj) -> List[JsonObj]:
         if not self.bearer_token:
             log.warning('No bearer token loaded, cannot fetch values from the database')
             return []
         auth_headers = {'Authorization': 'Bearer ' + self.bearer_token}
         url = 'https://api.cfht.hawaii.edu/op/exposures'
         response_data = self.json_request(url, request_data, headers=auth_headers, retries=2)
-        return [exposure['exposure_status'] for exposure in response_data['exposure']]
+        return response_data['exposure']
+
+    def json_request(self, url: str, data: JsonObj, headers: Mapping[str, str] = None, retries=0) -> JsonObj:
+        return self.client.json_request(url, data, headers=headers, retries=retries)
+
+
+class ExposureStatusCache:
+    """
+    In-memory cache of QSO exposure statuses, keyed by obsid.
+
+    Lookups are served from memory until an entry is older than the TTL. Missing or stale entries are fetched in bulk
+    with a single obsid_range request, which also refreshes any other stale entries near the requested range. Obsids
+    that the database has no exposure for are remembered for a shorter time, since they may appear later.
+    """
+
+    def __init__(self, database: QsoDatabase, ttl: float = 600.0, missing_ttl: float = 60.0, max_span: int = 1000):
+        """
+        :param database: The database to fetch exposure statuses from
+        :param ttl: How long, in seconds, a fetched status is served from memory
+        :param missing_ttl: How long, in seconds, to remember that an obsid had no status
+        :param max_span: How far outside a requested range stale entries are refreshed along with it
+        """
+        self.database = database
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.max_span = max_span
+        self.entries: Dict[int, Tuple[float, Optional[JsonObj]]] = {}
+
+    def prefetch(self, first: int, last: int):
+        """
+        Fetches the statuses for a whole range of obsids (e.g. a night) with a single request.
+        """
+        self.__fetch(first, last)
+
+    def get_exposure(self, obsid: int) -> Optional[JsonObj]:
+        result = self.get_exposure_range(obsid, obsid)
+        if result:
+            return result[0]
 
-    @staticmethod
-    def json_request(url: str, data: JsonObj, headers: Mapping[str, str] = None, retries=0) -> JsonObj:
-        http_headers = {'Content-Type': 'application/json'}
-        if headers:
-            http_headers.update(headers)
-        json_data = json.dumps(data)
-        request = Request(url, json_data.encode('utf-8'), http_headers)
-        for attempt in range(retries + 1):
-            try:
-                response = urlopen(request)
-            except URLError:
-                if attempt == retries:
-                    raise
+    def get_exposure_range(self, first: int, last: int) -> List[JsonObj]:
+        if not all(self.__is_fresh(obsid) for obsid in range(first, last + 1)):
+            self.__refresh(first, last)
+        statuses = (self.entries.get(obsid, (None, None))[1] for obsid in range(first, last + 1))
+        return [status for status in statuses if status is not None]
+
+    def __is_fresh(self, obsid: int) -> bool:
+        entry = self.entries.get(obsid)
+        if entry is None:
+            return False
+        fetch_time, status = entry
+        ttl = self.ttl if status is not None else self.missing_ttl
+        return time.monotonic() - fetch_time < ttl
+
+    def __refresh(self, first: int, last: int):
+        for obsid in [obsid for obsid in self.entries if not self.__is_fresh(obsid)]:
+            if first - self.max_span <= obsid <= last + self.max_span:
+                first, last = min(first, obsid), max(last, obsid)
             else:
-                return json.loads(response.read().decode('utf-8'))
+                del self.entries[obsid]
+        self.__fetch(first, last)
+
+    def __fetch(self, first: int, last: int):
+        statuses = self.database.get_exposure_range_by_obsid(first, last)
+        if statuses is None:
+            # Keep serving stale entries if the database can't be reached
+            return
+        fetch_time = time.monotonic()
+        for obsid in range(first, last + 1):
+            self.entries[obsid] = (fetch_time, statuses.get(obsid))
 
 
 class DatabaseHeaderConverter:
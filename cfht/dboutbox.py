@@ -0,0 +1,219 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+from urllib.error import URLError
+
+from logger import log
+from .dbinterface import FitsHeaderDict, QsoDatabase
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pipeline_updates (
+    obsid TEXT PRIMARY KEY,
+    headers TEXT NOT NULL,
+    in_progress INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0
+)
+'''
+
+
+class PendingUpdate(NamedTuple):
+    obsid: str
+    headers: FitsHeaderDict
+    in_progress: bool
+    version: int
+    attempts: int
+
+
+class DatabaseOutbox:
+    """
+    Durable outbox for pipeline header updates sent to the QSO database.
+
+    Updates are written to a local SQLite file and sent by a background thread, so callers never wait on the network.
+    Updates for the same obsid which have not been sent yet are merged into one, and failed updates stay in the outbox
+    and are retried with exponential backoff, including by any later process using the same outbox file. Rows being
+    sent are leased so that several processes can share one outbox without sending the same update twice.
+
+    The sender thread exits once nothing is due within max_wait seconds, so a process with updates waiting on a long
+    backoff does not stay alive for them; they are picked up by the next sender instead.
+    """
+
+    def __init__(self, database: QsoDatabase, path: Optional[Path], background: bool = True, batch_size: int = 20,
+                 retry_delay: float = 5.0, max_retry_delay: float = 600.0, max_wait: float = 10.0,
+                 lease: float = 120.0):
+        """
+        :param database: The database to send updates to
+        :param path: The SQLite file to store pending updates in, or None to send updates synchronously
+        :param background: Whether to start a sender thread automatically when an update is added
+        :param batch_size: Maximum number of updates claimed and sent together
+        :param retry_delay: Delay in seconds before the first retry of a failed update, doubled for each retry after
+        :param max_retry_delay: Maximum delay in seconds between retries
+        :param max_wait: How long the sender thread waits for a retry to become due before exiting
+        :param lease: How long, in seconds, a claimed update is reserved for the sender which claimed it
+        """
+        self.database = database
+        self.path = path
+        self.background = background
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_wait = max_wait
+        self.lease = lease
+        self.condition = threading.Condition()
+        self.sender_running = False
+        self.wakeup = False
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with closing(self.__connect()) as connection, connection:
+                    connection.execute(SCHEMA)
+            except (OSError, sqlite3.Error) as err:
+                log.error('Failed to open database outbox %s due to %s, updates will be sent synchronously',
+                          self.path, err)
+                self.path = None
+
+    def add(self, header_dict: FitsHeaderDict, in_progress=False):
+        """
+        Adds an update to the outbox, merging it with any pending update for the same obsid.
+        :param header_dict: The header values to send, including the obsid
+        :param in_progress: Whether this is an in-progress update, superseded by the final one when merged whichever
+                            is added first
+        """
+        if not self.database.bearer_token:
+            log.warning('No bearer token loaded, cannot send values to the database')
+            return
+        if self.path is None:
+            self.database.send_pipeline_headers(header_dict, in_progress)
+            return
+        obsid = str(header_dict['obsid'])
+        try:
+            with closing(self.__connect()) as connection, connection:
+                connection.execute('BEGIN IMMEDIATE')
+                row = connection.execute('SELECT headers, in_progress FROM pipeline_updates WHERE obsid = ?',
+                                         (obsid,)).fetchone()
+                if row is None:
+                    connection.execute('INSERT INTO pipeline_updates (obsid, headers, in_progress) VALUES (?, ?, ?)',
+                                       (obsid, json.dumps(header_dict), in_progress))
+                elif in_progress and not row[1]:
+                    # A late in-progress update only adds values the pending final update doesn't have
+                    headers = {**header_dict, **json.loads(row[0])}
+                    connection.execute('UPDATE pipeline_updates SET headers = ?, version = version + 1 WHERE obsid = ?',
+                                       (json.dumps(headers), obsid))
+                else:
+                    headers = {**json.loads(row[0]), **header_dict}
+                    connection.execute('UPDATE pipeline_updates SET headers = ?, in_progress = ?, '
+                                       'version = version + 1, attempts = 0, next_attempt = 0 WHERE obsid = ?',
+                                       (json.dumps(headers), in_progress, obsid))
+        except sqlite3.Error as err:
+            log.error('Failed to add update for %s to database outbox due to %s, sending synchronously', obsid, err)
+            self.database.send_pipeline_headers(header_dict, in_progress)
+            return
+        if self.background:
+            self.__start_sender()
+
+    def send_pending(self) -> int:
+        """
+        Sends every update which is currently due, in batches.
+        :return: The number of updates sent successfully
+        """
+        sent = 0
+        # Updates which fail are due again after this pass started, so they are only retried on a later pass
+        started = time.time()
+        while True:
+            batch = self.__claim(started)
+            if not batch:
+                return sent
+            for update in batch:
+                if self.__send(update):
+                    sent += 1
+
+    def next_due(self) -> Optional[float]:
+        """
+        :return: The number of seconds until the next pending update is due to be sent, or None if there are none
+        """
+        if self.path is None:
+            return None
+        with closing(self.__connect()) as connection:
+            row = connection.execute('SELECT MIN(MAX(next_attempt, lease_until)) FROM pipeline_updates').fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the sender thread has finished.
+        :param timeout: Maximum time to wait in seconds, or None to wait indefinitely
+        :return: Whether the sender thread finished
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.sender_running, timeout)
+
+    def __start_sender(self):
+        with self.condition:
+            self.wakeup = True
+            self.condition.notify_all()
+            if not self.sender_running:
+                self.sender_running = True
+                threading.Thread(target=self.__run_sender, name='database-outbox').start()
+
+    def __run_sender(self):
+        try:
+            while True:
+                with self.condition:
+                    self.wakeup = False
+                try:
+                    self.send_pending()
+                    delay = self.next_due()
+                except sqlite3.Error as err:
+                    log.error('Failed to read database outbox due to %s', err)
+                    delay = None
+                with self.condition:
+                    if not self.wakeup:
+                        if delay is None or delay > self.max_wait:
+                            return
+                        self.condition.wait(delay)
+        finally:
+            with self.condition:
+                self.sender_running = False
+                self.condition.notify_all()
+
+    def __claim(self, due_by: float) -> List[PendingUpdate]:
+        now = time.time()
+        with closing(self.__connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute('SELECT obsid, headers, in_progress, version, attempts FROM pipeline_updates '
+                                      'WHERE next_attempt <= ? AND lease_until <= ? ORDER BY next_attempt LIMIT ?',
+                                      (due_by, now, self.batch_size)).fetchall()
+            connection.executemany('UPDATE pipeline_updates SET lease_until = ? WHERE obsid = ?',
+                                   [(now + self.lease, row[0]) for row in rows])
+        return [PendingUpdate(obsid, json.loads(headers), bool(in_progress), version, attempts)
+                for obsid, headers, in_progress, version, attempts in rows]
+
+    def __send(self, update: PendingUpdate) -> bool:
+        try:
+            self.database.post_pipeline_headers(update.headers, in_progress=update.in_progress)
+        except (URLError, ValueError) as err:
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** update.attempts)
+            log.warning('Error sending values %s to database (%s), retrying in %.0f s', update.headers, err, delay)
+            with closing(self.__connect()) as connection, connection:
+                connection.execute('UPDATE pipeline_updates SET attempts = attempts + 1, next_attempt = ? '
+                                   'WHERE obsid = ? AND version = ?',
+                                   (time.time() + delay, update.obsid, update.version))
+                connection.execute('UPDATE pipeline_updates SET lease_until = 0 WHERE obsid = ?', (update.obsid,))
+            return False
+        with closing(self.__connect()) as connection, connection:
+            deleted = connection.execute('DELETE FROM pipeline_updates WHERE obsid = ? AND version = ?',
+                                         (update.obsid, update.version)).rowcount
+            if not deleted:
+                # Newer values were merged in while this update was being sent, so they still need to go out
+                connection.execute('UPDATE pipeline_updates SET lease_until = 0 WHERE obsid = ?', (update.obsid,))
+        return True
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
@@ -1,8 +1,195 @@
-import subprocess
+import os
+import socket
+import threading
+import time
+from collections import deque
+from multiprocessing.util import Finalize
+from typing import Deque, Dict, Optional, Tuple
 
+from logger import log
+from .ratelimiter import RateLimiter
 
-def director_message(message: str, level: str = None):
+DIRECTOR_HOST = 'spirou-session'
+DIRECTOR_PORT = 20140
+
+director_client: Optional[Tuple[int, 'DirectorClient']] = None
+
+
+class CoalescingWindow:
+    def __init__(self, start: float, level: Optional[str]):
+        self.start = start
+        self.level = level
+        self.suppressed = 0
+        self.last_message: Optional[str] = None
+
+
+class DirectorClient:
+    """
+    Sends messages to the director over one persistent socket connection, from a background thread so callers never
+    wait on the network.
+
+    Messages are rate limited, and repeats of a message key within a coalescing window are held back and summarized in
+    a single message at the end of the window (e.g. "failures of cal_ccf (4 more in last 60 s)"). Each process has its
+    own client, so both only apply to the messages of one process: repeats sent from different realtime workers are
+    not coalesced. Delivery is best effort: if the director can't be reached, messages are logged and dropped.
+    """
+
+    def __init__(self, host: str = DIRECTOR_HOST, port: int = DIRECTOR_PORT, messages_per_second: float = 1.0,
+                 burst: int = 5, coalesce_window: float = 60.0, timeout: float = 5.0, reconnect_delay: float = 30.0):
+        """
+        :param host: The director host
+        :param port: The director port
+        :param messages_per_second: Maximum sustained rate of messages sent
+        :param burst: Number of messages that can be sent at once before the rate limit applies
+        :param coalesce_window: How long, in seconds, repeats of a message key are summarized rather than sent
+        :param timeout: Timeout in seconds for connecting and sending
+        :param reconnect_delay: How long to wait before trying to connect again after a connection failure
+        """
+        self.address = (host, port)
+        self.limiter = RateLimiter(messages_per_second, burst)
+        self.coalesce_window = coalesce_window
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.condition = threading.Condition()
+        self.outgoing: Deque[str] = deque()
+        self.windows: Dict[str, CoalescingWindow] = {}
+        self.connection: Optional[socket.socket] = None
+        self.connect_after = 0.0
+        self.closing = False
+        self.sender: Optional[threading.Thread] = None
+        # Pool workers exit without running atexit handlers, but do run multiprocessing finalizers
+        Finalize(self, self.close, exitpriority=10)
+
+    def send(self, message: str, level: Optional[str] = None, key: Optional[str] = None):
+        """
+        Queues a message to be sent to the director.
+        :param message: The message to send
+        :param level: The message level (e.g. warning), prefixed to the message
+        :param key: Messages with the same key are coalesced, defaults to the message itself
+        """
+        key = key if key is not None else message
+        now = time.monotonic()
+        with self.condition:
+            window = self.windows.get(key)
+            if window is None or now - window.start >= self.coalesce_window:
+                if window is not None and window.suppressed:
+                    self.outgoing.append(self.__summary(key, window))
+                self.windows[key] = CoalescingWindow(now, level)
+                self.outgoing.append(format_message(message, level))
+            else:
+                window.suppressed += 1
+                window.last_message = message
+            self.__start_sender()
+            self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until all queued messages have been sent. Summaries of coalesced messages are only sent when their
+        windows end, or when the client is closed.
+        :return: Whether the queue was emptied
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.outgoing, timeout)
+
+    def close(self, timeout: float = 5.0):
+        """
+        Sends all queued messages and pending summaries immediately, then closes the connection.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+            sender = self.sender
+        if sender is not None:
+            sender.join(timeout)
+
+    def __start_sender(self):
+        if self.sender is None or not self.sender.is_alive():
+            self.closing = False
+            self.sender = threading.Thread(target=self.__run_sender, name='director-client', daemon=True)
+            self.sender.start()
+
+    def __run_sender(self):
+        while True:
+            with self.condition:
+                while not self.outgoing:
+                    self.__queue_summaries()
+                    if self.outgoing:
+                        break
+                    if self.closing or not self.windows:
+                        self.__disconnect()
+                        self.condition.notify_all()
+                        return
+                    next_end = min(window.start for window in self.windows.values()) + self.coalesce_window
+                    self.condition.wait(max(0.0, next_end - time.monotonic()))
+                command = self.outgoing[0]
+                closing = self.closing
+            if not closing:
+                self.limiter.acquire()
+            self.__write(command)
+            with self.condition:
+                self.outgoing.popleft()
+                self.condition.notify_all()
+
+    def __queue_summaries(self):
+        now = time.monotonic()
+        expired = [key for key, window in self.windows.items()
+                   if self.closing or now - window.start >= self.coalesce_window]
+        for key in expired:
+            window = self.windows.pop(key)
+            if window.suppressed:
+                self.outgoing.append(self.__summary(key, window))
+
+    def __summary(self, key: str, window: CoalescingWindow) -> str:
+        message = '{} ({} more in last {:.0f} s), latest: {}'.format(key, window.suppressed, self.coalesce_window,
+                                                                  window.last_message)
+        return format_message(message, window.level)
+
+    def __write(self, command: str):
+        data = command.encode('ascii', errors='replace')
+        for _ in range(2):
+            connection = self.__connect()
+            if connection is None:
+                break
+            try:
+                connection.sendall(data)
+                return
+            except OSError as err:
+                # The director may have closed an idle connection, so reconnect once before giving up
+                log.debug('Director connection lost: %s', err)
+                self.__disconnect()
+        log.warning('Failed to send director message: %s', command.strip())
+
+    def __connect(self) -> Optional[socket.socket]:
+        if self.connection is None and time.monotonic() >= self.connect_after:
+            try:
+                self.connection = socket.create_connection(self.address, self.timeout)
+            except OSError as err:
+                log.warning('Failed to connect to director at %s:%s due to %s', *self.address, err)
+                self.connect_after = time.monotonic() + self.reconnect_delay
+        return self.connection
+
+    def __disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def format_message(message: str, level: Optional[str] = None) -> str:
     if level:
         message = level + ': ' + message
-    command = '@say_ ' + message + '\n'
-    subprocess.run(['nc', '-q', '0', 'spirou-session', '20140'], input=command, encoding='ascii')
+    return '@say_ ' + message.replace('\n', ' ') + '\n'
+
+
+def get_director_client() -> DirectorClient:
+    """
+    :return: The director client for the current process, created on first use
+    """
+    global director_client
+    # The client's connection and thread do not survive a fork, so each process needs its own client
+    if director_client is None or director_client[0] != os.getpid():
+        director_client = (os.getpid(), DirectorClient())
+    return director_client[1]
+
+
+def director_message(message: str, level: str = None, key: str = None):
+    get_director_client().send(message, level, key)
@@ -1,25 +1,75 @@
+import atexit
+import os
 import shutil
 from pathlib import Path
-from threading import Thread
-from typing import Collection
+from typing import Collection, Optional, Set, Tuple
 
 from astropy.io import fits
 
 from logger import log
 from trigger.common import Exposure
-from .dbinterface import DatabaseHeaderConverter, JsonObj
-from .pathconfig import DISTRIBUTION_ROOT
+from .dbinterface import DatabaseHeaderConverter, FitsHeaderDict, JsonObj
+from .distributionmanifest import DistributionManifest
+from .distributionqueue import DistributionQueue
+from .headerpatch import patch_primary_header, read_primary_header
+from .pathconfig import DISTRIBUTION_ROOT, DISTRIBUTION_SPOOL
+
+RAW_DISTRIBUTION_WORKERS = 2
+RAW_DISTRIBUTION_BYTES_PER_SECOND = 100 * 1024 * 1024  # Per process, shared between its workers
+
+created_distribution_directories: Set[Path] = set()
+raw_distribution_queue: Optional[Tuple[int, DistributionQueue]] = None
 
 
 def get_distribution_path(source: Path, run_id: str, distribution_subdirectory: str) -> Path:
     distribution_dir = Path(DISTRIBUTION_ROOT, run_id.lower(), distribution_subdirectory)
-    try:
-        distribution_dir.mkdir(parents=True, exist_ok=True)
-    except OSError as err:
-        log.error('Failed to create distribution directory %s due to', str(distribution_dir), str(err))
+    if distribution_dir not in created_distribution_directories:
+        try:
+            distribution_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as err:
+            log.error('Failed to create distribution directory %s due to %s', str(distribution_dir), str(err))
+        else:
+            created_distribution_directories.add(distribution_dir)
     return Path(distribution_dir, source.name)
 
 
+def get_raw_distribution_queue() -> DistributionQueue:
+    """
+    :return: The raw distribution queue for the current process, created (and recovering any copies left pending by
+             processes that have died) on first use
+    """
+    global raw_distribution_queue
+    # The queue's threads do not survive a fork, so each process needs its own queue
+    if raw_distribution_queue is None or raw_distribution_queue[0] != os.getpid():
+        distribution_queue = DistributionQueue(Path(DISTRIBUTION_SPOOL), RAW_DISTRIBUTION_WORKERS,
+                                               RAW_DISTRIBUTION_BYTES_PER_SECOND)
+        distribution_queue.recover()
+        raw_distribution_queue = (os.getpid(), distribution_queue)
+    return raw_distribution_queue[1]
+
+
+def recover_raw_distribution():
+    """
+    Queues the copies left pending by processes which have died, without waiting for the next raw file to distribute.
+    """
+    get_raw_distribution_queue()
+
+
+def flush_raw_distribution(timeout: Optional[float] = None) -> bool:
+    """
+    Blocks until the copies queued by the current process have finished.
+    :param timeout: Maximum time to wait in seconds, or None to wait indefinitely
+    :return: Whether the queue was fully flushed
+    """
+    if raw_distribution_queue is None or raw_distribution_queue[0] != os.getpid():
+        return True
+    return raw_distribution_queue[1].flush(timeout)
+
+
+# Worker processes started by multiprocessing skip atexit, but wait for the copy threads before exiting anyway
+atexit.register(flush_raw_distribution)
+
+
 def try_copy(src: Path, dest: Path) -> Path:
     try:
         return shutil.copy2(src, dest)
@@ -29,63 +79,97 @@ def try_copy(src: Path, dest: Path) -> Path:
 
 
 def distribute_raw_file(path: Path, nonblocking=True) -> Path:
-    hdulist = fits.open(path)
-    run_id = hdulist[0].header['RUNID']
+    run_id = fits.getheader(path)['RUNID']
     destination = get_distribution_path(path, run_id, 'raw')
     log.info('Distributing %s', destination)
     if nonblocking:
-        Thread(target=try_copy, args=[path, destination]).start()
+        get_raw_distribution_queue().submit(path, destination)
         return destination
     else:
         new_file = try_copy(path, destination)
         return Path(new_file)
 
 
+def rewrite_product(product: Path, header_values: FitsHeaderDict, distribution_subdirectory: str) -> Path:
+    hdulist = fits.open(product)
+    run_id = hdulist[0].header['RUNID']
+    hdulist[0].header.update(header_values)
+    destination = get_distribution_path(product, run_id, distribution_subdirectory)
+    hdulist.writeto(destination, overwrite=True)
+    return destination
+
+
+def patch_product(product: Path, header_values: FitsHeaderDict, distribution_subdirectory: str) -> Path:
+    header, _ = read_primary_header(product)
+    destination = get_distribution_path(product, header['RUNID'], distribution_subdirectory)
+    return patch_primary_header(product, destination, header_values)
+
+
 class ProductDistributorFactory:
-    def __init__(self, quicklook: bool, distribute: bool):
+    def __init__(self, quicklook: bool, distribute: bool, patch_headers: bool = True):
         self.quicklook = quicklook
         self.distribute = distribute
+        self.patch_headers = patch_headers
+        self.manifest = DistributionManifest(Path(DISTRIBUTION_ROOT)) if distribute else None
 
     def get_exposure_distributor(self, exposure_status):
-        return ExposureProductDistributor(self.distribute, self.quicklook, exposure_status)
+        return ExposureProductDistributor(self.distribute, self.quicklook, exposure_status, self.patch_headers,
+                                          self.manifest)
 
     def get_sequence_distributor(self, exposure_statuses):
-        return SequenceProductDistributor(self.distribute, self.quicklook, exposure_statuses)
+        return SequenceProductDistributor(self.distribute, self.quicklook, exposure_statuses, self.patch_headers,
+                                          self.manifest)
 
 
 class ProductDistributor:
-    def __init__(self, distribute: bool, quicklook: bool):
+    def __init__(self, distribute: bool, quicklook: bool, patch_headers: bool = True,
+                 manifest: Optional[DistributionManifest] = None):
+        """
+        :param distribute: Whether products should be distributed at all
+        :param quicklook: Whether to distribute to the quicklook rather than the reduced subdirectory
+        :param patch_headers: Whether to copy the data unchanged and only rewrite the primary header, rather than
+                              writing out the whole product again
+        :param manifest: Manifest of distributed products, used to skip products which are already distributed with
+                         the same header values
+        """
         self.distribute = distribute
         self.quicklook = quicklook
+        self.patch_headers = patch_headers
+        self.manifest = manifest
         self.header_values = {}
 
     def distribute_product(self, exposure: Exposure, product_letter: str):
         if self.distribute:
             subdir = 'quicklook' if self.quicklook else 'reduced'
             file = exposure.final_product(product_letter)
+            distribute_function = patch_product if self.patch_headers else rewrite_product
             try:
-                hdulist = fits.open(file)
-                run_id = hdulist[0].header['RUNID']
-                hdulist[0].header.update(self.header_values)
-                destination = get_distribution_path(file, run_id, subdir)
-                hdulist.writeto(destination, overwrite=True)
+                source_stat = file.stat()
+                if self.manifest and self.manifest.is_current(file, subdir, self.header_values, source_stat):
+                    log.info('Skipping distribution of %s, unchanged since last distributed', file)
+                    return
+                destination = distribute_function(file, self.header_values, subdir)
             except FileNotFoundError as err:
                 log.error('Distribution of %s failed: unable to open file %s', file, err.filename)
             except Exception:
                 log.error('Distribution of %s failed', file, exc_info=True)
             else:
                 log.info('Distributing %s', destination)
+                if self.manifest:
+                    self.manifest.record(file, subdir, destination, self.header_values, source_stat)
 
 
 class ExposureProductDistributor(ProductDistributor):
-    def __init__(self, distribute: bool, quicklook: bool, exposure_status: JsonObj):
-        super().__init__(distribute, quicklook)
+    def __init__(self, distribute: bool, quicklook: bool, exposure_status: JsonObj, patch_headers: bool = True,
+                 manifest: Optional[DistributionManifest] = None):
+        super().__init__(distribute, quicklook, patch_headers, manifest)
         if exposure_status:
             self.header_values = DatabaseHeaderConverter.exp_status_db_to_header(exposure_status)
 
 
 class SequenceProductDistributor(ProductDistributor):
-    def __init__(self, distribute: bool, quicklook: bool, exposure_statuses: Collection[JsonObj]):
-        super().__init__(distribute, quicklook)
+    def __init__(self, distribute: bool, quicklook: bool, exposure_statuses: Collection[JsonObj],
+                 patch_headers: bool = True, manifest: Optional[DistributionManifest] = None):
+        super().__init__(distribute, quicklook, patch_headers, manifest)
         if exposure_statuses:
             self.header_values = DatabaseHeaderConverter.seq_status_db_to_header(exposure_statuses)
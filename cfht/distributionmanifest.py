@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Optional
+
+from logger import log
+from .dbinterface import FitsHeaderDict
+
+MANIFEST_NAME = '.distribution-manifest.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    source TEXT NOT NULL,
+    subdirectory TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    header_values TEXT NOT NULL,
+    PRIMARY KEY (source, subdirectory)
+)
+'''
+
+
+class DistributionManifest:
+    """
+    Record of the products distributed under a distribution root, used to skip redistributing products when neither
+    the product file nor the header values it was distributed with have changed.
+
+    Each entry stores the source path, size and modification time at the time it was distributed, the destination,
+    and the header values applied to it. The manifest is a SQLite file in the distribution root, so it can be shared
+    by several processes distributing to the same root.
+    """
+
+    def __init__(self, root: Path):
+        """
+        :param root: The distribution root the manifest belongs to
+        """
+        self.path: Optional[Path] = Path(root, MANIFEST_NAME)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(self.__connect()) as connection, connection:
+                connection.execute(SCHEMA)
+        except (OSError, sqlite3.Error) as err:
+            log.error('Failed to open distribution manifest %s due to %s, all products will be distributed',
+                      self.path, err)
+            self.path = None
+
+    def is_current(self, source: Path, subdirectory: str, header_values: FitsHeaderDict,
+                   source_stat: os.stat_result) -> bool:
+        """
+        :param source: The product file
+        :param subdirectory: The distribution subdirectory the product is distributed to
+        :param header_values: The header values the product would be distributed with
+        :param source_stat: The current stat of the product file
+        :return: Whether the product was already distributed from the same file with the same header values
+        """
+        if self.path is None:
+            return False
+        try:
+            with closing(self.__connect()) as connection:
+                row = connection.execute('SELECT destination, size, mtime_ns, header_values FROM products '
+                                         'WHERE source = ? AND subdirectory = ?',
+                                         (str(source), subdirectory)).fetchone()
+        except sqlite3.Error as err:
+            log.warning('Failed to read distribution manifest %s due to %s', self.path, err)
+            return False
+        if row is None:
+            return False
+        destination, size, mtime_ns, recorded_values = row
+        return (size == source_stat.st_size and mtime_ns == source_stat.st_mtime_ns and
+                recorded_values == serialize_header_values(header_values) and os.path.exists(destination))
+
+    def record(self, source: Path, subdirectory: str, destination: Path, header_values: FitsHeaderDict,
+               source_stat: os.stat_result):
+        """
+        Records that a product was distributed.
+        :param source: The product file
+        :param subdirectory: The distribution subdirectory the product was distributed to
+        :param destination: The distributed file
+        :param header_values: The header values the product was distributed with
+        :param source_stat: The stat of the product file taken before it was distributed
+        """
+        if self.path is None:
+            return
+        try:
+            with closing(self.__connect()) as connection, connection:
+                connection.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)',
+                                   (str(source), subdirectory, str(destination), source_stat.st_size,
+                                    source_stat.st_mtime_ns, serialize_header_values(header_values)))
+        except sqlite3.Error as err:
+            log.warning('Failed to update distribution manifest %s due to %s', self.path, err)
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30)
+
+
+def serialize_header_values(header_values: FitsHeaderDict) -> str:
+    return json.dumps(header_values, sort_keys=True, default=str)
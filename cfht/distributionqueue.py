@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import deque
+from pathlib import Path
+from threading import Condition, Thread
+from typing import Deque, NamedTuple, Optional, Tuple
+
+from logger import log
+from .ratelimiter import RateLimiter
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class CopyJob(NamedTuple):
+    source: Path
+    destination: Path
+
+
+class DistributionQueue:
+    """
+    Copies files in the background using a bounded number of worker threads, optionally limited to a total throughput.
+
+    Each queued copy is also recorded as a file in a spool directory until it completes, so copies which were pending
+    when a process died can be picked up again by recover(). Worker threads are not daemons, so a process (including a
+    multiprocessing pool worker) will not exit until all of its queued copies are done, and flush() can be used to
+    wait for them explicitly.
+    """
+
+    def __init__(self, spool_directory: Optional[Path], max_workers: int = 2,
+                 max_bytes_per_second: Optional[float] = None):
+        """
+        :param spool_directory: Directory used to persist pending copies, or None to only keep them in memory
+        :param max_workers: Maximum number of copies that can run at the same time
+        :param max_bytes_per_second: Combined throughput limit for all copies, or None for no limit
+        """
+        self.spool_directory = spool_directory
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(max_bytes_per_second, CHUNK_SIZE) if max_bytes_per_second else None
+        self.condition = Condition()
+        self.pending: Deque[Tuple[CopyJob, Optional[Path]]] = deque()
+        self.active_workers = 0
+        if self.spool_directory is not None:
+            try:
+                self.spool_directory.mkdir(parents=True, exist_ok=True)
+            except OSError as err:
+                log.error('Failed to create distribution spool directory %s due to %s', self.spool_directory, err)
+                self.spool_directory = None
+
+    def submit(self, source: Path, destination: Path):
+        """
+        Queues a file to be copied.
+        :param source: The file to copy
+        :param destination: The path to copy the file to
+        """
+        job = CopyJob(Path(source), Path(destination))
+        self.__enqueue(job, self.__spool(job))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until every queued copy has finished.
+        :param timeout: Maximum time to wait in seconds, or None to wait indefinitely
+        :return: Whether the queue was fully flushed
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and self.active_workers == 0, timeout)
+
+    def recover(self) -> int:
+        """
+        Queues any copies left in the spool directory by processes which are no longer running.
+        :return: The number of copies recovered
+        """
+        if self.spool_directory is None:
+            return 0
+        recovered = 0
+        for spool_file in self.spool_directory.glob('*.json'):
+            key, _, pid = spool_file.stem.rpartition('.')
+            if not pid.isdigit() or is_process_alive(int(pid)):
+                continue
+            claimed_file = spool_file.with_name(key + '.' + str(os.getpid()) + '.json')
+            try:
+                # Renaming claims the file, so if several processes try to recover it only one will succeed
+                os.rename(spool_file, claimed_file)
+                job_data = json.loads(claimed_file.read_text())
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as err:
+                log.error('Failed to recover pending distribution from %s due to %s', spool_file, err)
+                continue
+            log.info('Recovered pending distribution of %s', job_data['source'])
+            self.__enqueue(CopyJob(Path(job_data['source']), Path(job_data['destination'])), claimed_file)
+            recovered += 1
+        return recovered
+
+    def __enqueue(self, job: CopyJob, spool_file: Optional[Path]):
+        with self.condition:
+            self.pending.append((job, spool_file))
+            if self.active_workers < self.max_workers:
+                self.active_workers += 1
+                Thread(target=self.__work, name='distribution-worker').start()
+
+    def __work(self):
+        while True:
+            with self.condition:
+                if not self.pending:
+                    self.active_workers -= 1
+                    self.condition.notify_all()
+                    return
+                job, spool_file = self.pending.popleft()
+            if self.__copy(job) and spool_file is not None:
+                try:
+                    spool_file.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def __copy(self, job: CopyJob) -> bool:
+        try:
+            if self.limiter is None:
+                shutil.copy2(job.source, job.destination)
+            else:
+                with open(job.source, 'rb') as file_read, open(job.destination, 'wb') as file_write:
+                    for chunk in iter(lambda: file_read.read(CHUNK_SIZE), b''):
+                        self.limiter.acquire(len(chunk))
+                        file_write.write(chunk)
+                shutil.copystat(job.source, job.destination)
+        except OSError as err:
+            log.error('Distribution of %s failed due to %s ', str(job.source), str(err))
+            return False
+        return True
+
+    def __spool(self, job: CopyJob) -> Optional[Path]:
+        if self.spool_directory is None:
+            return None
+        key = hashlib.sha1(str(job.destination).encode('utf-8')).hexdigest()
+        spool_file = self.spool_directory.joinpath(key + '.' + str(os.getpid()) + '.json')
+        temp_file = spool_file.with_suffix('.tmp')
+        try:
+            temp_file.write_text(json.dumps({'source': str(job.source), 'destination': str(job.destination)}))
+            os.replace(temp_file, spool_file)
+        except OSError as err:
+            log.warning('Failed to record pending distribution of %s due to %s', str(job.source), str(err))
+            return None
+        return spool_file
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,141 @@
+import errno
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import BinaryIO, Tuple
+
+from astropy.io import fits
+
+from logger import log
+from .dbinterface import FitsHeaderDict
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+END_CARD = b'END'.ljust(CARD_SIZE)
+FICLONE = 0x40049409  # Linux ioctl for reflink copies (btrfs, XFS, ...)
+COPY_FALLBACK_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+def read_primary_header(file: Path) -> Tuple[fits.Header, int]:
+    """
+    Reads the primary header of a fits file without touching any of the data that follows it.
+    :param file: The fits file
+    :return: The primary header, and the size in bytes of the header blocks (i.e. the offset of the primary data)
+    """
+    header_bytes = bytearray()
+    with open(file, 'rb') as file_read:
+        while True:
+            block = file_read.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                raise ValueError('No END card found in primary header of ' + str(file))
+            header_bytes.extend(block)
+            if any(block[i:i + 8] == END_CARD[:8] for i in range(0, BLOCK_SIZE, CARD_SIZE)):
+                break
+    return fits.Header.fromstring(header_bytes.decode('ascii')), len(header_bytes)
+
+
+def serialize_header(header: fits.Header, header_size: int) -> bytes:
+    """
+    Serializes a fits header, reusing the existing header blocks if the header still fits in them.
+    When there is room, the header is padded with blank cards before the END card so the data offset is unchanged.
+    :param header: The fits header
+    :param header_size: The size in bytes of the header blocks the header is replacing
+    :return: The serialized header, padded to a whole number of fits blocks
+    """
+    cards = header.tostring(endcard=False, padding=False).encode('ascii')
+    blank_size = header_size - len(cards) - CARD_SIZE
+    if blank_size >= 0:
+        return cards + b' ' * blank_size + END_CARD
+    return header.tostring().encode('ascii')
+
+
+def patch_primary_header(source: Path, destination: Path, header_values: FitsHeaderDict) -> Path:
+    """
+    Copies a fits file, updating only the primary header. All data blocks are copied unchanged, using a reflink copy
+    when the filesystem supports it. The destination is written to a temporary file and then moved into place.
+    :param source: The fits file to copy
+    :param destination: The path to copy the file to
+    :param header_values: The cards to update in the primary header
+    :return: The destination path
+    """
+    header, header_size = read_primary_header(source)
+    header.update(header_values)
+    header_bytes = serialize_header(header, header_size)
+    temp_file = destination.with_name('.' + destination.name + '.tmp')
+    try:
+        with open(source, 'rb') as file_read, open(temp_file, 'wb') as file_write:
+            if len(header_bytes) == header_size:
+                copy_file(file_read, file_write)
+                file_write.seek(0)
+                file_write.write(header_bytes)
+            else:
+                file_write.write(header_bytes)
+                copy_file_range(file_read, file_write, header_size, len(header_bytes))
+        os.replace(temp_file, destination)
+    except BaseException:
+        try:
+            temp_file.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    return destination
+
+
+def copy_file(source: BinaryIO, destination: BinaryIO):
+    """
+    Copies the full contents of one open file to another, as a copy-on-write reflink if possible.
+    :param source: The file to copy from, opened for binary reading
+    :param destination: The empty file to copy to, opened for binary writing
+    """
+    if not reflink(source, destination):
+        copy_file_range(source, destination, 0, 0)
+
+
+def reflink(source: BinaryIO, destination: BinaryIO) -> bool:
+    """
+    Attempts to make a copy-on-write clone of a file.
+    :param source: The file to copy from, opened for binary reading
+    :param destination: The empty file to copy to, opened for binary writing
+    :return: Whether the clone succeeded
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+    except OSError as err:
+        log.debug('Reflink copy of %s not supported: %s', source.name, err)
+        return False
+    return True
+
+
+def copy_file_range(source: BinaryIO, destination: BinaryIO, source_offset: int, destination_offset: int):
+    """
+    Copies the contents of one open file, starting at an offset, to another file at an offset.
+    Uses os.copy_file_range where available, which lets the kernel avoid copying through user space (or the filesystem
+    share extents), and falls back to a buffered copy otherwise.
+    :param source: The file to copy from, opened for binary reading
+    :param destination: The file to copy to, opened for binary writing
+    :param source_offset: The position in the source file to start copying from
+    :param destination_offset: The position in the destination file to start copying to
+    """
+    destination.flush()
+    remaining = os.fstat(source.fileno()).st_size - source_offset
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining,
+                                            source_offset, destination_offset)
+                if copied == 0:
+                    break
+                source_offset += copied
+                destination_offset += copied
+                remaining -= copied
+        except OSError as err:
+            if err.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    if remaining > 0:
+        source.seek(source_offset)
+        destination.seek(destination_offset)
+        shutil.copyfileobj(source, destination)
@@ -1,2 +1,4 @@
 DISTRIBUTION_ROOT = '/data/distribution/spirou/'
 SESSION_ROOT = '/data/sessions/spirou/'
+DISTRIBUTION_SPOOL = '/data/spirou/apero/distribution-pending/'
+DATABASE_OUTBOX = '/data/spirou/apero/database-outbox.sqlite3'
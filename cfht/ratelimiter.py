@@ -0,0 +1,47 @@
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket. Each call to acquire takes tokens from the bucket, which refills at a fixed rate up to a
+    maximum burst size. Callers which overdraw the bucket sleep until it has been paid back.
+    """
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        """
+        :param rate: Tokens added per second, or None to disable rate limiting
+        :param burst: Maximum number of tokens the bucket can hold, defaults to one second's worth
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """
+        Takes tokens from the bucket, blocking until the rate limit allows them to be used.
+        :param amount: The number of tokens to take
+        """
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Takes tokens from the bucket without blocking.
+        :param amount: The number of tokens to take
+        :return: How long the caller should wait, in seconds, before using the tokens
+        """
+        if self.rate is None:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+            self.last_update = now
+            self.tokens -= amount
+            if self.tokens < 0:
+                return -self.tokens / self.rate
+            return 0
@@ -12,14 +12,25 @@ reading inputs from the APERO database.
 """
 
 import argparse
+import errno
+import http.client
 import json
 import logging
+import os
+import random
+import shutil
+import sqlite3
+import ssl
 import sys
+import threading
+import time
 from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import closing
 from pathlib import Path
-from typing import Collection, Dict, Mapping, List, Union, Tuple, Sequence, Iterable
-from urllib.error import URLError
-from urllib.request import Request, urlopen
+from typing import BinaryIO, Collection, Dict, Mapping, List, Optional, Union, Tuple, Sequence, Iterable
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
 
 from astropy.io import fits
 
@@ -34,21 +45,149 @@ PRODUCT_ROOT = '/data/spirou4/apero-data/offline/out/'
 DISTRIBUTION_ROOT = '/data/distribution/spirou/'
 KEY_FILE = '/h/spirou/bin/.cfht_access'
 
-
-def json_request(url: str, data: JsonObj, headers: Mapping[str, str] = None, retries=0) -> JsonObj:
-    http_headers = {'Content-Type': 'application/json'}
-    if headers:
-        http_headers.update(headers)
-    json_data = json.dumps(data)
-    request = Request(url, json_data.encode('utf-8'), http_headers)
-    for attempt in range(retries + 1):
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+END_CARD = b'END'.ljust(CARD_SIZE)
+FICLONE = 0x40049409  # Linux ioctl for reflink copies (btrfs, XFS, ...)
+COPY_FALLBACK_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+API_REQUESTS_PER_SECOND = 5
+MANIFEST_NAME = '.distribution-manifest.sqlite3'
+MANIFEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    source TEXT NOT NULL,
+    subdirectory TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    header_values TEXT NOT NULL,
+    PRIMARY KEY (source, subdirectory)
+)
+'''
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket, refilled at a fixed rate up to a maximum burst size.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+            self.last_update = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ApiClient:
+    """
+    JSON API client which keeps connections alive between requests, with connect/read timeouts, jittered exponential
+    backoff on retries, and an optional rate limit. Errors are raised as URLError/HTTPError like urlopen.
+    """
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, retries: int = 2,
+                 backoff: float = 0.5, max_backoff: float = 10.0, requests_per_second: Optional[float] = None,
+                 max_idle_connections: int = 4):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(requests_per_second) if requests_per_second else None
+        self.max_idle_connections = max_idle_connections
+        self.lock = threading.Lock()
+        self.idle_connections: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = defaultdict(list)
+        self.ssl_context = None
+
+    def json_request(self, url: str, data: JsonObj, headers: Mapping[str, str] = None,
+                     retries: Optional[int] = None) -> JsonObj:
+        http_headers = {'Content-Type': 'application/json'}
+        if headers:
+            http_headers.update(headers)
+        if retries is None:
+            retries = self.retries
+        body = json.dumps(data).encode('utf-8')
+        for attempt in range(retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                return json.loads(self.__attempt(url, body, http_headers).decode('utf-8'))
+            except URLError as err:
+                retryable = not isinstance(err, HTTPError) or err.code in RETRY_STATUSES
+                if attempt == retries or not retryable:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                log.warning('Request to %s failed (%s), retrying in %.1f s', url, err.reason, delay)
+                time.sleep(delay)
+
+    def __attempt(self, url: str, body: bytes, headers: Mapping[str, str]) -> bytes:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection, reused = self.__get_connection(key)
         try:
-            response = urlopen(request)
-        except URLError:
-            if attempt == retries:
-                raise
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection, so try once more on a new connection
+                connection.close()
+                connection, reused = self.__get_connection(key, new=True)
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+            response_body = response.read()
+        except (OSError, http.client.HTTPException) as err:
+            connection.close()
+            raise URLError(err)
+        if response.will_close:
+            connection.close()
+        else:
+            with self.lock:
+                idle = self.idle_connections[key]
+                if len(idle) < self.max_idle_connections:
+                    idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return response_body
+
+    def __get_connection(self, key: Tuple[str, str], new=False) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            if not new and self.idle_connections[key]:
+                return self.idle_connections[key].pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            connection = http.client.HTTPSConnection(netloc, timeout=self.connect_timeout, context=self.ssl_context)
         else:
-            return json.loads(response.read().decode('utf-8'))
+            connection = http.client.HTTPConnection(netloc, timeout=self.connect_timeout)
+        try:
+            connection.connect()
+        except OSError as err:
+            connection.close()
+            raise URLError(err)
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+
+api_client = ApiClient(requests_per_second=API_REQUESTS_PER_SECOND)
 
 
 class QsoDatabase:
@@ -76,14 +215,101 @@ class QsoDatabase:
         except URLError:
             log.error('Error fetching exposures for obsid range %s-%s', first, last, exc_info=True)
 
+    def get_exposure_range_by_obsid(self, first: int, last: int) -> Optional[Dict[int, JsonObj]]:
+        try:
+            exposures = self.get_exposures({
+                'obsid_range': {
+                    'first': first,
+                    'last': last
+                }
+            })
+        except URLError:
+            log.error('Error fetching exposures for obsid range %s-%s', first, last, exc_info=True)
+            return None
+        if first == last:
+            return {first: exposures[0]['exposure_status']} if exposures else {}
+        statuses = {}
+        for exposure in exposures:
+            obsid = exposure.get('obsid', exposure['exposure_status'].get('obsid'))
+            if obsid is None:
+                # Without an obsid the statuses can't be matched up to the range, so ask for each obsid separately
+                log.warning('Exposure statuses missing obsid, fetching obsids %s-%s one at a time', first, last)
+                return self.__get_exposures_by_obsid(first, last)
+            if first <= int(obsid) <= last:
+                statuses[int(obsid)] = exposure['exposure_status']
+        return statuses
+
+    def __get_exposures_by_obsid(self, first: int, last: int) -> Dict[int, JsonObj]:
+        statuses = {}
+        for obsid in range(first, last + 1):
+            status = self.get_exposure(obsid)
+            if status is not None:
+                statuses[obsid] = status
+        return statuses
+
     def get_exposures_status(self, request_data: JsonObj) -> List[JsonObj]:
+        return [exposure['exposure_status'] for exposure in self.get_exposures(request_data)]
+
+    def get_exposures(self, request_data: JsonObj) -> List[JsonObj]:
         if not self.bearer_token:
             log.warning('No bearer token loaded, cannot fetch values from the database')
             return []
         auth_headers = {'Authorization': 'Bearer ' + self.bearer_token}
         url = 'https://api.cfht.hawaii.edu/op/exposures'
-        response_data = json_request(url, request_data, headers=auth_headers, retries=2)
-        return [exposure['exposure_status'] for exposure in response_data['exposure']]
+        response_data = api_client.json_request(url, request_data, headers=auth_headers, retries=2)
+        return response_data['exposure']
+
+
+class ExposureStatusCache:
+    """
+    In-memory cache of QSO exposure statuses keyed by obsid, served from memory until older than the TTL.
+    Misses are fetched in bulk with one obsid_range request, which also refreshes nearby stale entries.
+    """
+
+    def __init__(self, database: QsoDatabase, ttl: float = 600.0, missing_ttl: float = 60.0, max_span: int = 1000):
+        self.database = database
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.max_span = max_span
+        self.entries: Dict[int, Tuple[float, Optional[JsonObj]]] = {}
+
+    def prefetch(self, first: int, last: int):
+        self.__fetch(first, last)
+
+    def get_exposure(self, obsid: int) -> Optional[JsonObj]:
+        result = self.get_exposure_range(obsid, obsid)
+        if result:
+            return result[0]
+
+    def get_exposure_range(self, first: int, last: int) -> List[JsonObj]:
+        if not all(self.__is_fresh(obsid) for obsid in range(first, last + 1)):
+            self.__refresh(first, last)
+        statuses = (self.entries.get(obsid, (None, None))[1] for obsid in range(first, last + 1))
+        return [status for status in statuses if status is not None]
+
+    def __is_fresh(self, obsid: int) -> bool:
+        entry = self.entries.get(obsid)
+        if entry is None:
+            return False
+        fetch_time, status = entry
+        ttl = self.ttl if status is not None else self.missing_ttl
+        return time.monotonic() - fetch_time < ttl
+
+    def __refresh(self, first: int, last: int):
+        for obsid in [obsid for obsid in self.entries if not self.__is_fresh(obsid)]:
+            if first - self.max_span <= obsid <= last + self.max_span:
+                first, last = min(first, obsid), max(last, obsid)
+            else:
+                del self.entries[obsid]
+        self.__fetch(first, last)
+
+    def __fetch(self, first: int, last: int):
+        statuses = self.database.get_exposure_range_by_obsid(first, last)
+        if statuses is None:
+            return
+        fetch_time = time.monotonic()
+        for obsid in range(first, last + 1):
+            self.entries[obsid] = (fetch_time, statuses.get(obsid))
 
 
 def exp_status_db_to_header(exposure_status: JsonObj) -> FitsHeaderDict:
@@ -118,26 +344,185 @@ def get_distribution_path(source: Path, run_id: str, distribution_subdirectory:
     return Path(distribution_dir, source.name)
 
 
-def distribute_product(product: Path, header_values: FitsHeaderDict, quicklook: bool):
+def read_primary_header(file: Path) -> Tuple[fits.Header, int]:
+    header_bytes = bytearray()
+    with open(file, 'rb') as file_read:
+        while True:
+            block = file_read.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                raise ValueError('No END card found in primary header of ' + str(file))
+            header_bytes.extend(block)
+            if any(block[i:i + 8] == END_CARD[:8] for i in range(0, BLOCK_SIZE, CARD_SIZE)):
+                break
+    return fits.Header.fromstring(header_bytes.decode('ascii')), len(header_bytes)
+
+
+def serialize_header(header: fits.Header, header_size: int) -> bytes:
+    # Pad with blank cards before END when the header still fits, so the data offset is unchanged
+    cards = header.tostring(endcard=False, padding=False).encode('ascii')
+    blank_size = header_size - len(cards) - CARD_SIZE
+    if blank_size >= 0:
+        return cards + b' ' * blank_size + END_CARD
+    return header.tostring().encode('ascii')
+
+
+def reflink(source: BinaryIO, destination: BinaryIO) -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+    except OSError:
+        return False
+    return True
+
+
+def copy_file_range(source: BinaryIO, destination: BinaryIO, source_offset: int, destination_offset: int):
+    destination.flush()
+    remaining = os.fstat(source.fileno()).st_size - source_offset
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining,
+                                            source_offset, destination_offset)
+                if copied == 0:
+                    break
+                source_offset += copied
+                destination_offset += copied
+                remaining -= copied
+        except OSError as err:
+            if err.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    if remaining > 0:
+        source.seek(source_offset)
+        destination.seek(destination_offset)
+        shutil.copyfileobj(source, destination)
+
+
+def patch_primary_header(source: Path, destination: Path, header_values: FitsHeaderDict) -> Path:
+    header, header_size = read_primary_header(source)
+    header.update(header_values)
+    header_bytes = serialize_header(header, header_size)
+    temp_file = destination.with_name('.' + destination.name + '.tmp')
+    try:
+        with open(source, 'rb') as file_read, open(temp_file, 'wb') as file_write:
+            if len(header_bytes) == header_size:
+                if not reflink(file_read, file_write):
+                    copy_file_range(file_read, file_write, 0, 0)
+                file_write.seek(0)
+                file_write.write(header_bytes)
+            else:
+                file_write.write(header_bytes)
+                copy_file_range(file_read, file_write, header_size, len(header_bytes))
+        os.replace(temp_file, destination)
+    except BaseException:
+        try:
+            temp_file.unlink()
+        except FileNotFoundError:
+            pass
+        raise
+    return destination
+
+
+def rewrite_product(product: Path, header_values: FitsHeaderDict, subdir: str) -> Path:
+    hdulist = fits.open(product)
+    run_id = hdulist[0].header['RUNID']
+    hdulist[0].header.update(header_values)
+    destination = get_distribution_path(product, run_id, subdir)
+    hdulist.writeto(destination, overwrite=True)
+    return destination
+
+
+def patch_product(product: Path, header_values: FitsHeaderDict, subdir: str) -> Path:
+    header, _ = read_primary_header(product)
+    destination = get_distribution_path(product, header['RUNID'], subdir)
+    return patch_primary_header(product, destination, header_values)
+
+
+class DistributionManifest:
+    """
+    Record of the products distributed under a distribution root (source path, size, mtime, destination and applied
+    header values), kept as a SQLite file in the root and shared with the trigger's distribution.
+    """
+
+    def __init__(self, root: Path):
+        self.path: Optional[Path] = Path(root, MANIFEST_NAME)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(self.__connect()) as connection, connection:
+                connection.execute(MANIFEST_SCHEMA)
+        except (OSError, sqlite3.Error) as err:
+            log.error('Failed to open distribution manifest %s due to %s, all products will be distributed',
+                      self.path, err)
+            self.path = None
+
+    def is_current(self, source: Path, subdirectory: str, header_values: FitsHeaderDict,
+                   source_stat: os.stat_result) -> bool:
+        if self.path is None:
+            return False
+        try:
+            with closing(self.__connect()) as connection:
+                row = connection.execute('SELECT destination, size, mtime_ns, header_values FROM products '
+                                         'WHERE source = ? AND subdirectory = ?',
+                                         (str(source), subdirectory)).fetchone()
+        except sqlite3.Error as err:
+            log.warning('Failed to read distribution manifest %s due to %s', self.path, err)
+            return False
+        if row is None:
+            return False
+        destination, size, mtime_ns, recorded_values = row
+        return (size == source_stat.st_size and mtime_ns == source_stat.st_mtime_ns and
+                recorded_values == serialize_header_values(header_values) and os.path.exists(destination))
+
+    def record(self, source: Path, subdirectory: str, destination: Path, header_values: FitsHeaderDict,
+               source_stat: os.stat_result):
+        if self.path is None:
+            return
+        try:
+            with closing(self.__connect()) as connection, connection:
+                connection.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)',
+                                   (str(source), subdirectory, str(destination), source_stat.st_size,
+                                    source_stat.st_mtime_ns, serialize_header_values(header_values)))
+        except sqlite3.Error as err:
+            log.warning('Failed to update distribution manifest %s due to %s', self.path, err)
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30)
+
+
+def serialize_header_values(header_values: FitsHeaderDict) -> str:
+    return json.dumps(header_values, sort_keys=True, default=str)
+
+
+def distribute_product(product: Path, header_values: FitsHeaderDict, quicklook: bool, patch_headers: bool = True,
+                       manifest: Optional[DistributionManifest] = None, force: bool = False):
     subdir = 'quicklook' if quicklook else 'reduced'
+    distribute_function = patch_product if patch_headers else rewrite_product
     try:
-        hdulist = fits.open(product)
-        run_id = hdulist[0].header['RUNID']
-        hdulist[0].header.update(header_values)
-        destination = get_distribution_path(product, run_id, subdir)
-        hdulist.writeto(destination, overwrite=True)
+        source_stat = product.stat()
+        if manifest and not force and manifest.is_current(product, subdir, header_values, source_stat):
+            log.debug('Skipping %s, unchanged since last distributed', product)
+            return
+        destination = distribute_function(product, header_values, subdir)
     except FileNotFoundError as err:
         log.error('Distribution of %s failed: unable to open file %s', product, err.filename)
     except Exception:
         log.error('Distribution of %s failed', product, exc_info=True)
     else:
         log.info('Distributing %s', destination)
+        if manifest:
+            manifest.record(product, subdir, destination, header_values, source_stat)
 
 
 class Distributor:
-    def __init__(self, quicklook: bool = False):
+    def __init__(self, quicklook: bool = False, patch_headers: bool = True, jobs: int = 1, force: bool = False):
         self.quicklook = quicklook
+        self.patch_headers = patch_headers
+        self.jobs = jobs
+        self.force = force
+        self.manifest = DistributionManifest(Path(DISTRIBUTION_ROOT))
         self.qso_database = QsoDatabase()
+        self.exposure_statuses = ExposureStatusCache(self.qso_database)
 
     def distribute_all_nights(self):
         nights = self.__find_nights('*')
@@ -147,33 +532,81 @@ class Distributor:
         nights = self.__find_nights(qrunid + '-*')
         self.distribute_nights(nights)
 
-    def distribute_nights(self, nights: Iterable[str]):
-        for night in nights:
-            self.distribute_night(night)
+    def distribute_nights(self, nights: Sequence[str]):
+        if self.jobs > 1:
+            self.distribute_nights_concurrently(nights)
+        else:
+            for night in nights:
+                self.distribute_night(night)
+
+    def distribute_nights_concurrently(self, nights: Sequence[str]):
+        """
+        Distributes nights using a pool of worker threads for the copies. Each night's statuses are fetched (with one
+        range request) by a separate thread while the previous night is being copied, and at most two nights of copies
+        are queued at a time.
+        """
+        if not nights:
+            return
+        with ThreadPoolExecutor(1, 'status-prefetch') as prefetcher, \
+                ThreadPoolExecutor(self.jobs, 'distribute') as pool:
+            next_night = prefetcher.submit(self.resolve_night, nights[0])
+            previous_copies, current_copies = [], []
+            for i, night in enumerate(nights):
+                night_products = next_night.result()
+                if i + 1 < len(nights):
+                    next_night = prefetcher.submit(self.resolve_night, nights[i + 1])
+                wait(previous_copies)
+                previous_copies = current_copies
+                current_copies = [pool.submit(distribute_product, product, header_values, self.quicklook,
+                                              self.patch_headers, self.manifest, self.force)
+                                  for product, header_values in night_products]
+            wait(previous_copies + current_copies)
 
     def distribute_night(self, night: str):
+        if self.jobs > 1:
+            self.distribute_nights_concurrently([night])
+            return
+        for product, header_values in self.resolve_night(night):
+            distribute_product(product, header_values, self.quicklook, self.patch_headers, self.manifest, self.force)
+
+    def resolve_night(self, night: str) -> List[Tuple[Path, FitsHeaderDict]]:
+        """
+        Finds the products for a night and the header values to distribute each with.
+        """
         log.info('Distributing night %s', night)
         night_dir = Path(PRODUCT_ROOT, night)
         products = list(sorted(file for file in night_dir.glob('*.fits') if file.exists()))
-        for product in products:
-            self.distribute_product(product)
+        self.prefetch_statuses(products)
+        return [(product, self.get_header_values(product)) for product in products]
 
     def distribute_file(self, night: str, file: str):
         product_file = Path(PRODUCT_ROOT, night, file)
         self.distribute_product(product_file)
 
+    def prefetch_statuses(self, products: Iterable[Path]):
+        odometers = []
+        for product in products:
+            try:
+                odometers.append(int(product.stem[0:-1]))
+            except ValueError:
+                log.warning('Unexpected product filename %s', product.name)
+        if odometers:
+            # p products use the statuses for the three exposures following their own odometer
+            self.exposure_statuses.prefetch(min(odometers), max(odometers) + 3)
+
     def distribute_product(self, product_file: Path):
+        distribute_product(product_file, self.get_header_values(product_file), self.quicklook, self.patch_headers,
+                           self.manifest, self.force)
+
+    def get_header_values(self, product_file: Path) -> FitsHeaderDict:
         odometer = int(product_file.stem[0:-1])
         letter = product_file.stem[-1]
-        qso_database: QsoDatabase
         if letter == 'p':
-            exposure_statuses = self.qso_database.get_exposure_range(odometer, odometer + 3)
-            header_values = seq_status_db_to_header(exposure_statuses)
-            distribute_product(product_file, header_values, self.quicklook)
+            exposure_statuses = self.exposure_statuses.get_exposure_range(odometer, odometer + 3)
+            return seq_status_db_to_header(exposure_statuses)
         else:
-            exposure_status = self.qso_database.get_exposure(odometer)
-            header_values = exp_status_db_to_header(exposure_status)
-            distribute_product(product_file, header_values, self.quicklook)
+            exposure_status = self.exposure_statuses.get_exposure(odometer)
+            return exp_status_db_to_header(exposure_status)
 
     @staticmethod
     def __find_nights(night_pattern: str) -> Sequence[str]:
@@ -196,6 +629,13 @@ if __name__ == '__main__':
     file_parser.add_argument('file')
     command_parser.add_parser('all', help='Distribute all nights')
     parser.add_argument('--quicklook', action='store_true')
+    parser.add_argument('--rewrite', action='store_true',
+                        help='Rewrite whole products instead of copying the data and patching the primary header')
+    parser.add_argument('--force', action='store_true',
+                        help='Redistribute products even if they are unchanged since they were last distributed')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of products to distribute concurrently, overlapping each night with the status '
+                             'lookup for the next')
     args = parser.parse_args()
 
     console_handler = logging.StreamHandler(sys.stdout)
@@ -203,7 +643,7 @@ if __name__ == '__main__':
     log.addHandler(console_handler)
     log.setLevel(logging.DEBUG)
 
-    distributor = Distributor(args.quicklook)
+    distributor = Distributor(args.quicklook, not args.rewrite, args.jobs, args.force)
     if args.command == 'qrunid':
         distributor.distribute_qrun(args.qrunid)
     elif args.command == 'night':
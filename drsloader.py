@@ -20,5 +20,14 @@ class DrsLoader:
             return Path(self.__config_path)
         return None
 
+    @property
+    def recipe_costs_path(self) -> Optional[Path]:
+        """
+        :return: The directory recipe running times are recorded in, shared by realtime and offline processing
+        """
+        if self.config_path:
+            return self.config_path.joinpath('.drstrigger-recipe-costs')
+        return None
+
     def get_loaded_trigger_module(self) -> ModuleType('cfht'):
         return self.cfht
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 
 import datetime
+from multiprocessing import Queue
+from pathlib import Path
 
 from drsloader import DrsLoader
 from logger import configure_logger
 from offline_trigger import get_base_argument_parsers, reduce_execute
-from realtime import load_and_start_realtime, run_listener
 
 if __name__ == '__main__':
     parsers = get_base_argument_parsers(additional_step_options=['distribute', 'database', 'distraw', 'distql'])
@@ -16,21 +17,68 @@ if __name__ == '__main__':
     version_flags.add_argument('--trigger', action='store_true')
     realtime_parse = parsers['command'].add_parser('realtime', help='Reduce files from observing session and update DB')
     realtime_parse.add_argument('--port', type=int, default=9998)
-    realtime_parse.add_argument('--processes', type=int, default=4)
+    realtime_parse.add_argument('--processes', type=int, default=4,
+                                help='Number of worker processes, or the minimum number with --max-processes')
+    realtime_parse.add_argument('--max-processes', type=int,
+                                help='Scale the number of worker processes up to this with the work queued')
     realtime_parse.add_argument('--steps', nargs='+', choices=parsers['steps'])
     realtime_parse.add_argument('--trace', action='store_true', help='Only simulate DRS commands, requires pp files')
+    realtime_parse.add_argument('--work-queue', type=Path,
+                                help='Queue work in a spool directory shared with realtime-worker on other hosts')
+    realtime_parse.add_argument('--shed-queue-depth', type=int,
+                                help='Process new object exposures with only the --shed-steps while more than this '
+                                     'many exposures and sequences are outstanding, running the others when idle')
+    realtime_parse.add_argument('--shed-queue-age', type=float,
+                                help='Process new object exposures with only the --shed-steps while the oldest '
+                                     'outstanding work has waited more than this many seconds')
+    worker_parse = parsers['command'].add_parser('realtime-worker',
+                                                 help='Process work queued by realtime on another host')
+    worker_parse.add_argument('--work-queue', type=Path, required=True, help='Spool directory shared with realtime')
+    worker_parse.add_argument('--processes', type=int, default=4)
+    worker_parse.add_argument('--steps', nargs='+', choices=parsers['steps'])
+    worker_parse.add_argument('--trace', action='store_true', help='Only simulate DRS commands, requires pp files')
+    for parse in (realtime_parse, worker_parse):
+        parse.add_argument('--max-worker-rss', type=float,
+                           help='Replace a worker process between tasks once its resident memory exceeds this many MB')
+        parse.add_argument('--max-worker-tasks', type=int,
+                           help='Replace a worker process after this many tasks, by default 1 without --max-worker-rss')
+        parse.add_argument('--priority', choices=['sequences', 'exposures'], default='sequences',
+                           help='Whether worker processes take sequences or exposures first')
+        parse.add_argument('--reserved-processes', type=int, default=0,
+                           help='Number of extra worker processes which only process exposures, so that new '
+                                'exposures are not stuck behind calibration sequences')
+        parse.add_argument('--shed-steps', nargs='+', choices=parsers['steps'],
+                           help='Steps run on object exposures while shedding load, by default preprocess snronly '
+                                'database')
 
     args = parsers['parser'].parse_args()
 
     log_files = args.logfile if args.logfile else []
-    if args.command == 'realtime':
+    realtime = args.command in ('realtime', 'realtime-worker')
+    if realtime:
         timestamp = datetime.datetime.now().strftime("error-report-%Y%m%d-%H%M%S")
         log_files.append((timestamp, 'ERROR'))
-    configure_logger(console_level=args.loglevel, log_files=log_files)
+    # Realtime workers log through a single writer thread so their output is not interleaved
+    configure_logger(console_level=args.loglevel, log_files=log_files, queued=realtime)
 
     if args.command == 'realtime':
-        queue = run_listener(args.port)
-        load_and_start_realtime(args.processes, queue, args.config, args.steps, args.trace)
+        # Imported here since the realtime server dependencies are slow to import and not needed by other commands
+        from realtime import WorkPriority, load_and_start_realtime, run_listener
+
+        cancel_queue = Queue()
+        queue = run_listener(args.port, cancel_queue)
+        priority = WorkPriority.EXPOSURES_FIRST if args.priority == 'exposures' else WorkPriority.SEQUENCES_FIRST
+        load_and_start_realtime(args.processes, queue, args.config, args.steps, args.trace, args.work_queue,
+                                args.max_processes, args.max_worker_rss, args.max_worker_tasks, cancel_queue,
+                                priority, args.reserved_processes, args.shed_queue_depth, args.shed_queue_age,
+                                args.shed_steps)
+    elif args.command == 'realtime-worker':
+        from realtime import WorkPriority, load_and_start_realtime_workers
+
+        priority = WorkPriority.EXPOSURES_FIRST if args.priority == 'exposures' else WorkPriority.SEQUENCES_FIRST
+        load_and_start_realtime_workers(args.processes, args.work_queue, args.config, args.steps, args.trace,
+                                        args.max_worker_rss, args.max_worker_tasks, priority, args.reserved_processes,
+                                        args.shed_steps)
     else:
         loader = DrsLoader(args.config)
         cfht = loader.get_loaded_trigger_module()
@@ -45,4 +93,6 @@ if __name__ == '__main__':
                 print('DRS version', CfhtDrsTrigger.drs_version(), '-',
                       'Trigger version', CfhtDrsTrigger.trigger_version())
         else:
+            if args.recipe_costs is None:
+                args.recipe_costs = loader.recipe_costs_path
             reduce_execute(args, CfhtDrsTrigger, CfhtDrsSteps, FileSelectionFilters)
@@ -1,32 +1,139 @@
+import atexit
 import logging
+import multiprocessing
+import queue
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler
 from os import PathLike
-from typing import Iterable, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 log: logging.Logger = logging.getLogger('drs_trigger')
 
+log_context = threading.local()
+
 
 class LogFormatter(logging.Formatter):
-    def __init__(self, fmt='%(levelname)s: %(message)s'):
+    def __init__(self, fmt='%(levelname)s: %(message)s', info_fmt='%(message)s'):
         super().__init__(fmt)
+        # One formatter per level format, rather than swapping the format string, so format() is safe to call from
+        # several threads at once
+        self.level_formatters = {logging.INFO: logging.Formatter(info_fmt)}
 
     def format(self, record):
-        original_format = self._style._fmt
-        if record.levelno == logging.INFO:
-            self._style._fmt = '%(message)s'
-        result = super().format(record)
-        self._style._fmt = original_format
+        formatter = self.level_formatters.get(record.levelno)
+        result = formatter.format(record) if formatter else super().format(record)
+        tag = getattr(record, 'tag', None)
+        if tag:
+            result = '[' + tag + '] ' + result
         return result
 
 
+class LogContextFilter(logging.Filter):
+    """
+    Tags records with the name of the worker process that logged them and the exposure it is processing, if any.
+    """
+
+    def filter(self, record):
+        tags = []
+        process_name = multiprocessing.current_process().name
+        if process_name != 'MainProcess':
+            tags.append(process_name)
+        exposure = getattr(log_context, 'exposure', None)
+        if exposure:
+            tags.append(exposure)
+        record.tag = ' '.join(tags)
+        return True
+
+
+@contextmanager
+def logging_context(exposure: Optional[str]):
+    """
+    Tags records logged by the current thread within the context with an exposure (or sequence).
+    """
+    previous = getattr(log_context, 'exposure', None)
+    log_context.exposure = exposure
+    try:
+        yield
+    finally:
+        log_context.exposure = previous
+
+
+class BufferedEmitMixin:
+    """
+    Writes records without flushing the stream after each one. The stream is flushed immediately for records at or
+    above flush_level, and otherwise whenever flush() is called (by the log writer when it is idle).
+    """
+    flush_level = logging.ERROR
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= self.flush_level:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class BufferedStreamHandler(BufferedEmitMixin, logging.StreamHandler):
+    pass
+
+
+class BufferedFileHandler(BufferedEmitMixin, logging.FileHandler):
+    pass
+
+
+class LogWriter:
+    """
+    Writes records sent through a multiprocessing queue from a single thread, so processes logging through a
+    QueueHandler never block on console or file writes and their lines are never interleaved.
+    """
+
+    def __init__(self, handlers: Iterable[logging.Handler], flush_interval: float = 1.0):
+        self.handlers = list(handlers)
+        self.flush_interval = flush_interval
+        self.queue = multiprocessing.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = False
+            if record:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            if record is None or time.monotonic() - last_flush >= self.flush_interval:
+                for handler in self.handlers:
+                    handler.flush()
+                last_flush = time.monotonic()
+            if record is None:
+                return
+
+
 class LogFile:
     def __init__(self, file: PathLike, level: str):
         self.file = file
         self.level = level
 
-    def to_handler(self, formatter: LogFormatter):
+    def to_handler(self, formatter: LogFormatter, buffered=False):
         try:
-            file_handler = logging.FileHandler(self.file)
+            file_handler = BufferedFileHandler(self.file) if buffered else logging.FileHandler(self.file)
         except OSError:
             raise RuntimeError('Could not open log file ' + str(self.file))
         else:
@@ -35,15 +142,38 @@ class LogFile:
             return file_handler
 
 
-def configure_logger(logger=log, console_level='INFO', log_files: Iterable[Tuple[PathLike, str]] = None):
+def configure_logger(logger=log, console_level='INFO', log_files: Iterable[Tuple[PathLike, str]] = None,
+                     queued=False) -> Optional[LogWriter]:
+    """
+    :param logger: The logger to configure
+    :param console_level: Minimum level of records written to stdout
+    :param log_files: Pairs of log file path and minimum level of records written to it
+    :param queued: Whether to send records through a queue to a log writer thread, so that records from this process
+                   and any worker processes forked from it are written by one thread, tagged with their worker and
+                   exposure
+    :return: The log writer if queued, which is stopped automatically at exit
+    """
     formatter = LogFormatter()
-    console_handler = logging.StreamHandler(sys.stdout)
+    handlers: List[logging.Handler] = []
+    console_handler = BufferedStreamHandler(sys.stdout) if queued else logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.getLevelName(console_level))
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
     if log_files:
         for log_file in log_files:
-            file_handler = LogFile(*log_file).to_handler(formatter)
+            file_handler = LogFile(*log_file).to_handler(formatter, buffered=queued)
             if file_handler:
-                logger.addHandler(file_handler)
+                handlers.append(file_handler)
     logger.setLevel(logging.DEBUG)
+    if not queued:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return None
+    log_writer = LogWriter(handlers)
+    queue_handler = QueueHandler(log_writer.queue)
+    queue_handler.setLevel(min(handler.level for handler in handlers))
+    queue_handler.addFilter(LogContextFilter())
+    logger.addHandler(queue_handler)
+    log_writer.start()
+    atexit.register(log_writer.stop)
+    return log_writer
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
 import argparse
+import json
+import sys
+from pathlib import Path
 
 import logger
 
@@ -12,17 +15,23 @@ def get_base_argument_parsers(additional_step_options=None):
 
     parsers['command'] = parsers['parser'].add_subparsers(dest='command')
     parsers['command'].required = True
-    parsers['reduce'] = argparse.ArgumentParser(add_help=False)
-    parsers['reduce'].add_argument('--trace', action='store_true', help='Only simulate DRS commands, requires pp files')
-    parsers['reduce'].add_argument('--runid', nargs='+', help='Only process observations belonging to the runid(s)')
-    parsers['reduce'].add_argument('--target', nargs='+', help='Only process observations of the target(s)')
+    parsers['selection'] = argparse.ArgumentParser(add_help=False)
+    parsers['selection'].add_argument('--runid', nargs='+', help='Only process observations belonging to the runid(s)')
+    parsers['selection'].add_argument('--target', nargs='+', help='Only process observations of the target(s)')
+    parsers['selection'].add_argument('--recipe-costs', type=Path,
+                                      help='Directory of recipe running times to record to and schedule nights from')
 
     parsers['steps'] = ['preprocess', 'ppcal', 'ppobj',
                         'calibrations', 'badpix', 'loc', 'shape', 'flat', 'thermal', 'wave',
                         'objects', 'snronly', 'extract', 'leak', 'fittellu', 'ccf', 'pol', 'products']
     if additional_step_options:
         parsers['steps'].extend(additional_step_options)
-    parsers['reduce'].add_argument('--steps', nargs='+', choices=parsers['steps'])
+    parsers['selection'].add_argument('--steps', nargs='+', choices=parsers['steps'])
+
+    parsers['reduce'] = argparse.ArgumentParser(parents=[parsers['selection']], add_help=False)
+    parsers['reduce'].add_argument('--trace', action='store_true', help='Only simulate DRS commands, requires pp files')
+    parsers['reduce'].add_argument('--isolate-recipes', action='store_true',
+                                   help='Run each recipe in a forked process to contain memory leaks and crashes')
 
     parsers['multinight'] = argparse.ArgumentParser(parents=[parsers['reduce']], add_help=False)
     parsers['multinight'].add_argument('--parallel', type=int, help='If used, number of parallel processes to run')
@@ -43,6 +52,16 @@ def get_base_argument_parsers(additional_step_options=None):
     parsers['sequence'] = parsers['command'].add_parser('sequence', parents=[parsers['night']],
                                                         help='Reduce a sequence of files together')
     parsers['sequence'].add_argument('filenames', nargs='+')
+
+    parsers['plan'] = parsers['command'].add_parser('plan', parents=[parsers['selection']],
+                                                    help='Print the recipes reducing nights would run as JSON, '
+                                                         'with their predicted cost, without running anything')
+    parsers['plan'].add_argument('nights', nargs='*', help='Night directories to plan, by default all nights')
+    parsers['plan'].add_argument('--qrunid', help='Plan all nights belonging to qrunid')
+    parsers['plan'].add_argument('--processes', type=int, default=1,
+                                 help='Number of processes to predict the wall clock time for')
+    parsers['plan'].add_argument('--output', type=Path,
+                                 help='File to write the plan to instead of stdout, which log messages also go to')
     return parsers
 
 
@@ -51,7 +70,14 @@ def reduce_execute(args, drs_class, steps_class, filters_class):
         steps = steps_class.from_keys(args.steps)
     else:
         steps = steps_class.all()
+    if args.command == 'plan':
+        return plan_execute(args, drs_class, steps, filters_class)
     trigger = drs_class(steps, trace=args.trace)
+    if args.isolate_recipes:
+        trigger.isolate_recipes()
+    if args.recipe_costs:
+        from trigger.common.recipecosts import RecipeCostStore
+        trigger.set_recipe_costs(RecipeCostStore(args.recipe_costs))
     filters = filters_class(runids=args.runid, targets=args.target)
     if args.command == 'all':
         trigger.reduce_all_nights(filters=filters, num_processes=args.parallel)
@@ -72,6 +98,31 @@ def reduce_execute(args, drs_class, steps_class, filters_class):
         trigger.process_sequence([trigger.exposure(args.night, filename) for filename in args.filenames])
 
 
+def plan_execute(args, drs_class, steps, filters_class):
+    from trigger.common.executionplan import ExecutionPlan
+    from trigger.common.recipecosts import RecipeCostStore
+
+    trigger = drs_class(steps, trace=True)
+    if args.recipe_costs:
+        trigger.set_recipe_costs(RecipeCostStore(args.recipe_costs))
+    plan = ExecutionPlan()
+    trigger.plan(plan)
+    filters = filters_class(runids=args.runid, targets=args.target)
+    if args.nights:
+        for night in args.nights:
+            trigger.reduce_night(night, filters)
+    elif args.qrunid:
+        trigger.reduce_qrun(args.qrunid, filters=filters)
+    else:
+        trigger.reduce_all_nights(filters=filters)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(plan.to_dict(args.processes), file, indent=2)
+    else:
+        json.dump(plan.to_dict(args.processes), sys.stdout, indent=2)
+        print()
+
+
 if __name__ == '__main__':
     from trigger.common import DrsSteps
     from trigger.drstrigger import DrsTrigger
@@ -1,2 +1,3 @@
-from .impl import load_and_start_realtime
+from .impl import load_and_start_realtime, load_and_start_realtime_workers
 from .listener import run_listener
+from .typing import WorkPriority
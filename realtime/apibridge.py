@@ -11,9 +11,10 @@ from .manager import IExposureApi
 
 
 class ApiBridge(IExposureApi):
-    def __init__(self, file_queue: Queue[Path], trigger: IDrsTrigger):
+    def __init__(self, file_queue: Queue[Path], trigger: IDrsTrigger, cancel_queue: Queue[str] = None):
         self.queue = file_queue
         self.trigger = trigger
+        self.cancel_queue = cancel_queue
 
     def get_new_exposures(self, cursor) -> Iterable[IExposure]:
         exposures = []
@@ -25,3 +26,9 @@ class ApiBridge(IExposureApi):
             except RuntimeError as err:
                 log.error('Failed to create link to %s: %s', str(file), str(err))
         return exposures
+
+    def get_cancelled_files(self) -> Iterable[str]:
+        filenames = []
+        while self.cancel_queue is not None and not self.cancel_queue.empty():
+            filenames.append(self.cancel_queue.get(block=False))
+        return filenames
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from logger import log
+from trigger.baseinterface.exposure import IExposure
+
+
+class CancellationStore:
+    """
+    Exposures whose processing has been cancelled, stored as one empty file per exposure so that the realtime manager
+    can cancel work held by worker processes, including workers on other hosts sharing the directory.
+
+    Cancellation is cooperative: workers skip cancelled exposures they get from the queue, and check between recipes
+    (and while a forked recipe runs) whether the exposure they are processing has been cancelled.
+    """
+
+    def __init__(self, directory: Path):
+        """
+        :param directory: The directory to store cancellations in
+        """
+        self.directory = directory
+
+    def cancel(self, exposure: IExposure):
+        path = self.__path(exposure)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        except OSError as err:
+            log.warning('Failed to cancel %s due to %s', exposure, err)
+
+    def is_cancelled(self, exposure: IExposure) -> bool:
+        return self.__path(exposure).exists()
+
+    def clear(self, exposure: IExposure):
+        try:
+            self.__path(exposure).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            log.warning('Failed to clear cancellation %s due to %s', self.__path(exposure), err)
+
+    def __path(self, exposure: IExposure) -> Path:
+        return self.directory.joinpath(exposure.night, exposure.raw.name)
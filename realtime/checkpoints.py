@@ -0,0 +1,65 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from logger import log
+from trigger.baseinterface.checkpoints import IStageCheckpoints
+from trigger.baseinterface.exposure import IExposure
+
+
+class StageCheckpointStore(IStageCheckpoints):
+    """
+    Stage checkpoints stored as one JSON file per exposure, shared by the realtime manager and its worker processes.
+
+    Files are replaced atomically, so a crash never leaves a partly written checkpoint. Only one worker processes an
+    exposure at a time, so its file has a single writer. If a checkpoint can't be read or written, the stage is run
+    as if nothing had been recorded.
+    """
+
+    def __init__(self, directory: Path):
+        """
+        :param directory: The directory to store checkpoints in
+        """
+        self.directory = directory
+
+    def get(self, exposure: IExposure, stage: str) -> Tuple[bool, Any]:
+        stages = self.__load(exposure)
+        if stage in stages:
+            return True, stages[stage]
+        return False, None
+
+    def record(self, exposure: IExposure, stage: str, result: Any):
+        stages = self.__load(exposure)
+        stages[stage] = result
+        path = self.__path(exposure)
+        temp_path = path.with_name(path.name + '.' + str(os.getpid()))
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'w') as file:
+                json.dump(stages, file, default=str)
+            os.replace(temp_path, path)
+        except OSError as err:
+            log.warning('Failed to update stage checkpoints %s due to %s', path, err)
+
+    def clear(self, exposure: IExposure):
+        try:
+            self.__path(exposure).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            log.warning('Failed to clear stage checkpoints %s due to %s', self.__path(exposure), err)
+
+    def __load(self, exposure: IExposure) -> Dict[str, Any]:
+        path = self.__path(exposure)
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            log.warning('Failed to read stage checkpoints %s due to %s', path, err)
+            return {}
+
+    def __path(self, exposure: IExposure) -> Path:
+        return self.directory.joinpath(exposure.night, exposure.raw.name + '.json')
@@ -3,24 +3,114 @@ from __future__ import annotations
 from functools import partial
 from multiprocessing import Queue
 from pathlib import Path
-from typing import Iterable, Optional, Tuple
+from typing import Iterable, Optional, Sequence, Tuple
 
 from drsloader import DrsLoader
 from trigger.baseinterface.drstrigger import IDrsTrigger
+from trigger.baseinterface.exposure import IExposure
+from trigger.common.recipecosts import RecipeCostStore
+from trigger.fileselector import FileSelector
 from .apibridge import ApiBridge
+from .cancellation import CancellationStore
+from .checkpoints import StageCheckpointStore
+from .loadshedding import LoadSheddingPolicy, ShedExposureStore
 from .localdb import DataCache
-from .manager import RealtimeStateCache, start_realtime
+from .manager import RealtimeStateCache, start_realtime, start_realtime_workers
 from .process import CalibrationStateCache, RealtimeProcessor, init_realtime_process, process_from_queues
+from .typing import WorkPriority
+from .workerpool import AutoscalePolicy, RecyclePolicy
+from .workqueue import SpoolWorkQueues
+
+# Steps run on object exposures while shedding load, just enough for the SNR in the database
+SHED_STEPS = ('preprocess', 'snronly', 'database')
 
 
 def load_and_start_realtime(num_processes: int, file_queue: Queue[Path],
-                            config_subdir: Optional[str], steps: Optional[Iterable[str]], trace: Optional[bool]):
+                            config_subdir: Optional[str], steps: Optional[Iterable[str]], trace: Optional[bool],
+                            work_queue: Optional[Path] = None, max_processes: Optional[int] = None,
+                            max_worker_rss: Optional[float] = None, max_worker_tasks: Optional[int] = None,
+                            cancel_queue: Optional[Queue[str]] = None,
+                            priority: WorkPriority = WorkPriority.SEQUENCES_FIRST, reserved_processes: int = 0,
+                            shed_queue_depth: Optional[int] = None, shed_queue_age: Optional[float] = None,
+                            shed_steps: Optional[Sequence[str]] = None):
+    """
+    :param num_processes: Number of worker processes, or the minimum number if autoscaling
+    :param max_processes: Maximum number of worker processes, to scale the number of workers with the work queued
+    :param work_queue: A spool directory to queue work in, shared with workers on other hosts, or None to only
+                       process work with local workers
+    :param max_worker_rss: Resident memory in megabytes above which a worker process is replaced between tasks
+    :param max_worker_tasks: Number of tasks after which a worker process is replaced, by default 1 unless
+                             max_worker_rss is given
+    :param cancel_queue: Queue of raw filenames of exposures to cancel processing of
+    :param priority: Which queue worker processes take work from first
+    :param reserved_processes: Number of extra worker processes which only process exposures, to keep the latency of
+                               new exposures low while calibration sequences are processed
+    :param shed_queue_depth: Number of outstanding exposures and sequences above which new object exposures are
+                             processed with only the shed steps, the other steps being run once workers are idle
+    :param shed_queue_age: Age in seconds of the oldest outstanding work above which new object exposures are
+                           processed with only the shed steps
+    :param shed_steps: The steps run on object exposures while shedding load, by default SHED_STEPS
+    """
     loader, trigger = __load_realtime_trigger(config_subdir, steps, trace)
-    remote_api = ApiBridge(file_queue, trigger)
+    load_shedding = None
+    if shed_queue_depth is not None or shed_queue_age is not None:
+        load_shedding = LoadSheddingPolicy(shed_queue_depth, shed_queue_age, __is_object)
+        shed_steps = shed_steps or SHED_STEPS
+    else:
+        # Workers don't need a trigger for reduced steps when nothing is shed
+        shed_steps = None
+    work_queues = SpoolWorkQueues(work_queue) if work_queue else None
+    autoscale = AutoscalePolicy(num_processes, max_processes) if max_processes else None
+    metrics_file = loader.config_path.joinpath('.drstrigger-realtime-metrics.json')
+    remote_api = ApiBridge(file_queue, trigger, cancel_queue)
     realtime_cache: RealtimeStateCache = DataCache(loader.config_path.joinpath('.drstrigger-realtime.cache'))
-    process_from_queues_part = partial(__process_from_queues, config_subdir, steps, trace)
-    start_realtime(trigger.find_sequences, remote_api, realtime_cache, init_realtime_process, process_from_queues_part,
-                   num_processes, 10, 1, 1)
+    checkpoints = StageCheckpointStore(__checkpoints_path(loader))
+    init_part = partial(__init_realtime_worker, config_subdir, steps, trace, shed_steps)
+    start_realtime(trigger.find_sequences, remote_api, realtime_cache, init_part, __process_from_queues,
+                   num_processes, 10, 1, 1, checkpoints=checkpoints, work_queues=work_queues, autoscale=autoscale,
+                   metrics_file=metrics_file, recycle=__recycle_policy(max_worker_rss, max_worker_tasks),
+                   spare_processes=1, cancellations=CancellationStore(__cancellations_path(loader)),
+                   cost_estimator=trigger.estimate_cost, priority=priority, reserved_processes=reserved_processes,
+                   load_shedding=load_shedding, shed_exposures=ShedExposureStore(__shed_exposures_path(loader)))
+
+
+def load_and_start_realtime_workers(num_processes: int, work_queue: Path, config_subdir: Optional[str],
+                                    steps: Optional[Iterable[str]], trace: Optional[bool],
+                                    max_worker_rss: Optional[float] = None, max_worker_tasks: Optional[int] = None,
+                                    priority: WorkPriority = WorkPriority.SEQUENCES_FIRST,
+                                    reserved_processes: int = 0, shed_steps: Optional[Sequence[str]] = None):
+    """
+    Processes work queued in a shared spool directory by a realtime manager on another host.
+    :param shed_steps: The steps run on object exposures the manager sheds load on, by default SHED_STEPS
+    """
+    shed_steps = shed_steps or SHED_STEPS
+    init_part = partial(__init_realtime_worker, config_subdir, steps, trace, shed_steps)
+    start_realtime_workers(SpoolWorkQueues(work_queue), init_part, __process_from_queues, num_processes, 1, 1,
+                           recycle=__recycle_policy(max_worker_rss, max_worker_tasks), spare_processes=1,
+                           priority=priority, reserved_processes=reserved_processes)
+
+
+def __recycle_policy(max_worker_rss: Optional[float], max_worker_tasks: Optional[int]) -> RecyclePolicy:
+    if max_worker_rss is None and max_worker_tasks is None:
+        return RecyclePolicy.every_task()
+    return RecyclePolicy(max_worker_rss, max_worker_tasks)
+
+
+def __checkpoints_path(loader: DrsLoader) -> Path:
+    return loader.config_path.joinpath('.drstrigger-checkpoints')
+
+
+def __cancellations_path(loader: DrsLoader) -> Path:
+    return loader.config_path.joinpath('.drstrigger-cancelled')
+
+
+def __shed_exposures_path(loader: DrsLoader) -> Path:
+    return loader.config_path.joinpath('.drstrigger-shed')
+
+
+def __is_object(exposure: IExposure) -> bool:
+    # Calibrations are never shed, since every later exposure depends on them
+    return FileSelector.has_object_extension(exposure.raw)
 
 
 def __load_realtime_trigger(config_subdir: Optional[str], steps: Optional[Iterable[str]],
@@ -29,11 +119,28 @@ def __load_realtime_trigger(config_subdir: Optional[str], steps: Optional[Iterab
     cfht = loader.get_loaded_trigger_module()
     steps = cfht.CfhtDrsSteps.all() if steps is None else cfht.CfhtDrsSteps.from_keys(steps)
     trigger = cfht.CfhtRealtimeTrigger(steps, trace)
+    trigger.set_recipe_costs(RecipeCostStore(loader.recipe_costs_path))
     return loader, trigger
 
 
-def __process_from_queues(config_subdir: Optional[str], steps: Optional[Iterable[str]], trace: Optional[bool]):
+def __init_realtime_worker(config_subdir: Optional[str], steps: Optional[Iterable[str]], trace: Optional[bool],
+                           shed_steps: Optional[Sequence[str]], *init_args):
+    global realtime_processor_global
+    init_realtime_process(*init_args)
     loader, trigger = __load_realtime_trigger(config_subdir, steps, trace)
+    # Import the recipes for the configured steps before waiting for work, rather than on the first exposure
+    trigger.preload_recipes()
+    trigger.set_checkpoints(StageCheckpointStore(__checkpoints_path(loader)))
     calibration_cache: CalibrationStateCache = DataCache(loader.config_path.joinpath('.drstrigger-calib.cache'), True)
-    processor = RealtimeProcessor(trigger, calibration_cache)
-    return process_from_queues(processor)
+    cancellations = CancellationStore(__cancellations_path(loader))
+    shed_exposures, reduced_trigger = None, None
+    if shed_steps is not None:
+        shed_exposures = ShedExposureStore(__shed_exposures_path(loader))
+        _, reduced_trigger = __load_realtime_trigger(config_subdir, shed_steps, trace)
+        reduced_trigger.set_checkpoints(StageCheckpointStore(__checkpoints_path(loader)))
+    realtime_processor_global = RealtimeProcessor(trigger, calibration_cache, cancellations, shed_exposures,
+                                                  reduced_trigger)
+
+
+def __process_from_queues() -> bool:
+    return process_from_queues(realtime_processor_global)
@@ -9,7 +9,13 @@ from flask import Flask, request
 from logger import log
 
 
-def run_listener(port: int) -> Queue[Path]:
+def run_listener(port: int, cancel_queue: Queue[str] = None) -> Queue[Path]:
+    """
+    :param port: The port to listen for new files on
+    :param cancel_queue: Queue the names of files to cancel processing of are put on, or None to not accept
+                         cancellations
+    :return: The queue paths of new files are put on
+    """
     app = Flask('realtime-server')
     file_queue = Queue()
 
@@ -26,6 +32,16 @@ def run_listener(port: int) -> Queue[Path]:
         except Exception:
             return '{"success": false}', 500
 
+    if cancel_queue is not None:
+        @app.route('/cancel', methods=['POST'])
+        def realtime_cancel():
+            filename = request.args.get('filename')
+            try:
+                cancel_queue.put(Path(filename).name)
+                return '{"success": true}', 200
+            except Exception:
+                return '{"success": false}', 500
+
     app.base_url = 'http://localhost:' + str(port)
     cherrypy.tree.graft(app.wsgi_app, '/')
     cherrypy.config.update({'server.socket_host': '0.0.0.0',
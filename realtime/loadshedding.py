@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import Callable, Optional
+
+from logger import log
+from trigger.baseinterface.exposure import IExposure
+
+
+class LoadSheddingPolicy:
+    """
+    Chooses when new exposures are processed with reduced steps, so that realtime keeps up with a backlog (e.g. after
+    a network outage) rather than falling hours behind running every step on every exposure.
+
+    Shedding starts once the outstanding work or the age of the oldest outstanding work goes over a limit, and only
+    applies to exposures arriving while it lasts. The steps skipped for an exposure are run later, once workers are
+    idle.
+    """
+
+    def __init__(self, max_outstanding: Optional[int] = None, max_queue_age: Optional[float] = None,
+                 sheddable: Optional[Callable[[IExposure], bool]] = None):
+        """
+        :param max_outstanding: Number of exposures and sequences queued or being processed above which new exposures
+                                are processed with reduced steps, or None for no limit
+        :param max_queue_age: Age in seconds of the oldest outstanding work above which new exposures are processed
+                              with reduced steps, or None for no limit
+        :param sheddable: Whether an exposure can be processed with reduced steps, by default every exposure
+        """
+        if max_outstanding is None and max_queue_age is None:
+            raise ValueError('A load shedding policy needs an outstanding work or a queue age limit')
+        self.max_outstanding = max_outstanding
+        self.max_queue_age = max_queue_age
+        self.sheddable = sheddable
+
+    def shed_reason(self, outstanding: int, oldest_age: float) -> Optional[str]:
+        """
+        :param outstanding: The number of exposures and sequences queued or being processed, including new exposures
+        :param oldest_age: How long, in seconds, the oldest outstanding work has been waiting
+        :return: Why new exposures should be processed with reduced steps, or None if they should be processed fully
+        """
+        if self.max_outstanding is not None and outstanding > self.max_outstanding:
+            return '{} outstanding over limit of {}'.format(outstanding, self.max_outstanding)
+        if self.max_queue_age is not None and oldest_age > self.max_queue_age:
+            return 'oldest {:.0f} s over limit of {:.0f} s'.format(oldest_age, self.max_queue_age)
+        return None
+
+    def can_shed(self, exposure: IExposure) -> bool:
+        return self.sheddable is None or self.sheddable(exposure)
+
+
+class ShedExposureStore:
+    """
+    Exposures to be processed with reduced steps, stored as one empty file per exposure so that the realtime manager
+    can tell worker processes, including workers on other hosts sharing the directory.
+    """
+
+    def __init__(self, directory: Path):
+        """
+        :param directory: The directory to store shed exposures in
+        """
+        self.directory = directory
+
+    def shed(self, exposure: IExposure):
+        path = self.__path(exposure)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        except OSError as err:
+            log.warning('Failed to shed %s due to %s, it will be processed fully', exposure, err)
+
+    def is_shed(self, exposure: IExposure) -> bool:
+        return self.__path(exposure).exists()
+
+    def clear(self, exposure: IExposure):
+        try:
+            self.__path(exposure).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            log.warning('Failed to clear shed exposure %s due to %s', self.__path(exposure), err)
+
+    def __path(self, exposure: IExposure) -> Path:
+        return self.directory.joinpath(exposure.night, exposure.raw.name)
@@ -3,16 +3,24 @@ from __future__ import annotations
 import queue
 import time
 from abc import ABC, abstractmethod
-from multiprocessing import Event, Pool, Queue, Value
-from typing import Callable, Iterable, Sequence
+from multiprocessing import Event, Value
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Sequence
 
 from logger import log
+from trigger.baseinterface.checkpoints import IStageCheckpoints, NoCheckpoints
 from trigger.baseinterface.exposure import IExposure
+from trigger.common.recipecosts import longest_first
+from .cancellation import CancellationStore
+from .loadshedding import LoadSheddingPolicy, ShedExposureStore
 from .localdb import DataCache
 from .sequencestatetracker import SequenceStateTracker
-from .typing import InitArgs, InitProcess, ProcessFromQueues
+from .typing import InitProcess, ProcessFromQueues, WorkPriority
+from .workerpool import AutoscalePolicy, Autoscaler, RecyclePolicy, WorkerPool
+from .workqueue import IWorkQueues, LocalWorkQueues
 
 SequenceFinder = Callable[[Iterable[IExposure]], Iterable[Sequence[IExposure]]]
+CostEstimator = Callable[[IExposure], float]
 # Need a forward reference...
 RealtimeStateCache = DataCache['Realtime']
 
@@ -22,149 +30,298 @@ class IExposureApi(ABC):
     def get_new_exposures(self, cursor) -> Iterable[IExposure]:
         pass
 
+    def get_cancelled_files(self) -> Iterable[str]:
+        """
+        :return: The raw filenames of exposures whose processing should be cancelled
+        """
+        return []
+
 
 def start_realtime(find_sequences: SequenceFinder, remote_api: IExposureApi, realtime_cache: RealtimeStateCache,
                    init_queues: InitProcess, process_from_queues: ProcessFromQueues, num_processes: int,
                    fetch_interval: float, tick_interval: float, subprocess_tick_interval: float,
-                   started_running: Event = None, finished_running: Value = None, stop_running: Event = None):
+                   started_running: Event = None, finished_running: Value = None, stop_running: Event = None,
+                   checkpoints: IStageCheckpoints = None, work_queues: IWorkQueues = None,
+                   autoscale: AutoscalePolicy = None, metrics_file: Path = None, recycle: RecyclePolicy = None,
+                   spare_processes: int = 0, cancellations: CancellationStore = None,
+                   cost_estimator: CostEstimator = None, priority: WorkPriority = WorkPriority.SEQUENCES_FIRST,
+                   reserved_processes: int = 0, load_shedding: LoadSheddingPolicy = None,
+                   shed_exposures: ShedExposureStore = None):
+    """
+    :param num_processes: Number of worker processes, if not autoscaling
+    :param autoscale: Policy choosing the number of worker processes while running, instead of a fixed number
+    :param metrics_file: File the latest worker and queue metrics are written to
+    :param recycle: Policy choosing when worker processes are replaced, by default after every task
+    :param spare_processes: Number of initialized worker processes kept ready to replace recycled ones
+    :param cancellations: Where cancelled exposures are recorded for the workers, or None to not accept cancellations
+    :param cost_estimator: Predicts the cost of processing an exposure, to queue the most expensive of the exposures
+                           found together first
+    :param priority: Which queue worker processes take work from first
+    :param reserved_processes: Number of worker processes reserved for exposures, on top of num_processes or the
+                               autoscaled workers
+    :param load_shedding: Policy choosing when new exposures are processed with reduced steps, which are caught up
+                          on once workers are idle, or None to always process exposures fully
+    :param shed_exposures: Where exposures to process with reduced steps are recorded for the workers, required with
+                           load_shedding
+    """
     if started_running is None:
         started_running = Event()
     if finished_running is None:
         finished_running = Value('i', 0)
     if stop_running is None:
         stop_running = Event()
-    realtime = Realtime(find_sequences, remote_api, realtime_cache, subprocess_tick_interval)
+    realtime = Realtime(find_sequences, remote_api, realtime_cache, subprocess_tick_interval, checkpoints, work_queues,
+                        cancellations, cost_estimator, load_shedding, shed_exposures)
     try:
         realtime = realtime_cache.load()
-        realtime.inject(find_sequences, remote_api, realtime_cache, subprocess_tick_interval)
+        realtime.inject(find_sequences, remote_api, realtime_cache, subprocess_tick_interval, checkpoints,
+                        work_queues, cancellations, cost_estimator, load_shedding, shed_exposures)
     except (OSError, IOError):
         log.warning('Realtime state file %s not found. This should only appear the first time realtime is run.',
                     realtime_cache.cache_file)
-    realtime.main(num_processes, init_queues, process_from_queues, fetch_interval, tick_interval,
-                  started_running, finished_running, stop_running)
+    if autoscale is None:
+        autoscale = AutoscalePolicy.fixed(num_processes)
+    realtime.main(autoscale, init_queues, process_from_queues, fetch_interval, tick_interval,
+                  started_running, finished_running, stop_running, metrics_file, recycle, spare_processes, priority,
+                  reserved_processes)
+
+
+def start_realtime_workers(work_queues: IWorkQueues, init_queues: InitProcess, process_from_queues: ProcessFromQueues,
+                           num_processes: int, tick_interval: float, subprocess_tick_interval: float,
+                           stop_running: Event = None, recycle: RecyclePolicy = None, spare_processes: int = 0,
+                           priority: WorkPriority = WorkPriority.SEQUENCES_FIRST, reserved_processes: int = 0):
+    """
+    Runs workers processing work queued by a realtime manager on another host, until stopped.
+    """
+    if stop_running is None:
+        stop_running = Event()
+    pool = WorkerPool(init_queues, process_from_queues, subprocess_tick_interval, work_queues.queues(), num_processes,
+                      recycle, spare_processes, priority, reserved_processes)
+    while not stop_running.is_set():
+        pool.maintain()
+        time.sleep(tick_interval)
+    pool.stop()
 
 
 class Realtime:
     def __init__(self, sequence_finder: SequenceFinder, remote_api: IExposureApi, local_db: RealtimeStateCache,
-                 subprocess_tick_interval: float):
-        # Shared construction method
-        self.__construct()
-        # Injectable resources
-        self.sequence_finder = sequence_finder
-        self.remote_api = remote_api
-        self.local_db = local_db
-        self.subprocess_tick_interval = subprocess_tick_interval
+                 subprocess_tick_interval: float, checkpoints: IStageCheckpoints = None,
+                 work_queues: IWorkQueues = None, cancellations: CancellationStore = None,
+                 cost_estimator: CostEstimator = None, load_shedding: LoadSheddingPolicy = None,
+                 shed_exposures: ShedExposureStore = None):
         # Set initial state
         self.sequence_mapper = SequenceStateTracker()
         self.exposures_to_process = []
         self.sequences_to_process = []
+        # Exposures processed with reduced steps, waiting for idle workers to run the steps skipped
+        self.exposures_to_catch_up = []
         self.cursor = None
-
-    def __construct(self):
-        self.exposure_in_queue = Queue()
-        self.exposure_out_queue = Queue()
-        self.sequence_in_queue = Queue()
-        self.sequence_out_queue = Queue()
+        # Injectable resources
+        self.inject(sequence_finder, remote_api, local_db, subprocess_tick_interval, checkpoints, work_queues,
+                    cancellations, cost_estimator, load_shedding, shed_exposures)
 
     # Need to call this after __setstate__ is called, e.g. after loading from pickle.
     def inject(self, sequence_finder: SequenceFinder, remote_api: IExposureApi, local_db: RealtimeStateCache,
-               subprocess_tick_interval: float):
+               subprocess_tick_interval: float, checkpoints: IStageCheckpoints = None,
+               work_queues: IWorkQueues = None, cancellations: CancellationStore = None,
+               cost_estimator: CostEstimator = None, load_shedding: LoadSheddingPolicy = None,
+               shed_exposures: ShedExposureStore = None):
+        if load_shedding is not None and shed_exposures is None:
+            raise ValueError('Load shedding needs a store for the exposures shed')
         self.sequence_finder = sequence_finder
         self.remote_api = remote_api
         self.local_db = local_db
         self.subprocess_tick_interval = subprocess_tick_interval
+        # Stages finished by workers, kept until the exposure is done so that exposures requeued after a restart
+        # resume where they left off
+        self.checkpoints = checkpoints if checkpoints is not None else NoCheckpoints()
+        self.work_queues = work_queues if work_queues is not None else LocalWorkQueues()
+        self.cancellations = cancellations
+        self.cost_estimator = cost_estimator
+        self.load_shedding = load_shedding
+        self.shed_exposures = shed_exposures
+        (self.exposure_in_queue, self.sequence_in_queue,
+         self.exposure_out_queue, self.sequence_out_queue) = self.work_queues.queues()
+        # When each outstanding exposure or sequence was queued, not saved since the queues are rebuilt on loading
+        self.queued_times: Dict[Any, float] = {}
+        # Work which was not finished when the state was saved is queued again
+        for exposure in self.exposures_to_process:
+            self.__queue(self.exposure_in_queue, exposure, requeue=True)
+        for sequence in self.sequences_to_process:
+            self.__queue(self.sequence_in_queue, sequence, requeue=True)
 
     def __getstate__(self):
         return {key: self.__dict__[key] for key in ('sequence_mapper',
                                                     'exposures_to_process',
                                                     'sequences_to_process',
+                                                    'exposures_to_catch_up',
                                                     'cursor')}
 
     def __setstate__(self, state):
-        self.__construct()
+        # State saved before load shedding has nothing to catch up on
+        self.exposures_to_catch_up = []
         self.__dict__.update(state)
-        for exposure in self.exposures_to_process:
-            self.exposure_in_queue.put(exposure)
-        for sequence in self.sequences_to_process:
-            self.sequence_in_queue.put(sequence)
 
-    def main(self, num_processes: int, init_operation: InitProcess, process_operation: ProcessFromQueues,
+    def main(self, autoscale: AutoscalePolicy, init_operation: InitProcess, process_operation: ProcessFromQueues,
              fetch_interval: float, tick_interval: float,
-             started_running: Event, finished_running: Value, stop_running: Event):
-
-        stop_signal = Event()
-        init_args: InitArgs = (self.subprocess_tick_interval, stop_signal,
-                               self.exposure_in_queue, self.sequence_in_queue,
-                               self.exposure_out_queue, self.sequence_out_queue)
-        with Pool(num_processes, init_operation, init_args, maxtasksperchild=1) as pool:
-            async_results = []
-            for i in range(num_processes):
-                async_results.append(pool.apply_async(process_operation))
-            started_running.set()
-
-            while not stop_running.is_set():
-                self.__fetch_and_handle_new_exposures()
-                fetch_time = time.time() + fetch_interval
-                while time.time() < fetch_time:
-                    self.__queue_tick(finished_running)
-                    self.__replace_finished_processes(pool, async_results, process_operation)
-                    time.sleep(tick_interval)
-
-            stop_signal.set()
-            pool.close()
-            pool.join()
-
-    @staticmethod
-    def __replace_finished_processes(pool, async_results, operation):
-        for i, result in enumerate(async_results):
-            if result and result.ready():
-                try:
-                    value = result.get()
-                    if operation is not None:
-                        if not value:
-                            log.error('Process %i did not return success: %s', i, value)
-                        async_results[i] = pool.apply_async(operation)
-                    else:
-                        async_results[i] = None
-                except Exception as e:
-                    log.error('Error occurred in process %i', i, exc_info=e)
+             started_running: Event, finished_running: Value, stop_running: Event, metrics_file: Path = None,
+             recycle: RecyclePolicy = None, spare_processes: int = 0,
+             priority: WorkPriority = WorkPriority.SEQUENCES_FIRST, reserved_processes: int = 0):
+        queues = (self.exposure_in_queue, self.sequence_in_queue, self.exposure_out_queue, self.sequence_out_queue)
+        pool = WorkerPool(init_operation, process_operation, self.subprocess_tick_interval, queues,
+                          autoscale.min_workers, recycle, spare_processes, priority, reserved_processes)
+        autoscaler = Autoscaler(pool, autoscale, metrics_file)
+        pool.maintain()
+        started_running.set()
+
+        while not stop_running.is_set():
+            self.__fetch_and_handle_new_exposures()
+            fetch_time = time.time() + fetch_interval
+            while time.time() < fetch_time:
+                self.__queue_tick(finished_running)
+                self.__catch_up(pool.size + pool.reserved_count)
+                autoscaler.update(self.__outstanding(), self.__oldest_age())
+                time.sleep(tick_interval)
+
+        pool.stop()
+
+    def __queue(self, work_queue, work, requeue=False):
+        """
+        :param requeue: Whether the work is being queued again after a restart, in which case durable queues skip it
+                        if it is still queued or being processed
+        """
+        self.queued_times.setdefault(work, time.time())
+        if requeue and hasattr(work_queue, 'requeue'):
+            work_queue.requeue(work)
+        else:
+            work_queue.put(work)
+
+    def __outstanding(self) -> int:
+        return len(self.exposures_to_process) + len(self.sequences_to_process)
+
+    def __oldest_age(self) -> float:
+        if not self.queued_times:
+            return 0.0
+        return time.time() - min(self.queued_times.values())
+
+    def __is_shed(self, exposure) -> bool:
+        return self.shed_exposures is not None and self.shed_exposures.is_shed(exposure)
+
+    def __catch_up(self, workers: int):
+        """
+        Queues exposures processed with reduced steps to be processed fully, only while there are fewer outstanding
+        exposures and sequences than workers so that new work never waits behind them for long.
+        """
+        caught_up = 0
+        while self.exposures_to_catch_up and self.__outstanding() < workers:
+            exposure = self.exposures_to_catch_up.pop(0)
+            log.info('Catching up on steps skipped for %s', exposure)
+            self.shed_exposures.clear(exposure)
+            self.__queue(self.exposure_in_queue, exposure)
+            self.exposures_to_process.append(exposure)
+            caught_up += 1
+        if caught_up:
+            self.local_db.save(self)
+
+    def cancel(self, filename: str):
+        """
+        Cancels processing of an exposure queued or being processed. Workers skip it if they haven't started it yet,
+        and otherwise abandon it at the next recipe, killing the recipe running if it was forked.
+        :param filename: The raw filename of the exposure
+        """
+        exposures = [exposure for exposure in self.exposures_to_process if exposure.raw.name == filename]
+        if self.cancellations is None:
+            log.warning('Not cancelling %s, cancellation is not enabled', filename)
+        elif not exposures:
+            log.warning('Not cancelling %s, it is not queued or being processed', filename)
+        else:
+            for exposure in exposures:
+                log.info('Cancelling %s', exposure)
+                self.cancellations.cancel(exposure)
 
     def __fetch_and_handle_new_exposures(self):
+        for filename in self.remote_api.get_cancelled_files():
+            self.cancel(filename)
         new_exposures = self.remote_api.get_new_exposures(self.cursor)
         if new_exposures:
             # self.cursor = new_exposures[-1].get_timestamp()  # THIS IS NOT A REAL METHOD
+            # Sequences are found from the order exposures arrived in, whatever order they are queued in
             self.sequence_mapper.add_unmapped_exposures(new_exposures)
             unmapped_exposures = self.sequence_mapper.get_unmapped_exposures()
             completed_sequences = self.sequence_finder(unmapped_exposures)
             self.sequence_mapper.mark_sequences_complete(completed_sequences)
+            if self.cost_estimator:
+                # Exposures found together are otherwise queued in the order they arrived
+                new_exposures = longest_first(new_exposures, self.cost_estimator)
+            shed_reason = None
+            if self.load_shedding is not None:
+                shed_reason = self.load_shedding.shed_reason(self.__outstanding() + len(new_exposures),
+                                                             self.__oldest_age())
+            shed = 0
             for exposure in new_exposures:
-                self.exposure_in_queue.put(exposure)
-                self.exposures_to_process.append(exposure)
+                # A new copy of an exposure seen before is processed from scratch
+                self.checkpoints.clear(exposure)
+                if self.cancellations is not None:
+                    self.cancellations.clear(exposure)
+                if self.shed_exposures is not None:
+                    self.shed_exposures.clear(exposure)
+                    if exposure in self.exposures_to_catch_up:
+                        self.exposures_to_catch_up.remove(exposure)
+                    if shed_reason and self.load_shedding.can_shed(exposure):
+                        self.shed_exposures.shed(exposure)
+                        shed += 1
+                self.__queue(self.exposure_in_queue, exposure)
+                # Still only outstanding once if a copy is already queued or being processed
+                if exposure not in self.exposures_to_process:
+                    self.exposures_to_process.append(exposure)
+            if shed:
+                log.info('Processing %i new exposures with reduced steps: %s', shed, shed_reason)
             self.local_db.save(self)
 
     def __queue_tick(self, finished_running):
         updated = 0
+        exposures_done = []
         while not self.sequence_out_queue.empty():
             try:
                 sequence = self.sequence_out_queue.get(block=False)
+                if sequence not in self.sequences_to_process:
+                    # Durable queues can report work done twice if it was requeued after a restart
+                    log.info('Ignoring repeated completion of %s', sequence)
+                    continue
                 self.sequences_to_process.remove(sequence)
+                self.queued_times.pop(sequence, None)
                 updated += 1
             except queue.Empty:
                 pass
         while not self.exposure_out_queue.empty():
             try:
                 exposure = self.exposure_out_queue.get(block=False)
+                if exposure not in self.exposures_to_process:
+                    log.info('Ignoring repeated completion of %s', exposure)
+                    continue
                 self.exposures_to_process.remove(exposure)
+                self.queued_times.pop(exposure, None)
+                updated += 1
+                if self.__is_shed(exposure):
+                    # Only counts as processed for its sequence once the steps skipped have been caught up on, and
+                    # keeps its finished stages so catching up doesn't repeat them
+                    self.exposures_to_catch_up.append(exposure)
+                    continue
+                exposures_done.append(exposure)
                 self.sequence_mapper.mark_exposure_processed(exposure)
                 sequence = self.sequence_mapper.get_sequence_if_ready_to_process(exposure)
                 if sequence:
-                    self.sequence_in_queue.put(sequence)
+                    self.__queue(self.sequence_in_queue, sequence)
                     self.sequences_to_process.append(sequence)
                     self.sequence_mapper.done_with_sequence(sequence)
-                updated += 1
             except queue.Empty:
                 pass
         if updated:
             self.local_db.save(self)
+            # Only forget finished stages once the saved state no longer has the exposures to process
+            for exposure in exposures_done:
+                self.checkpoints.clear(exposure)
+                if self.cancellations is not None:
+                    self.cancellations.clear(exposure)
             with finished_running.get_lock():
                 finished_running.value += updated
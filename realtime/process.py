@@ -2,39 +2,49 @@ from __future__ import annotations
 
 import queue
 import time
+from functools import partial
 from multiprocessing import Event, Queue, current_process
+from multiprocessing.sharedctypes import Synchronized
 from typing import Optional, Sequence
 
-from logger import log
+from logger import log, logging_context
 from trigger.baseinterface.drstrigger import ICalibrationState, IDrsTrigger
 from trigger.baseinterface.exposure import IExposure
+from trigger.baseinterface.processor import WorkCancelled
+from .cancellation import CancellationStore
+from .loadshedding import ShedExposureStore
 from .localdb import DataCache
-from .typing import BlockingParams, ExposureQueue, IRealtimeProcessor, InitProcess, ProcessFromQueues, SequenceQueue
+from .typing import (BlockingParams, ExposureQueue, IRealtimeProcessor, InitProcess, ProcessFromQueues, SequenceQueue,
+                     WorkPriority)
 
 CalibrationStateCache = DataCache[ICalibrationState]
 
 
 def init_realtime_process(retry_interval: float, stop_signal: Event,
                           exposure_queue: ExposureQueue, sequence_queue: SequenceQueue,
-                          exposures_done: ExposureQueue, sequences_done: SequenceQueue):
+                          exposures_done: ExposureQueue, sequences_done: SequenceQueue,
+                          priority: Optional[Synchronized] = None):
     global exposure_queue_global
     global sequence_queue_global
     global exposures_done_global
     global sequences_done_global
     global blocking_params_global
+    global priority_global
     exposure_queue_global = exposure_queue
     sequence_queue_global = sequence_queue
     exposures_done_global = exposures_done
     sequences_done_global = sequences_done
     blocking_params_global = BlockingParams(retry_interval, stop_signal)
+    priority_global = priority
     log.info('Started process %i', current_process().pid)
 
 
 def process_from_queues(realtime_processor) -> bool:
     realtime_processor.process_id = current_process().pid
+    priority = WorkPriority(priority_global.value) if priority_global is not None else WorkPriority.SEQUENCES_FIRST
     return realtime_processor.process_next_from_queue(exposure_queue_global, sequence_queue_global,
                                                       exposures_done_global, sequences_done_global,
-                                                      blocking_params_global)
+                                                      blocking_params_global, priority=priority)
 
 
 # Just here for static typechecking, calling this is pointless
@@ -46,57 +56,101 @@ def __typechecking():
     assert process_from_queues_check == process_from_queues
 
 
+def not_cancelled() -> bool:
+    return False
+
+
 class RealtimeProcessor(IRealtimeProcessor):
-    def __init__(self, trigger: IDrsTrigger, calibration_cache: CalibrationStateCache):
+    def __init__(self, trigger: IDrsTrigger, calibration_cache: CalibrationStateCache,
+                 cancellations: Optional[CancellationStore] = None, shed_exposures: Optional[ShedExposureStore] = None,
+                 reduced_trigger: Optional[IDrsTrigger] = None):
+        """
+        :param cancellations: Where cancelled exposures are recorded, or None to not check for cancellations
+        :param shed_exposures: Where exposures to process with reduced steps are recorded, or None to process every
+                               exposure fully
+        :param reduced_trigger: The trigger processing shed exposures, configured with the reduced steps
+        """
         super().__init__()
         self.trigger = trigger
         self.calibration_cache = calibration_cache
+        self.cancellations = cancellations
+        self.shed_exposures = shed_exposures
+        self.reduced_trigger = reduced_trigger
 
     def process_next_from_queue(self, exposure_queue: Queue[IExposure], sequence_queue: Queue[Sequence[IExposure]],
                                 exposures_done: Queue[IExposure], sequences_done: Queue[Sequence[IExposure]],
-                                block: Optional[BlockingParams] = None) -> bool:
+                                block: Optional[BlockingParams] = None,
+                                priority: WorkPriority = WorkPriority.SEQUENCES_FIRST) -> bool:
         if block:
             while not block.stop_signal.is_set():
-                result = self.__process_next_from_queue(exposure_queue, sequence_queue, exposures_done, sequences_done)
+                result = self.__process_next_from_queue(exposure_queue, sequence_queue, exposures_done, sequences_done,
+                                                        priority)
                 if result:
                     return result
                 time.sleep(block.retry_interval)
             return False
         else:
-            return self.__process_next_from_queue(exposure_queue, sequence_queue, exposures_done, sequences_done)
+            return self.__process_next_from_queue(exposure_queue, sequence_queue, exposures_done, sequences_done,
+                                                  priority)
 
     def __process_next_from_queue(self, exposure_queue: Queue[IExposure], sequence_queue: Queue[Sequence[IExposure]],
-                                  exposures_done: Queue[IExposure], sequences_done: Queue[Sequence[IExposure]]) -> bool:
+                                  exposures_done: Queue[IExposure], sequences_done: Queue[Sequence[IExposure]],
+                                  priority: WorkPriority) -> bool:
+        if priority == WorkPriority.SEQUENCES_FIRST:
+            return (self.__process_next_sequence(sequence_queue, sequences_done)
+                    or self.__process_next_exposure(exposure_queue, exposures_done))
+        if priority == WorkPriority.EXPOSURES_FIRST:
+            return (self.__process_next_exposure(exposure_queue, exposures_done)
+                    or self.__process_next_sequence(sequence_queue, sequences_done))
+        return self.__process_next_exposure(exposure_queue, exposures_done)
+
+    def __process_next_exposure(self, exposure_queue: Queue[IExposure], exposures_done: Queue[IExposure]) -> bool:
         try:
-            sequence = sequence_queue.get(block=False)
+            exposure = exposure_queue.get(block=False)
         except queue.Empty:
-            try:
-                exposure = exposure_queue.get(block=False)
-            except queue.Empty:
-                pass
+            return False
+        with logging_context(exposure.raw.name):
+            if self.cancellations and self.cancellations.is_cancelled(exposure):
+                log.info('Process %i skipping cancelled %s', self.process_id, exposure)
             else:
                 log.info('Process %i processing %s', self.process_id, exposure)
                 try:
                     self.__process_exposure(exposure)
+                except WorkCancelled:
+                    log.info('Process %i cancelled processing of %s', self.process_id, exposure)
                 except:
                     log.error('An error occurred while processing %s', exposure, exc_info=True)
-                exposures_done.put(exposure)
-                return True
-        else:
+        exposures_done.put(exposure)
+        return True
+
+    def __process_next_sequence(self, sequence_queue: Queue[Sequence[IExposure]],
+                                sequences_done: Queue[Sequence[IExposure]]) -> bool:
+        try:
+            sequence = sequence_queue.get(block=False)
+        except queue.Empty:
+            return False
+        with logging_context(sequence[0].raw.name + ' sequence' if sequence else None):
             log.info('Process %i processing %s', self.process_id, sequence)
             try:
                 self.__process_sequence(sequence)
             except:
                 log.error('An error occurred while processing %s', sequence, exc_info=True)
-            sequences_done.put(sequence)
-            return True
-        return False
+        sequences_done.put(sequence)
+        return True
 
     def __process_exposure(self, exposure: IExposure):
-        if self.trigger.preprocess(exposure):
-            self.trigger.process_file(exposure)
+        trigger = self.trigger
+        if self.reduced_trigger and self.shed_exposures and self.shed_exposures.is_shed(exposure):
+            log.info('Process %i processing %s with reduced steps', self.process_id, exposure)
+            trigger = self.reduced_trigger
+        if self.cancellations:
+            trigger.set_cancel_check(partial(self.cancellations.is_cancelled, exposure))
+        if trigger.preprocess(exposure):
+            trigger.process_file(exposure)
 
     def __process_sequence(self, sequence: Sequence[IExposure]):
+        # Sequences depend on the calibration state, so they are never abandoned part way
+        self.trigger.set_cancel_check(not_cancelled)
         try:
             self.trigger.calibration_state = self.calibration_cache.load()
         except (OSError, IOError):
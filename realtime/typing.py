@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from enum import IntEnum
 from multiprocessing import Event
-from typing import Callable, NamedTuple, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from multiprocessing.sharedctypes import Synchronized
 
 # For some reason using the usual typing method here blows up when we run tests...
 ExposureQueue = 'Queue[IExposure]'
@@ -14,6 +18,17 @@ class BlockingParams(NamedTuple):
     stop_signal: Event
 
 
+class WorkPriority(IntEnum):
+    """
+    Which queue a realtime worker takes work from first. Stored as an int so it can be shared with worker processes.
+    """
+    SEQUENCES_FIRST = 0
+    EXPOSURES_FIRST = 1
+    # For workers reserved to keep latency of new exposures low, which never wait on a long calibration sequence.
+    # They take any exposure, since calibration exposures only need preprocessing and there is a single exposure queue
+    EXPOSURES_ONLY = 2
+
+
 class IRealtimeProcessor(ABC):
     def __init__(self):
         self.process_id = 0
@@ -21,10 +36,13 @@ class IRealtimeProcessor(ABC):
     @abstractmethod
     def process_next_from_queue(self, exposure_queue: ExposureQueue, sequence_queue: SequenceQueue,
                                 exposures_done: ExposureQueue, sequences_done: SequenceQueue,
-                                block: Optional[BlockingParams] = None) -> bool:
+                                block: Optional[BlockingParams] = None,
+                                priority: WorkPriority = WorkPriority.SEQUENCES_FIRST) -> bool:
         pass
 
 
-InitArgs = Tuple[float, Event, ExposureQueue, SequenceQueue, ExposureQueue, SequenceQueue]
-InitProcess = Callable[[float, Event, ExposureQueue, SequenceQueue, ExposureQueue, SequenceQueue], None]
+# Ends with a shared int holding the WorkPriority of the worker, which can change when a spare worker is activated
+InitArgs = Tuple[float, Event, ExposureQueue, SequenceQueue, ExposureQueue, SequenceQueue, 'Synchronized']
+InitProcess = Callable[[float, Event, ExposureQueue, SequenceQueue, ExposureQueue, SequenceQueue, 'Synchronized'],
+                       None]
 ProcessFromQueues = Callable[[], bool]
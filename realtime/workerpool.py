@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+from multiprocessing import Event, Process, Value
+from multiprocessing.sharedctypes import Synchronized
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from logger import log
+from .typing import InitArgs, InitProcess, ProcessFromQueues, WorkPriority
+from .workqueue import WorkQueues
+
+
+class ScalingDecision(NamedTuple):
+    workers: int
+    reason: Optional[str]
+
+
+class AutoscalePolicy:
+    """
+    Chooses how many realtime workers to run from the work outstanding, how long the oldest outstanding work has been
+    waiting, and the host load.
+
+    Workers are added as soon as there is more outstanding work than workers, unless the host is already loaded and
+    the outstanding work is still recent. Workers are removed one at a time, each once there has been less outstanding
+    work than workers for scale_down_delay seconds.
+    """
+
+    def __init__(self, min_workers: int, max_workers: int, max_queue_age: float = 300.0, max_load: float = 1.0,
+                 scale_down_delay: float = 120.0):
+        """
+        :param min_workers: Number of workers kept running when there is no work
+        :param max_workers: Maximum number of workers
+        :param max_queue_age: Age in seconds of the oldest outstanding work beyond which workers are added regardless
+                              of the host load
+        :param max_load: One minute load average per CPU above which workers are not added for recent work
+        :param scale_down_delay: How long, in seconds, workers must have been idle before they are removed
+        """
+        if not 0 < min_workers <= max_workers:
+            raise ValueError('Worker limits must satisfy 0 < min_workers <= max_workers')
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.max_queue_age = max_queue_age
+        self.max_load = max_load
+        self.scale_down_delay = scale_down_delay
+        self.last_busy = time.monotonic()
+
+    @staticmethod
+    def fixed(workers: int) -> AutoscalePolicy:
+        return AutoscalePolicy(workers, workers)
+
+    def decide(self, workers: int, outstanding: int, oldest_age: float, load: float) -> ScalingDecision:
+        """
+        :param workers: The number of workers running
+        :param outstanding: The number of exposures and sequences queued or being processed
+        :param oldest_age: How long, in seconds, the oldest outstanding work has been waiting
+        :param load: The one minute load average per CPU
+        :return: The number of workers to run, and the reason for changing it if it changed
+        """
+        now = time.monotonic()
+        demand = min(max(outstanding, self.min_workers), self.max_workers)
+        status = '{} outstanding, oldest {:.0f} s, load {:.2f} per CPU'.format(outstanding, oldest_age, load)
+        if demand >= workers:
+            self.last_busy = now
+        if demand > workers:
+            if load > self.max_load and oldest_age < self.max_queue_age:
+                return ScalingDecision(workers, None)
+            return ScalingDecision(demand, status)
+        if demand < workers and now - self.last_busy >= self.scale_down_delay:
+            # Each worker removed waits out the delay again, rather than all of them going one tick after another
+            self.last_busy = now
+            return ScalingDecision(workers - 1, status)
+        if workers < self.min_workers or workers > self.max_workers:
+            return ScalingDecision(min(max(workers, self.min_workers), self.max_workers), status)
+        return ScalingDecision(workers, None)
+
+
+class RecyclePolicy:
+    """
+    Chooses when a worker process is replaced by a fresh one, to bound the memory APERO accumulates while it runs.
+
+    Workers are only checked between tasks, so a worker is never retired in the middle of one. Retiring workers often
+    bounds memory tightly but pays the worker startup cost more often.
+    """
+
+    def __init__(self, max_rss: Optional[float] = None, max_tasks: Optional[int] = None):
+        """
+        :param max_rss: Resident memory, in megabytes, above which a worker is retired after its current task
+        :param max_tasks: Number of tasks after which a worker is retired, or None for no limit
+        """
+        if max_rss is None and max_tasks is None:
+            raise ValueError('A recycle policy needs a memory or a task limit')
+        self.max_rss = max_rss
+        self.max_tasks = max_tasks
+
+    @staticmethod
+    def every_task() -> RecyclePolicy:
+        return RecyclePolicy(max_tasks=1)
+
+    def retire_reason(self, tasks: int, rss: Optional[float]) -> Optional[str]:
+        """
+        :param tasks: The number of tasks the worker has finished
+        :param rss: The resident memory of the worker in megabytes, or None if unknown
+        :return: Why the worker should be retired, or None if it should keep running
+        """
+        if self.max_rss is not None and rss is not None and rss >= self.max_rss:
+            return 'RSS {:.0f} MB over limit of {:.0f} MB after {} tasks'.format(rss, self.max_rss, tasks)
+        if self.max_tasks is not None and tasks >= self.max_tasks:
+            return 'finished {} tasks'.format(tasks)
+        return None
+
+
+def current_rss() -> Optional[float]:
+    """
+    :return: The resident memory of the current process in megabytes, or None if it can't be read
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Worker:
+    def __init__(self, process: Process, stop_signal: Event, activate_signal: Event, recycle_signal: Event,
+                 priority: Synchronized):
+        self.process = process
+        self.stop_signal = stop_signal
+        self.activate_signal = activate_signal
+        self.recycle_signal = recycle_signal
+        # Shared with the worker process, which reads it before taking each task
+        self.priority = priority
+        self.retiring = False
+
+    @property
+    def reserved(self) -> bool:
+        return self.priority.value == WorkPriority.EXPOSURES_ONLY
+
+    @property
+    def spare(self) -> bool:
+        return not self.activate_signal.is_set()
+
+
+class WorkerPool:
+    """
+    Realtime worker processes, which can be resized while running.
+
+    Each worker processes exposures and sequences until its recycle policy retires it between tasks. Spare workers
+    are started and initialized ahead of time, without taking any work, so a retired worker is replaced by one which
+    is ready straight away rather than one which still has to pay the startup cost.
+
+    Reserved workers only take exposures, on top of the workers taking work in the order of the pool's priority, so
+    that new exposures are never all stuck behind long calibration sequences. Resizing only changes the number of
+    unreserved workers.
+
+    Resizing down is graceful: a retired worker finishes the work it has in hand before it exits.
+    """
+
+    def __init__(self, init_operation: InitProcess, process_operation: ProcessFromQueues, retry_interval: float,
+                 queues: WorkQueues, workers: int = 0, recycle: Optional[RecyclePolicy] = None, spares: int = 0,
+                 priority: WorkPriority = WorkPriority.SEQUENCES_FIRST, reserved: int = 0):
+        """
+        :param init_operation: Function called at the start of each worker process, with the queues
+        :param process_operation: Function called repeatedly by each worker process to process work from the queues,
+                                  returning False once the worker is stopped
+        :param retry_interval: How long idle workers wait before checking the queues again
+        :param queues: The queues workers get work from and put finished work on
+        :param workers: The initial number of workers
+        :param recycle: When workers are replaced, by default after every task
+        :param spares: The number of spare workers kept ready to replace retired workers
+        :param priority: Which queue unreserved workers take work from first
+        :param reserved: The number of workers reserved for exposures
+        """
+        self.init_operation = init_operation
+        self.process_operation = process_operation
+        self.retry_interval = retry_interval
+        self.queues = queues
+        self.target = workers
+        self.recycle = recycle if recycle is not None else RecyclePolicy.every_task()
+        self.spares = spares
+        self.priority = priority
+        self.reserved = reserved
+        self.recycled = 0
+        self.workers: List[Worker] = []
+
+    @property
+    def size(self) -> int:
+        """
+        :return: The number of workers taking work, not counting retiring, spare or reserved workers
+        """
+        return sum(1 for worker in self.workers if not worker.retiring and not worker.spare and not worker.reserved)
+
+    @property
+    def reserved_count(self) -> int:
+        return sum(1 for worker in self.workers if not worker.retiring and not worker.spare and worker.reserved)
+
+    @property
+    def spare_count(self) -> int:
+        return sum(1 for worker in self.workers if not worker.retiring and worker.spare)
+
+    def resize(self, target: int):
+        self.target = target
+        for worker in reversed(self.workers):
+            if self.size <= target:
+                break
+            if not worker.retiring and not worker.spare and not worker.reserved:
+                worker.retiring = True
+                worker.stop_signal.set()
+
+    def maintain(self):
+        """
+        Removes workers which have exited, replaces workers which were recycled, and starts workers until there are
+        as many as the target and the number reserved, using spare workers first.
+        """
+        for worker in list(self.workers):
+            if worker.recycle_signal.is_set() and not worker.retiring:
+                worker.retiring = True
+                self.recycled += 1
+            if not worker.process.is_alive():
+                worker.process.join()
+                if worker.process.exitcode:
+                    log.error('Worker %i exited with code %s', worker.process.pid, worker.process.exitcode)
+                self.workers.remove(worker)
+        while self.reserved_count < self.reserved:
+            self.__activate_worker(WorkPriority.EXPOSURES_ONLY)
+        while self.size < self.target:
+            self.__activate_worker(self.priority)
+        while self.spare_count < self.spares:
+            self.__start_worker()
+
+    def stop(self):
+        """
+        Stops every worker once it has finished the work it has in hand, and waits for them to exit.
+        """
+        self.target = 0
+        self.spares = 0
+        self.reserved = 0
+        for worker in self.workers:
+            worker.retiring = True
+            worker.stop_signal.set()
+        for worker in self.workers:
+            worker.process.join()
+        self.workers.clear()
+
+    def __activate_worker(self, priority: WorkPriority):
+        worker = next((worker for worker in self.workers if not worker.retiring and worker.spare), None)
+        if worker is None:
+            worker = self.__start_worker()
+        # Set before activating, so the worker never takes work with the priority of a spare
+        worker.priority.value = priority
+        worker.activate_signal.set()
+
+    def __start_worker(self) -> Worker:
+        stop_signal = Event()
+        activate_signal = Event()
+        recycle_signal = Event()
+        priority = Value('i', self.priority)
+        init_args: InitArgs = (self.retry_interval, stop_signal, *self.queues, priority)
+        process = Process(target=run_worker, args=(self.init_operation, init_args, self.process_operation,
+                                                   self.recycle, activate_signal, recycle_signal), daemon=True)
+        process.start()
+        worker = Worker(process, stop_signal, activate_signal, recycle_signal, priority)
+        self.workers.append(worker)
+        return worker
+
+
+def run_worker(init_operation: InitProcess, init_args: InitArgs, process_operation: ProcessFromQueues,
+               recycle: RecyclePolicy, activate_signal: Event, recycle_signal: Event):
+    retry_interval, stop_signal = init_args[0], init_args[1]
+    try:
+        init_operation(*init_args)
+        # Spare workers are initialized up front, then wait until they are needed
+        while not activate_signal.wait(retry_interval):
+            if stop_signal.is_set():
+                return
+        tasks = 0
+        while process_operation():
+            tasks += 1
+            rss = current_rss()
+            log.debug('Worker %i finished task %i, RSS %s MB', os.getpid(), tasks, rss)
+            reason = recycle.retire_reason(tasks, rss)
+            if reason:
+                log.info('Recycling worker %i: %s', os.getpid(), reason)
+                recycle_signal.set()
+                return
+    except Exception:
+        log.error('Error occurred in worker %i', os.getpid(), exc_info=True)
+        sys.exit(1)
+
+
+class Autoscaler:
+    """
+    Resizes a worker pool according to an autoscale policy, logging each change and writing the latest state to a
+    metrics file if given.
+    """
+
+    def __init__(self, pool: WorkerPool, policy: AutoscalePolicy, metrics_file: Optional[Path] = None):
+        self.pool = pool
+        self.policy = policy
+        self.metrics_file = metrics_file
+        self.scale_ups = 0
+        self.scale_downs = 0
+
+    def update(self, outstanding: int, oldest_age: float):
+        """
+        :param outstanding: The number of exposures and sequences queued or being processed
+        :param oldest_age: How long, in seconds, the oldest outstanding work has been waiting
+        """
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        workers = self.pool.size
+        decision = self.policy.decide(workers, outstanding, oldest_age, load)
+        if decision.workers != workers:
+            log.info('Scaling workers from %i to %i: %s', workers, decision.workers, decision.reason)
+            if decision.workers > workers:
+                self.scale_ups += 1
+            else:
+                self.scale_downs += 1
+            self.pool.resize(decision.workers)
+        self.pool.maintain()
+        if self.metrics_file:
+            self.__write_metrics({
+                'time': time.time(),
+                'workers': self.pool.size,
+                'spare_workers': self.pool.spare_count,
+                'reserved_workers': self.pool.reserved_count,
+                'retiring_workers': (len(self.pool.workers) - self.pool.size - self.pool.spare_count
+                                     - self.pool.reserved_count),
+                'recycled_workers': self.pool.recycled,
+                'outstanding': outstanding,
+                'oldest_age': oldest_age,
+                'load_per_cpu': load,
+                'scale_ups': self.scale_ups,
+                'scale_downs': self.scale_downs,
+            })
+
+    def __write_metrics(self, metrics: dict):
+        temp_file = self.metrics_file.with_name(self.metrics_file.name + '.tmp')
+        try:
+            with open(temp_file, 'w') as file:
+                json.dump(metrics, file)
+            os.replace(temp_file, self.metrics_file)
+        except OSError as err:
+            log.warning('Failed to write realtime metrics to %s due to %s', self.metrics_file, err)
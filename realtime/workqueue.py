@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Any, Optional, Set, Tuple
+
+from logger import log
+from trigger.baseinterface.exposure import IExposure
+from .typing import ExposureQueue, SequenceQueue
+
+WorkQueues = Tuple[ExposureQueue, SequenceQueue, ExposureQueue, SequenceQueue]
+
+
+class IWorkQueues(ABC):
+    """
+    The queues realtime work is sent through: exposures and sequences to process, and exposures and sequences done.
+    Each queue supports put(item), get(block=False), raising queue.Empty when there is nothing to get, and empty().
+    Durable queues also support requeue(item), to queue work again after a restart unless it is still queued.
+    """
+
+    @abstractmethod
+    def queues(self) -> WorkQueues:
+        """
+        :return: The exposure, sequence, exposures done and sequences done queues
+        """
+        pass
+
+
+class LocalWorkQueues(IWorkQueues):
+    """
+    In-memory queues shared with worker processes forked on the same host.
+    """
+
+    def __init__(self):
+        self.__queues = (Queue(), Queue(), Queue(), Queue())
+
+    def queues(self) -> WorkQueues:
+        return self.__queues
+
+
+class SpoolWorkQueues(IWorkQueues):
+    """
+    Durable queues stored as files in a spool directory, which can be shared by realtime workers on several hosts
+    through a common filesystem. Work is claimed and completed by renaming files, which is atomic, so no locking is
+    needed (and nothing breaks when the worker pool forks while another thread is using the queues).
+
+    Work is leased to the worker which gets it and only removed once the worker puts it on the matching done queue.
+    Workers renew their leases while they hold work, so work held by a worker which died is handed out again once
+    its lease expires. Work requeued after a restart is skipped if it is still queued or leased, so requeueing
+    everything unfinished is safe.
+    """
+
+    def __init__(self, path: Path, lease: float = 300.0):
+        """
+        :param path: The spool directory to store queued work in
+        :param lease: How long, in seconds, work stays leased to a worker which stops renewing it
+        """
+        self.path = path
+        self.lease = lease
+
+    def queues(self) -> WorkQueues:
+        return (SpoolWorkQueue(self.path.joinpath('exposures'), lease=self.lease),
+                SpoolWorkQueue(self.path.joinpath('sequences'), lease=self.lease),
+                SpoolWorkQueue(self.path.joinpath('exposures_done'), completes=self.path.joinpath('exposures')),
+                SpoolWorkQueue(self.path.joinpath('sequences_done'), completes=self.path.joinpath('sequences')))
+
+
+class SpoolWorkQueue:
+    """
+    A queue stored in a directory. Queued work is a file in the pending subdirectory, named so that files sort in the
+    order they were queued, and work which has been got is moved to the leased subdirectory. The modification time of
+    a leased file is when its lease was last renewed.
+    """
+
+    def __init__(self, path: Path, lease: Optional[float] = None, completes: Optional[Path] = None):
+        """
+        :param path: The directory the queue is stored in
+        :param lease: How long work got from the queue is leased for, or None to remove work as soon as it is got
+        :param completes: The directory of the queue whose leased work is completed by putting it on this queue
+        """
+        self.path = path
+        self.lease = lease
+        self.completes = completes
+        self.pending = path.joinpath('pending')
+        self.leased = path.joinpath('leased')
+        for directory in (self.pending, self.leased, path.joinpath('tmp')):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.__reset()
+
+    def __getstate__(self):
+        return self.path, self.lease, self.completes
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __reset(self):
+        self.pid = os.getpid()
+        self.held: Set[Path] = set()
+        self.condition = threading.Condition()
+        self.renewer: Optional[threading.Thread] = None
+
+    def put(self, item: Any):
+        key = key_digest(work_key(item))
+        temp_file = self.path.joinpath('tmp', worker_name() + '-' + key)
+        with open(temp_file, 'wb') as file:
+            pickle.dump(item, file)
+        os.rename(temp_file, self.pending.joinpath('{:020d}-{}'.format(time.time_ns(), key)))
+        if self.completes:
+            for leased_file in self.completes.joinpath('leased').glob('*-' + key):
+                leased_file.unlink()
+
+    def requeue(self, item: Any):
+        """
+        Queues work again after a restart, unless it is still queued or leased to a worker.
+        """
+        if not self.__find(key_digest(work_key(item))):
+            self.put(item)
+
+    def get(self, block=True, timeout: Optional[float] = None) -> Any:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            item = self.__get()
+            if item is not None:
+                return item
+            if not block or deadline is not None and time.monotonic() >= deadline:
+                raise queue.Empty
+            time.sleep(0.1)
+
+    def empty(self) -> bool:
+        self.__release_expired()
+        return not any(self.pending.iterdir())
+
+    def __find(self, key: str) -> bool:
+        return any(self.pending.glob('*-' + key)) or any(self.leased.glob('*-' + key))
+
+    def __get(self) -> Optional[Any]:
+        self.__release_expired()
+        for name in sorted(os.listdir(self.pending)):
+            pending_file = self.pending.joinpath(name)
+            leased_file = self.leased.joinpath(name)
+            try:
+                # Start the lease before the file is moved, so it is never seen as an expired lease
+                os.utime(pending_file)
+                # Only one worker can move the file, so only one gets the work
+                os.rename(pending_file, leased_file)
+            except FileNotFoundError:
+                continue
+            with open(leased_file, 'rb') as file:
+                item = pickle.load(file)
+            if self.lease is None:
+                leased_file.unlink()
+            else:
+                self.__hold(leased_file)
+            return item
+        return None
+
+    def __release_expired(self):
+        if self.lease is None:
+            return
+        expired_before = time.time() - self.lease
+        for leased_file in self.leased.iterdir():
+            try:
+                if leased_file.stat().st_mtime < expired_before:
+                    os.rename(leased_file, self.pending.joinpath(leased_file.name))
+                    log.warning('Lease of %s expired, queueing it again', leased_file.name)
+            except FileNotFoundError:
+                pass
+
+    def __hold(self, leased_file: Path):
+        if self.pid != os.getpid():
+            # The renewer thread of the parent process does not exist in a forked child
+            self.__reset()
+        with self.condition:
+            self.held.add(leased_file)
+            if self.renewer is None:
+                self.renewer = threading.Thread(target=self.__renew_leases, name='work-lease-renewer', daemon=True)
+                self.renewer.start()
+
+    def __renew_leases(self):
+        while True:
+            with self.condition:
+                self.condition.wait(self.lease / 3)
+                for leased_file in list(self.held):
+                    try:
+                        os.utime(leased_file)
+                    except FileNotFoundError:
+                        # Completed, or the lease expired and the work was queued again
+                        self.held.discard(leased_file)
+                if not self.held:
+                    self.renewer = None
+                    return
+
+
+def worker_name() -> str:
+    return socket.gethostname() + '-' + str(os.getpid())
+
+
+def key_digest(key: str) -> str:
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def work_key(item: Any) -> str:
+    """
+    :return: A key identifying an exposure or sequence of exposures, the same in every process
+    """
+    if isinstance(item, IExposure):
+        return item.night + '/' + item.raw.name
+    return ','.join(work_key(exposure) for exposure in item)
@@ -16,12 +16,14 @@ else
   quicklook)
     activate_env "$1"
     steps="preprocess calibrations extract leak fittellu ccf products distribute"
-    /data/spirou/apero/trigger/full_trigger.py realtime --processes 8 --steps ${steps}
+    /data/spirou/apero/trigger/full_trigger.py realtime --processes 2 --max-processes 12 --steps ${steps} \
+      --shed-queue-depth 24 --shed-steps preprocess snronly
     ;;
   snr)
     activate_env "$1"
     steps="preprocess calibrations snronly distraw database"
-    /data/spirou/apero/trigger/full_trigger.py realtime --processes 4 --steps ${steps}
+    /data/spirou/apero/trigger/full_trigger.py realtime --processes 1 --max-processes 6 --reserved-processes 1 \
+      --steps ${steps}
     ;;
   *)
     echo "Supported realtime environments are quicklook or snr"
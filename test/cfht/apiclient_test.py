@@ -0,0 +1,79 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+from cfht.apiclient import ApiClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.requests.append(data)
+        status = server.statuses.pop(0) if server.statuses else 200
+        body = json.dumps({'echo': data}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.connections = set()
+    server.requests = []
+    server.statuses = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def stub_url(server):
+    return 'http://127.0.0.1:%d/api' % server.server_address[1]
+
+
+def test_api_client_reuses_connection(stub_server):
+    client = ApiClient()
+    for i in range(5):
+        assert client.json_request(stub_url(stub_server), {'i': i}) == {'echo': {'i': i}}
+    assert len(stub_server.requests) == 5
+    assert len(stub_server.connections) == 1
+    client.close()
+
+
+def test_api_client_retries_server_errors(stub_server):
+    stub_server.statuses = [503, 500]
+    client = ApiClient(backoff=0.01)
+    assert client.json_request(stub_url(stub_server), {'a': 1}, retries=2) == {'echo': {'a': 1}}
+    assert len(stub_server.requests) == 3
+
+
+def test_api_client_does_not_retry_client_errors(stub_server):
+    stub_server.statuses = [404]
+    client = ApiClient(backoff=0.01)
+    with pytest.raises(HTTPError) as err:
+        client.json_request(stub_url(stub_server), {'a': 1}, retries=2)
+    assert err.value.code == 404
+    assert len(stub_server.requests) == 1
+
+
+def test_api_client_connection_error_is_url_error(stub_server):
+    url = stub_url(stub_server)
+    stub_server.shutdown()
+    stub_server.server_close()
+    client = ApiClient(connect_timeout=1, backoff=0.01)
+    with pytest.raises(URLError):
+        client.json_request(url, {'a': 1}, retries=1)
@@ -0,0 +1,69 @@
+import time
+
+from cfht.dbinterface import ExposureStatusCache, QsoDatabase
+
+
+class MockDatabase:
+    def __init__(self):
+        self.requests = []
+
+    def get_exposure_range_by_obsid(self, first, last):
+        self.requests.append((first, last))
+        return {obsid: {'exp_status': 'V', 'grade': 1} for obsid in range(first, last + 1) if obsid % 10}
+
+
+class MockClient:
+    def __init__(self, with_obsid):
+        self.with_obsid = with_obsid
+        self.requests = []
+
+    def json_request(self, url, data, headers=None, retries=0):
+        obsid_range = data['obsid_range']
+        self.requests.append((obsid_range['first'], obsid_range['last']))
+        exposures = []
+        for obsid in range(obsid_range['first'], obsid_range['last'] + 1):
+            status = {'exp_status': 'V', 'grade': obsid}
+            exposures.append({'obsid': obsid, 'exposure_status': status} if self.with_obsid
+                             else {'exposure_status': status})
+        return {'exposure': exposures}
+
+
+def test_exposure_status_cache_prefetch():
+    database = MockDatabase()
+    cache = ExposureStatusCache(database)
+    cache.prefetch(2000, 2300)
+    assert cache.get_exposure(2001) == {'exp_status': 'V', 'grade': 1}
+    assert cache.get_exposure(2010) is None
+    assert len(cache.get_exposure_range(2001, 2004)) == 4
+    assert database.requests == [(2000, 2300)]
+
+
+def test_exposure_status_cache_refreshes_in_bulk():
+    database = MockDatabase()
+    cache = ExposureStatusCache(database, ttl=0.1, missing_ttl=0.1)
+    cache.get_exposure(2001)
+    cache.get_exposure(2002)
+    assert database.requests == [(2001, 2001), (2002, 2002)]
+    time.sleep(0.2)
+    cache.get_exposure(2003)
+    assert database.requests[-1] == (2001, 2003)
+    assert cache.get_exposure(2001) is not None
+    assert len(database.requests) == 3
+
+
+def test_exposure_range_keyed_by_obsid():
+    client = MockClient(with_obsid=True)
+    database = QsoDatabase(client)
+    database.bearer_token = 'token'
+    statuses = database.get_exposure_range_by_obsid(2001, 2003)
+    assert {obsid: status['grade'] for obsid, status in statuses.items()} == {2001: 2001, 2002: 2002, 2003: 2003}
+    assert client.requests == [(2001, 2003)]
+
+
+def test_exposure_range_without_obsid_fetched_one_at_a_time():
+    client = MockClient(with_obsid=False)
+    database = QsoDatabase(client)
+    database.bearer_token = 'token'
+    statuses = database.get_exposure_range_by_obsid(2001, 2003)
+    assert {obsid: status['grade'] for obsid, status in statuses.items()} == {2001: 2001, 2002: 2002, 2003: 2003}
+    assert client.requests == [(2001, 2003), (2001, 2001), (2002, 2002), (2003, 2003)]
@@ -0,0 +1,59 @@
+from urllib.error import URLError
+
+from cfht.dboutbox import DatabaseOutbox
+
+
+class MockDatabase:
+    def __init__(self, failures=0):
+        self.bearer_token = 'token'
+        self.failures = failures
+        self.sent = []
+
+    def post_pipeline_headers(self, header_dict, in_progress=False, retries=0):
+        if self.failures:
+            self.failures -= 1
+            raise URLError('unreachable')
+        self.sent.append((header_dict, in_progress))
+
+
+def test_outbox_coalesces_per_obsid(cache_dir):
+    database = MockDatabase()
+    outbox = DatabaseOutbox(database, cache_dir.joinpath('outbox.sqlite3'), background=False)
+    outbox.add({'obsid': '2001', 'dprtype': 'OBJ_FP'}, in_progress=True)
+    outbox.add({'obsid': '2002', 'dprtype': 'OBJ_FP'}, in_progress=True)
+    outbox.add({'obsid': '2001', 'snr10': 12.5})
+    assert outbox.send_pending() == 2
+    assert sorted(database.sent, key=lambda sent: sent[0]['obsid']) == [
+        ({'obsid': '2001', 'dprtype': 'OBJ_FP', 'snr10': 12.5}, False),
+        ({'obsid': '2002', 'dprtype': 'OBJ_FP'}, True),
+    ]
+    assert outbox.next_due() is None
+
+
+def test_outbox_keeps_final_update_over_later_in_progress(cache_dir):
+    database = MockDatabase()
+    outbox = DatabaseOutbox(database, cache_dir.joinpath('outbox.sqlite3'), background=False)
+    outbox.add({'obsid': '2001', 'dprtype': 'OBJ_FP', 'snr10': 12.5})
+    outbox.add({'obsid': '2001', 'dprtype': 'OBJ_DARK', 'exptime': 300}, in_progress=True)
+    assert outbox.send_pending() == 1
+    assert database.sent == [({'obsid': '2001', 'dprtype': 'OBJ_FP', 'snr10': 12.5, 'exptime': 300}, False)]
+
+
+def test_outbox_retries_across_restarts(cache_dir):
+    path = cache_dir.joinpath('outbox.sqlite3')
+    outbox = DatabaseOutbox(MockDatabase(failures=1), path, background=False, retry_delay=0)
+    outbox.add({'obsid': '2001', 'dprtype': 'OBJ_FP'})
+    assert outbox.send_pending() == 0
+    assert outbox.next_due() == 0
+    database = MockDatabase()
+    restarted = DatabaseOutbox(database, path, background=False)
+    assert restarted.send_pending() == 1
+    assert database.sent == [({'obsid': '2001', 'dprtype': 'OBJ_FP'}, False)]
+
+
+def test_outbox_sends_in_background(cache_dir):
+    database = MockDatabase(failures=1)
+    outbox = DatabaseOutbox(database, cache_dir.joinpath('outbox.sqlite3'), retry_delay=0.1)
+    outbox.add({'obsid': '2001', 'dprtype': 'OBJ_FP'})
+    assert outbox.flush(5)
+    assert database.sent == [({'obsid': '2001', 'dprtype': 'OBJ_FP'}, False)]
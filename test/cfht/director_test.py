@@ -0,0 +1,65 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from cfht.director import DirectorClient
+
+
+class StubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        for line in self.rfile:
+            self.server.lines.append(line.decode('ascii').rstrip('\n'))
+
+
+@pytest.fixture
+def stub_director():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.lines = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for_lines(server, n, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(server.lines) < n and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_director_client_uses_one_connection(stub_director):
+    client = DirectorClient('127.0.0.1', stub_director.server_address[1], messages_per_second=100, burst=10)
+    client.send('first', level='warning')
+    client.send('second')
+    assert client.flush(5)
+    wait_for_lines(stub_director, 2)
+    assert stub_director.lines == ['@say_ warning: first', '@say_ second']
+    assert stub_director.connections == 1
+    client.close()
+
+
+def test_director_client_coalesces_repeats(stub_director):
+    client = DirectorClient('127.0.0.1', stub_director.server_address[1], messages_per_second=100, burst=10)
+    for i in range(4):
+        client.send('cal_ccf failed on ' + str(i), level='warning', key='failures of cal_ccf')
+    client.close()
+    wait_for_lines(stub_director, 2)
+    assert stub_director.lines == [
+        '@say_ warning: cal_ccf failed on 0',
+        '@say_ warning: failures of cal_ccf (3 more in last 60 s), latest: cal_ccf failed on 3',
+    ]
+
+
+def test_director_client_drops_messages_when_unreachable(stub_director):
+    port = stub_director.server_address[1]
+    stub_director.shutdown()
+    stub_director.server_close()
+    client = DirectorClient('127.0.0.1', port, timeout=1)
+    client.send('lost')
+    assert client.flush(5)
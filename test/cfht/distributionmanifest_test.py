@@ -0,0 +1,27 @@
+from cfht.distributionmanifest import DistributionManifest
+
+
+def test_manifest_tracks_source_and_header_values(cache_dir):
+    source = cache_dir.joinpath('2001e.fits')
+    source.write_bytes(b'product')
+    destination = cache_dir.joinpath('dist', '2001e.fits')
+    destination.parent.mkdir()
+    destination.write_bytes(b'product')
+    header_values = {'QSOVALID': ('V', 'QSO validation state'), 'QSOGRADE': (1, 'QSO grade (1=good 5=unusable)')}
+    manifest = DistributionManifest(cache_dir.joinpath('dist'))
+    assert not manifest.is_current(source, 'reduced', header_values, source.stat())
+    manifest.record(source, 'reduced', destination, header_values, source.stat())
+    reopened = DistributionManifest(cache_dir.joinpath('dist'))
+    assert reopened.is_current(source, 'reduced', header_values, source.stat())
+    assert not reopened.is_current(source, 'quicklook', header_values, source.stat())
+    assert not reopened.is_current(source, 'reduced', {**header_values, 'QSOGRADE': (2, '')}, source.stat())
+    source.write_bytes(b'reprocessed product')
+    assert not reopened.is_current(source, 'reduced', header_values, source.stat())
+
+
+def test_manifest_requires_destination(cache_dir):
+    source = cache_dir.joinpath('2001e.fits')
+    source.write_bytes(b'product')
+    manifest = DistributionManifest(cache_dir)
+    manifest.record(source, 'reduced', cache_dir.joinpath('missing.fits'), {}, source.stat())
+    assert not manifest.is_current(source, 'reduced', {}, source.stat())
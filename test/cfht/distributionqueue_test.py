@@ -0,0 +1,43 @@
+import json
+
+from cfht.distributionqueue import DistributionQueue
+
+
+def create_files(directory, n):
+    directory.mkdir()
+    files = []
+    for i in range(n):
+        file = directory.joinpath(str(i) + '.fits')
+        file.write_bytes(bytes([i]) * 1000)
+        files.append(file)
+    return files
+
+
+def test_distribution_queue_flush(tmp_path):
+    sources = create_files(tmp_path.joinpath('source'), 10)
+    destination_dir = tmp_path.joinpath('destination')
+    destination_dir.mkdir()
+    spool_dir = tmp_path.joinpath('spool')
+    distribution_queue = DistributionQueue(spool_dir, max_workers=2, max_bytes_per_second=1e6)
+    for source in sources:
+        distribution_queue.submit(source, destination_dir.joinpath(source.name))
+    assert distribution_queue.active_workers <= 2
+    assert distribution_queue.flush(timeout=10)
+    for source in sources:
+        assert destination_dir.joinpath(source.name).read_bytes() == source.read_bytes()
+    assert list(spool_dir.glob('*')) == []
+
+
+def test_distribution_queue_recover(tmp_path):
+    sources = create_files(tmp_path.joinpath('source'), 2)
+    destination = tmp_path.joinpath('copy.fits')
+    spool_dir = tmp_path.joinpath('spool')
+    spool_dir.mkdir()
+    dead_pid = 2 ** 22 + 1
+    job = {'source': str(sources[1]), 'destination': str(destination)}
+    spool_dir.joinpath('abc.' + str(dead_pid) + '.json').write_text(json.dumps(job))
+    distribution_queue = DistributionQueue(spool_dir)
+    assert distribution_queue.recover() == 1
+    assert distribution_queue.flush(timeout=10)
+    assert destination.read_bytes() == sources[1].read_bytes()
+    assert list(spool_dir.glob('*')) == []
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from cfht.headerpatch import BLOCK_SIZE, patch_primary_header, read_primary_header
+
+
+def create_product(path, n_cards):
+    primary_hdu = fits.PrimaryHDU()
+    primary_hdu.header['RUNID'] = '20AQ01'
+    for i in range(n_cards):
+        primary_hdu.header['KEY' + str(i)] = i
+    flux = fits.ImageHDU(np.arange(10000.0).reshape(100, 100), name='FluxAB')
+    fits.HDUList([primary_hdu, flux]).writeto(path, overwrite=True)
+    return path
+
+
+@pytest.mark.parametrize('n_cards, grows', [(10, False), (30, True)])
+def test_patch_primary_header(tmp_path, n_cards, grows):
+    source = create_product(tmp_path.joinpath('2400000e.fits'), n_cards)
+    destination = tmp_path.joinpath('out.fits')
+    header_values = {'QSOVALID': ('V', 'QSO validation state'), 'QSOGRADE': (1, 'QSO grade'), 'A': 1, 'B': 2}
+    _, header_size = read_primary_header(source)
+    patch_primary_header(source, destination, header_values)
+
+    assert not tmp_path.joinpath('.out.fits.tmp').exists()
+    new_size = destination.stat().st_size
+    assert (new_size == source.stat().st_size + BLOCK_SIZE) if grows else (new_size == source.stat().st_size)
+    with fits.open(destination) as patched, fits.open(source) as original:
+        patched.verify('exception')
+        assert patched[0].header['QSOVALID'] == 'V'
+        assert patched[0].header['QSOGRADE'] == 1
+        assert patched[0].header['RUNID'] == '20AQ01'
+        assert np.array_equal(patched[1].data, original[1].data)
+        assert patched[1].header.tostring() == original[1].header.tostring()
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of the exposure bookkeeping done for every exposure of a night, run with:
+    python -m test.exposure_benchmark [--exposures N] [--repeat N]
+"""
+import argparse
+import pickle
+import tempfile
+import timeit
+from pathlib import Path
+
+from astropy.io import fits
+
+from logger import log
+from realtime.sequencestatetracker import SequenceStateTracker
+from trigger.basedrstrigger import BaseDrsTrigger
+from trigger.common.pathhandler import Exposure, RootDataDirectories
+
+NIGHT = 'benchmark'
+SEQUENCE_LENGTH = 4
+
+
+def create_night(root: Path, count: int):
+    RootDataDirectories.input = root.joinpath('raw')
+    RootDataDirectories.tmp = root.joinpath('tmp')
+    RootDataDirectories.reduced = root.joinpath('reduced')
+    RootDataDirectories.input.joinpath(NIGHT).mkdir(parents=True)
+    filenames = []
+    for i in range(count):
+        hdu = fits.PrimaryHDU()
+        hdu.header['CMPLTEXP'] = i % SEQUENCE_LENGTH + 1
+        hdu.header['NEXP'] = SEQUENCE_LENGTH
+        filename = '{}o.fits'.format(2400000 + i)
+        hdu.writeto(RootDataDirectories.input.joinpath(NIGHT, filename))
+        filenames.append(filename)
+    return filenames
+
+
+def track_night(exposures, sequences):
+    tracker = SequenceStateTracker()
+    tracker.add_unmapped_exposures(exposures)
+    tracker.mark_sequences_complete(sequences)
+    for exposure in exposures:
+        tracker.mark_exposure_processed(exposure)
+        sequence = tracker.get_sequence_if_ready_to_process(exposure)
+        if sequence:
+            tracker.done_with_sequence(sequence)
+
+
+def report(name: str, seconds: float, count: int):
+    print('{:<24} {:>10.3f} ms total {:>8.2f} us/exposure'.format(name, seconds * 1e3, seconds / count * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exposures', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    log.disabled = True
+    with tempfile.TemporaryDirectory() as root:
+        filenames = create_night(Path(root), args.exposures)
+        exposures = [Exposure(NIGHT, filename) for filename in filenames]
+        sequences = BaseDrsTrigger.find_sequences(exposures)
+        benchmarks = {
+            'create exposures': lambda: [Exposure(NIGHT, filename) for filename in filenames],
+            'raw paths': lambda: [exposure.raw for exposure in exposures],
+            'derived paths': lambda: [exposure.final_product('e') for exposure in exposures],
+            'exposure order dict': lambda: {exposure: i for i, exposure in enumerate(exposures)},
+            'sequence state tracker': lambda: track_night(exposures, sequences),
+            'pickle round trip': lambda: pickle.loads(pickle.dumps(exposures)),
+            'find sequences': lambda: BaseDrsTrigger.find_sequences(exposures),
+        }
+        for name, benchmark in benchmarks.items():
+            seconds = min(timeit.repeat(benchmark, number=1, repeat=args.repeat))
+            report(name, seconds, args.exposures)
+
+
+if __name__ == '__main__':
+    main()
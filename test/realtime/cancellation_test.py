@@ -0,0 +1,48 @@
+import time
+from multiprocessing import Queue
+
+from realtime.cancellation import CancellationStore
+from realtime.manager import Realtime
+from realtime.process import RealtimeProcessor
+from test.realtime.helpers import MockCache, MockExposure, TriggerActionT, instant_log, mock_sequence_finder
+
+
+def test_cancellations_are_shared_through_files(cache_dir, night):
+    exposure = MockExposure(cache_dir, night, 'cancelled.fits')
+    store = CancellationStore(cache_dir.joinpath('cancellations'))
+    assert not store.is_cancelled(exposure)
+    store.cancel(exposure)
+    assert CancellationStore(cache_dir.joinpath('cancellations')).is_cancelled(exposure)
+    store.clear(exposure)
+    store.clear(exposure)
+    assert not store.is_cancelled(exposure)
+
+
+def test_cancelled_exposures_are_skipped(cache_dir, link_dir, night, mock_trigger):
+    store = CancellationStore(cache_dir.joinpath('skipped'))
+    processor = RealtimeProcessor(mock_trigger, MockCache(), store)
+    processor.process_id = 0
+    exposures = [MockExposure(link_dir, night, name) for name in ('kept.fits', 'skipped.fits')]
+    store.cancel(exposures[1])
+    exposure_queue, sequence_queue, exposures_done, sequences_done = Queue(), Queue(), Queue(), Queue()
+    for exposure in exposures:
+        exposure_queue.put(exposure)
+    time.sleep(0.1)
+    for _ in exposures:
+        assert processor.process_next_from_queue(exposure_queue, sequence_queue, exposures_done, sequences_done)
+    time.sleep(0.1)
+    # Cancelled work is still reported done, so the manager stops waiting on it
+    assert instant_log(exposures_done) == exposures
+    assert (TriggerActionT.PREPROCESS, exposures[0]) in mock_trigger.log.data
+    assert (TriggerActionT.PREPROCESS, exposures[1]) not in mock_trigger.log.data
+
+
+def test_realtime_cancels_outstanding_exposures(cache_dir, link_dir, night, remote_api, realtime_cache):
+    store = CancellationStore(cache_dir.joinpath('outstanding'))
+    realtime = Realtime(mock_sequence_finder, remote_api, realtime_cache, 0.1, cancellations=store)
+    outstanding = MockExposure(link_dir, night, 'outstanding.fits')
+    realtime.exposures_to_process.append(outstanding)
+    realtime.cancel('finished.fits')
+    realtime.cancel('outstanding.fits')
+    assert store.is_cancelled(outstanding)
+    assert not store.is_cancelled(MockExposure(link_dir, night, 'finished.fits'))
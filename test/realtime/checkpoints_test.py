@@ -0,0 +1,67 @@
+from pathlib import Path
+
+from realtime.checkpoints import StageCheckpointStore
+from test.realtime.helpers import MockExposure
+
+
+class Stage:
+    def __init__(self, result=True, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_finished_stages_are_skipped(cache_dir):
+    exposure = MockExposure(Path('/'), 'night', '2400000o.fits')
+    checkpoints = StageCheckpointStore(cache_dir.joinpath('checkpoints-skip'))
+    extract = Stage()
+    assert checkpoints.run(exposure, 'extract', extract, exposure) is True
+    assert checkpoints.run(exposure, 'extract', extract, exposure) is True
+    assert extract.calls == 1
+    other_exposure = MockExposure(Path('/'), 'night', '2400001o.fits')
+    checkpoints.run(other_exposure, 'extract', extract, other_exposure)
+    assert extract.calls == 2
+
+
+def test_failed_stages_are_run_again(cache_dir):
+    exposure = MockExposure(Path('/'), 'night', '2400000o.fits')
+    checkpoints = StageCheckpointStore(cache_dir.joinpath('checkpoints-failed'))
+    tellu = Stage(error=RuntimeError('crashed'))
+    for _ in range(2):
+        try:
+            checkpoints.run(exposure, 'tellu', tellu)
+        except RuntimeError:
+            pass
+    assert tellu.calls == 2
+    assert checkpoints.get(exposure, 'tellu') == (False, None)
+    ccf = Stage(result=False)
+    assert checkpoints.run(exposure, 'ccf', ccf) is False
+    assert checkpoints.run(exposure, 'ccf', ccf) is False
+    assert ccf.calls == 2
+    assert checkpoints.get(exposure, 'ccf') == (False, None)
+
+
+def test_stages_without_result_are_recorded(cache_dir):
+    exposure = MockExposure(Path('/'), 'night', '2400000o.fits')
+    checkpoints = StageCheckpointStore(cache_dir.joinpath('checkpoints-none'))
+    product = Stage(result=None)
+    assert checkpoints.run(exposure, '2d products', product) is None
+    assert checkpoints.run(exposure, '2d products', product) is None
+    assert product.calls == 1
+    assert checkpoints.get(exposure, '2d products') == (True, None)
+
+
+def test_checkpoints_survive_restart_until_cleared(cache_dir):
+    path = cache_dir.joinpath('checkpoints-restart')
+    exposure = MockExposure(Path('/'), 'night', '2400000o.fits')
+    StageCheckpointStore(path).record(exposure, 'extract', True)
+    checkpoints = StageCheckpointStore(path)
+    assert checkpoints.get(exposure, 'extract') == (True, True)
+    checkpoints.clear(exposure)
+    assert checkpoints.get(exposure, 'extract') == (False, None)
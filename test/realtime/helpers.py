@@ -228,13 +228,14 @@ class StartRealtimeParams(NamedTuple):
     subprocess_tick_interval: float
 
 
-def start_realtime_blocking(api, cache, processor, params, started_running, finished_running, stop_running):
+def start_realtime_blocking(api, cache, processor, params, started_running, finished_running, stop_running,
+                            work_queues=None, **kwargs):
     process_from_queues_partial = partial(process_from_queues, processor)
     start_realtime(mock_sequence_finder, api, cache,
                    init_realtime_process, process_from_queues_partial,
                    params.num_processes, params.fetch_interval, params.tick_interval,
                    params.subprocess_tick_interval,
-                   started_running, finished_running, stop_running)
+                   started_running, finished_running, stop_running, work_queues=work_queues, **kwargs)
 
 
 def stop_after_n_finish(finished_running: Value, target_n: int, stop_running: Event, tick_interval: float):
@@ -246,12 +247,13 @@ def stop_after_n_finish(finished_running: Value, target_n: int, stop_running: Ev
     stop_running.set()
 
 
-def start_realtime_blocking_until_n_finish(api, cache, processor, params, n):
+def start_realtime_blocking_until_n_finish(api, cache, processor, params, n, work_queues=None, **kwargs):
     started_running = Event()
     finished_running = Value('i', 0)
     stop_running = Event()
     p = Process(target=stop_after_n_finish, args=(finished_running, n, stop_running, 0.1))
     p.start()
-    start_realtime_blocking(api, cache, processor, params, started_running, finished_running, stop_running)
+    start_realtime_blocking(api, cache, processor, params, started_running, finished_running, stop_running,
+                            work_queues, **kwargs)
     p.join()
     return finished_running.value
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+import pytest
+
+from realtime.loadshedding import LoadSheddingPolicy, ShedExposureStore
+from test.realtime.helpers import MockExposure
+
+
+def test_load_shedding_policy_limits():
+    policy = LoadSheddingPolicy(max_outstanding=20, max_queue_age=600)
+    assert policy.shed_reason(20, 600) is None
+    assert '21 outstanding' in policy.shed_reason(21, 0)
+    assert 'oldest 900 s' in policy.shed_reason(1, 900)
+    with pytest.raises(ValueError):
+        LoadSheddingPolicy()
+
+
+def test_load_shedding_policy_only_sheds_matching_exposures():
+    policy = LoadSheddingPolicy(max_outstanding=0, sheddable=lambda exposure: exposure.raw.name.endswith('o.fits'))
+    assert policy.can_shed(MockExposure(Path('/'), 'night', '2400000o.fits'))
+    assert not policy.can_shed(MockExposure(Path('/'), 'night', '2400001f.fits'))
+
+
+def test_shed_exposures_are_shared_through_directory(cache_dir):
+    path = cache_dir.joinpath('shed')
+    exposure = MockExposure(Path('/'), 'night', '2400000o.fits')
+    ShedExposureStore(path).shed(exposure)
+    shed_exposures = ShedExposureStore(path)
+    assert shed_exposures.is_shed(exposure)
+    assert not shed_exposures.is_shed(MockExposure(Path('/'), 'night', '2400001o.fits'))
+    shed_exposures.clear(exposure)
+    assert not shed_exposures.is_shed(exposure)
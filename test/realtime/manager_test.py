@@ -7,7 +7,9 @@ from typing import Optional
 
 import pytest
 
-from realtime.typing import BlockingParams, ExposureQueue, IRealtimeProcessor, SequenceQueue
+from realtime.loadshedding import LoadSheddingPolicy, ShedExposureStore
+from realtime.typing import BlockingParams, ExposureQueue, IRealtimeProcessor, SequenceQueue, WorkPriority
+from realtime.workqueue import SpoolWorkQueues
 from test.realtime.helpers import Log, LogActions, MockExposureMetadata, StartRealtimeParams, \
     consistency_check_general, mock_sequence_finder, start_realtime_blocking_until_n_finish
 
@@ -29,7 +31,8 @@ class MockProcessor(IRealtimeProcessor):
 
     def process_next_from_queue(self, exposure_queue: ExposureQueue, sequence_queue: SequenceQueue,
                                 exposures_done: ExposureQueue, sequences_done: SequenceQueue,
-                                block: Optional[BlockingParams] = None) -> bool:
+                                block: Optional[BlockingParams] = None,
+                                priority: WorkPriority = WorkPriority.SEQUENCES_FIRST) -> bool:
         if block:
             while not block.stop_signal.is_set():
                 result = self.__process_next_from_queue(exposure_queue, sequence_queue, exposures_done, sequences_done)
@@ -108,3 +111,28 @@ def test_realtime_save_and_load(remote_api, realtime_cache, mock_processor, real
     realtime_loaded.inject(mock_sequence_finder, remote_api, realtime_cache, 0.01)
     start_realtime_blocking_until_n_finish(remote_api, realtime_cache, mock_processor, realtime_params, 19 - finished)
     consistency_check(mock_processor.log, check_data)
+
+
+def test_realtime_durable_work_queues(remote_api, realtime_cache, mock_processor, realtime_params, test_data,
+                                      check_data, cache_dir):
+    work_queues = SpoolWorkQueues(cache_dir.joinpath('realtime-work'))
+    remote_api.add_new_exposures(test_data)
+    finished = start_realtime_blocking_until_n_finish(remote_api, realtime_cache, mock_processor, realtime_params, 8,
+                                                      work_queues)
+    start_realtime_blocking_until_n_finish(remote_api, realtime_cache, mock_processor, realtime_params, 19 - finished,
+                                           work_queues)
+    consistency_check(mock_processor.log, check_data)
+
+
+def test_realtime_catches_up_on_shed_exposures(remote_api, realtime_cache, mock_processor, realtime_params, test_data,
+                                               check_data, cache_dir):
+    shed_exposures = ShedExposureStore(cache_dir.joinpath('realtime-shed'))
+    remote_api.add_new_exposures(test_data)
+    # Every exposure is shed, then processed again once caught up on
+    start_realtime_blocking_until_n_finish(remote_api, realtime_cache, mock_processor, realtime_params, 32,
+                                           load_shedding=LoadSheddingPolicy(max_outstanding=0),
+                                           shed_exposures=shed_exposures)
+    consistency_check(mock_processor.log, check_data)
+    for exposure in check_data:
+        assert mock_processor.log.data.count((ProcessorActionT.FINISHED, exposure)) == 2
+        assert not shed_exposures.is_shed(exposure)
@@ -4,8 +4,10 @@ from multiprocessing import Event, Pool, Process, Queue
 
 import pytest
 
+from realtime.loadshedding import ShedExposureStore
 from realtime.process import BlockingParams, RealtimeProcessor, init_realtime_process, process_from_queues
-from test.realtime.helpers import MockCache, MockExposure, instant_log
+from realtime.typing import WorkPriority
+from test.realtime.helpers import MockCache, MockExposure, MockTrigger, TriggerActionT, instant_log
 
 
 @pytest.fixture
@@ -61,6 +63,25 @@ def test_process_queues_in_correct_order(realtime_processor, test_data):
     assert r is False
 
 
+def test_process_queues_with_exposures_first(realtime_processor, test_data):
+    exposure_queue, sequence_queue, exposures_done, sequences_done = Queue(), Queue(), Queue(), Queue()
+    exposure_queue.put(test_data[0])
+    sequence_queue.put(test_data[4:8])
+    time.sleep(0.1)
+    queues = (exposure_queue, sequence_queue, exposures_done, sequences_done)
+
+    assert realtime_processor.process_next_from_queue(*queues, priority=WorkPriority.EXPOSURES_ONLY)
+    assert instant_log(exposures_done) == [test_data[0]]
+    # Reserved workers leave sequences to the others
+    assert not realtime_processor.process_next_from_queue(*queues, priority=WorkPriority.EXPOSURES_ONLY)
+    exposure_queue.put(test_data[1])
+    time.sleep(0.1)
+    assert realtime_processor.process_next_from_queue(*queues, priority=WorkPriority.EXPOSURES_FIRST)
+    assert instant_log(exposures_done) == [test_data[1]]
+    assert realtime_processor.process_next_from_queue(*queues, priority=WorkPriority.EXPOSURES_FIRST)
+    assert instant_log(sequences_done) == [test_data[4:8]]
+
+
 def test_process_queues_blocks_and_interruptable(realtime_processor, test_data):
     exposure_queue = Queue()
     sequence_queue = Queue()
@@ -146,3 +167,24 @@ def test_can_start_process_from_pool(realtime_processor, test_data, tasks_before
 
     assert instant_log(exposures_done) == test_data[0:2]
     assert instant_log(sequences_done) == [test_data[4:8]]
+
+
+def test_process_shed_exposures_with_reduced_trigger(mock_trigger, link_dir, session_dir, test_data, cache_dir):
+    reduced_trigger = MockTrigger(link_dir, session_dir)
+    shed_exposures = ShedExposureStore(cache_dir.joinpath('process-shed'))
+    processor = RealtimeProcessor(mock_trigger, MockCache(), shed_exposures=shed_exposures,
+                                  reduced_trigger=reduced_trigger)
+    exposure_queue, sequence_queue, exposures_done, sequences_done = Queue(), Queue(), Queue(), Queue()
+    shed_exposures.shed(test_data[0])
+    exposure_queue.put(test_data[0])
+    exposure_queue.put(test_data[1])
+    time.sleep(0.1)
+    queues = (exposure_queue, sequence_queue, exposures_done, sequences_done)
+
+    assert processor.process_next_from_queue(*queues)
+    assert processor.process_next_from_queue(*queues)
+    assert instant_log(exposures_done) == test_data[0:2]
+    assert list(reduced_trigger.log.data) == [(TriggerActionT.PREPROCESS, test_data[0]),
+                                              (TriggerActionT.PROCESS_FILE, test_data[0])]
+    assert list(mock_trigger.log.data) == [(TriggerActionT.PREPROCESS, test_data[1]),
+                                           (TriggerActionT.PROCESS_FILE, test_data[1])]
@@ -0,0 +1,183 @@
+import os
+import queue
+import time
+from multiprocessing import Queue
+
+from realtime.typing import WorkPriority
+from realtime.workerpool import AutoscalePolicy, RecyclePolicy, WorkerPool, current_rss
+
+
+def test_autoscale_policy_follows_outstanding_work():
+    policy = AutoscalePolicy(2, 6, scale_down_delay=0)
+    assert policy.decide(2, 0, 0, 0.1).workers == 2
+    assert policy.decide(2, 5, 10, 0.1).workers == 5
+    assert policy.decide(5, 20, 10, 0.1).workers == 6
+    assert policy.decide(6, 1, 10, 0.1).workers == 5
+    assert policy.decide(5, 1, 10, 0.1).workers == 4
+
+
+def test_autoscale_policy_waits_on_load_unless_work_is_old():
+    policy = AutoscalePolicy(1, 4, max_queue_age=60, max_load=1.0)
+    decision = policy.decide(1, 3, 10, 2.0)
+    assert decision.workers == 1
+    assert decision.reason is None
+    decision = policy.decide(1, 3, 90, 2.0)
+    assert decision.workers == 3
+    assert 'oldest 90 s' in decision.reason
+
+
+def test_autoscale_policy_delays_scale_down():
+    policy = AutoscalePolicy(1, 4, scale_down_delay=60)
+    assert policy.decide(4, 4, 0, 0.1).workers == 4
+    assert policy.decide(4, 0, 0, 0.1).workers == 4
+    policy.last_busy -= 60
+    assert policy.decide(4, 0, 0, 0.1).workers == 3
+    assert policy.decide(3, 0, 0, 0.1).workers == 3
+    policy.last_busy -= 60
+    assert policy.decide(3, 0, 0, 0.1).workers == 2
+
+
+def init_worker(retry_interval, stop_signal, exposure_queue, *args):
+    global worker_stop_signal, started
+    worker_stop_signal = stop_signal
+    started = exposure_queue
+
+
+def wait_for_stop():
+    started.put(True)
+    worker_stop_signal.wait()
+    return False
+
+
+def test_worker_pool_resizes_gracefully():
+    started = Queue()
+    pool = WorkerPool(init_worker, wait_for_stop, 0.01, (started, None, None, None), 3)
+    pool.maintain()
+    for _ in range(3):
+        started.get(timeout=10)
+    pool.resize(1)
+    assert pool.size == 1
+    deadline = time.monotonic() + 10
+    while len(pool.workers) > 1 and time.monotonic() < deadline:
+        pool.maintain()
+        time.sleep(0.05)
+    assert len(pool.workers) == 1
+    pool.resize(2)
+    pool.maintain()
+    assert pool.size == 2
+    pool.stop()
+    assert not pool.workers
+
+
+def test_recycle_policy_limits_memory_and_tasks():
+    policy = RecyclePolicy(max_rss=1000, max_tasks=10)
+    assert policy.retire_reason(1, 500) is None
+    assert policy.retire_reason(1, None) is None
+    assert 'RSS 1200 MB' in policy.retire_reason(2, 1200)
+    assert policy.retire_reason(10, 500) == 'finished 10 tasks'
+    assert RecyclePolicy(max_rss=1000).retire_reason(1000, 500) is None
+    assert RecyclePolicy.every_task().retire_reason(1, None) == 'finished 1 tasks'
+    assert current_rss() > 0
+
+
+def init_task_worker(retry_interval, stop_signal, work_queue, done_queue, *args):
+    global worker_stop_signal, work, done
+    worker_stop_signal = stop_signal
+    work = work_queue
+    done = done_queue
+
+
+def take_task():
+    while not worker_stop_signal.is_set():
+        try:
+            item = work.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        done.put((item, os.getpid()))
+        return True
+    return False
+
+
+def run_tasks(pool, work_queue, done_queue, tasks):
+    for task in range(tasks):
+        work_queue.put(task)
+    results = []
+    deadline = time.monotonic() + 20
+    while len(results) < tasks and time.monotonic() < deadline:
+        pool.maintain()
+        try:
+            results.append(done_queue.get(timeout=0.05))
+        except queue.Empty:
+            pass
+    return results
+
+
+def test_worker_pool_recycles_workers_between_tasks():
+    work_queue, done_queue = Queue(), Queue()
+    pool = WorkerPool(init_task_worker, take_task, 0.01, (work_queue, done_queue, None, None), 1,
+                      RecyclePolicy(max_tasks=2), spares=1)
+    pool.maintain()
+    assert pool.size == 1
+    assert pool.spare_count == 1
+    results = run_tasks(pool, work_queue, done_queue, 6)
+    assert sorted(task for task, _ in results) == list(range(6))
+    pids = [pid for _, pid in results]
+    # Each worker is retired after exactly two tasks and replaced by a spare
+    assert all(pids.count(pid) == 2 for pid in pids)
+    assert len(set(pids)) == 3
+    pool.maintain()
+    assert pool.recycled >= 2
+    assert pool.size == 1
+    assert pool.spare_count == 1
+    pool.stop()
+    assert not pool.workers
+
+
+def test_worker_pool_recycles_workers_over_memory_limit():
+    for max_rss, workers_used in ((1e9, 1), (0, 3)):
+        work_queue, done_queue = Queue(), Queue()
+        pool = WorkerPool(init_task_worker, take_task, 0.01, (work_queue, done_queue, None, None), 1,
+                          RecyclePolicy(max_rss=max_rss), spares=1)
+        pool.maintain()
+        results = run_tasks(pool, work_queue, done_queue, 3)
+        assert len({pid for _, pid in results}) == workers_used
+        pool.stop()
+
+
+def init_priority_worker(retry_interval, stop_signal, work_queue, done_queue, exposures_done, sequences_done,
+                         priority):
+    global worker_stop_signal, work, done, worker_priority
+    worker_stop_signal = stop_signal
+    work = work_queue
+    done = done_queue
+    worker_priority = priority
+
+
+def take_task_reporting_priority():
+    while not worker_stop_signal.is_set():
+        try:
+            item = work.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        done.put((item, WorkPriority(worker_priority.value)))
+        return True
+    return False
+
+
+def test_worker_pool_keeps_reserved_workers():
+    work_queue, done_queue = Queue(), Queue()
+    pool = WorkerPool(init_priority_worker, take_task_reporting_priority, 0.01, (work_queue, done_queue, None, None),
+                      1, RecyclePolicy(max_tasks=1), spares=1, priority=WorkPriority.EXPOSURES_FIRST, reserved=1)
+    pool.maintain()
+    assert pool.size == 1
+    assert pool.reserved_count == 1
+    assert pool.spare_count == 1
+    results = run_tasks(pool, work_queue, done_queue, 6)
+    assert {priority for _, priority in results} == {WorkPriority.EXPOSURES_FIRST, WorkPriority.EXPOSURES_ONLY}
+    # Resizing leaves the reserved workers alone
+    pool.resize(0)
+    pool.maintain()
+    assert pool.size == 0
+    assert pool.reserved_count == 1
+    pool.stop()
+    assert not pool.workers
@@ -0,0 +1,87 @@
+import os
+import queue
+import signal
+from multiprocessing import Event, Process
+
+import pytest
+
+from realtime.process import RealtimeProcessor
+from realtime.workqueue import SpoolWorkQueues
+from test.realtime.helpers import MockCache, MockExposure, instant_log
+
+
+@pytest.fixture
+def test_data(link_dir, night):
+    return [MockExposure(link_dir, night, str(i) + '.fits') for i in range(0, 12)]
+
+
+def test_work_is_leased_until_done(cache_dir, test_data):
+    exposures, sequences, exposures_done, _ = SpoolWorkQueues(cache_dir.joinpath('queue-lease')).queues()
+    exposures.put(test_data[0])
+    exposures.requeue(test_data[0])
+    exposures.put(test_data[1])
+    assert exposures.get(block=False) == test_data[0]
+    assert exposures.get(block=False) == test_data[1]
+    with pytest.raises(queue.Empty):
+        exposures.get(block=False)
+    assert exposures.empty()
+    # Work leased to a worker is not requeued, but a new copy of it is queued
+    exposures.requeue(test_data[0])
+    assert exposures.empty()
+    exposures.put(test_data[0])
+    assert exposures.get(block=False) == test_data[0]
+    exposures_done.put(test_data[0])
+    assert exposures_done.get(block=False) == test_data[0]
+    assert exposures_done.empty()
+    # Work which is done can be queued again
+    exposures.put(test_data[0])
+    assert exposures.get(block=False) == test_data[0]
+
+
+def hold_work(path, held):
+    exposures = SpoolWorkQueues(path, lease=1.0).queues()[0]
+    exposures.get(block=False)
+    held.set()
+    signal.pause()
+
+
+def test_work_held_by_dead_worker_is_handed_out_again(cache_dir, test_data):
+    path = cache_dir.joinpath('queue-dead')
+    exposures = SpoolWorkQueues(path, lease=1.0).queues()[0]
+    exposures.put(test_data[0])
+    held = Event()
+    worker = Process(target=hold_work, args=(path, held))
+    worker.start()
+    held.wait(10)
+    # The lease is renewed while the worker is alive
+    with pytest.raises(queue.Empty):
+        exposures.get(timeout=1.5)
+    os.kill(worker.pid, signal.SIGKILL)
+    worker.join()
+    assert exposures.get(timeout=5) == test_data[0]
+
+
+def run_node(processor, path):
+    processor.process_id = os.getpid()
+    queues = SpoolWorkQueues(path).queues()
+    while processor.process_next_from_queue(*queues):
+        pass
+
+
+def test_several_nodes_share_work(cache_dir, mock_trigger, test_data):
+    path = cache_dir.joinpath('queue-nodes')
+    exposures, sequences, exposures_done, sequences_done = SpoolWorkQueues(path).queues()
+    for exposure in test_data[:8]:
+        exposures.put(exposure)
+    sequences.put(tuple(test_data[8:12]))
+    processor = RealtimeProcessor(mock_trigger, MockCache())
+    nodes = [Process(target=run_node, args=(processor, path)) for _ in range(3)]
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join()
+    done = instant_log(exposures_done)
+    assert len(done) == 8
+    assert set(done) == set(test_data[:8])
+    assert instant_log(sequences_done) == [tuple(test_data[8:12])]
+    assert exposures.empty() and sequences.empty()
@@ -0,0 +1,82 @@
+"""
+Benchmark of finding sequences in a night whose exposures arrive out of order, run with:
+    python -m test.sequence_benchmark [--exposures N] [--delay N] [--repeat N]
+"""
+import argparse
+import random
+import tempfile
+import timeit
+from pathlib import Path
+
+from astropy.io import fits
+
+from logger import log
+from trigger.basedrstrigger import BaseDrsTrigger
+from trigger.common.pathhandler import Exposure, RootDataDirectories
+
+NIGHT = 'benchmark'
+SEQUENCE_LENGTH = 4
+
+
+def create_night(root: Path, count: int, with_ids: bool):
+    RootDataDirectories.input = root.joinpath('raw')
+    RootDataDirectories.tmp = root.joinpath('tmp')
+    RootDataDirectories.reduced = root.joinpath('reduced')
+    RootDataDirectories.input.joinpath(NIGHT).mkdir(parents=True)
+    filenames = []
+    for i in range(count):
+        hdu = fits.PrimaryHDU()
+        hdu.header['CMPLTEXP'] = i % SEQUENCE_LENGTH + 1
+        hdu.header['NEXP'] = SEQUENCE_LENGTH
+        if with_ids:
+            hdu.header['OCTOKEN'] = 'token{}'.format(i // SEQUENCE_LENGTH)
+            hdu.header['OCEXPNUM'] = 1
+        filename = '{}o.fits'.format(2400000 + i)
+        hdu.writeto(RootDataDirectories.input.joinpath(NIGHT, filename))
+        filenames.append(filename)
+    return filenames
+
+
+def arrival_order(exposures, delay: int, seed: int = 0):
+    """
+    :param delay: The most exposures by which an exposure can arrive late
+    """
+    rng = random.Random(seed)
+    delayed = [(i + rng.uniform(0, delay), exposure) for i, exposure in enumerate(exposures)]
+    return [exposure for _, exposure in sorted(delayed, key=lambda arrival: arrival[0])]
+
+
+def broken_sequences(sequences) -> int:
+    return sum(1 for sequence in sequences if len(sequence) != SEQUENCE_LENGTH)
+
+
+def report(name: str, seconds: float, count: int, broken: int):
+    print('{:<28} {:>10.3f} ms total {:>8.2f} us/exposure {:>6} broken sequences'.format(
+        name, seconds * 1e3, seconds / count * 1e6, broken))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exposures', type=int, default=2000)
+    parser.add_argument('--delay', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    log.disabled = True
+    for with_ids in (True, False):
+        with tempfile.TemporaryDirectory() as root:
+            filenames = create_night(Path(root), args.exposures, with_ids)
+            in_order = [Exposure(NIGHT, filename) for filename in filenames]
+            shuffled = arrival_order(in_order, args.delay)
+            keywords = 'OCTOKEN' if with_ids else 'no OCTOKEN'
+            benchmarks = {
+                'in order, ' + keywords: in_order,
+                'shuffled, ' + keywords: shuffled,
+            }
+            for name, exposures in benchmarks.items():
+                seconds = min(timeit.repeat(lambda: BaseDrsTrigger.find_sequences(exposures), number=1,
+                                            repeat=args.repeat))
+                report(name, seconds, args.exposures, broken_sequences(BaseDrsTrigger.find_sequences(exposures)))
+
+
+if __name__ == '__main__':
+    main()
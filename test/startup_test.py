@@ -0,0 +1,34 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# Import time budgets in seconds for modules on the CLI startup path, which must not load APERO
+IMPORT_TIME_BUDGETS = {
+    'full_trigger': 0.5,
+    'offline_trigger': 0.5,
+    'trigger.common': 2.0,
+    'cfht': 3.0,
+}
+
+
+def measure_import(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=str(REPO_ROOT), stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                imported[name.strip()] = int(cumulative) / 1e6
+    return imported
+
+
+@pytest.mark.parametrize('module', IMPORT_TIME_BUDGETS)
+def test_import_time_budget(module):
+    imported = measure_import(module)
+    assert not [name for name in imported if name.split('.')[0] == 'apero']
+    assert imported[module] < IMPORT_TIME_BUDGETS[module]
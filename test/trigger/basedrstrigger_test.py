@@ -14,8 +14,10 @@ def setup_data_dirs(data_dir, night):
     RootDataDirectories.input.joinpath(night).mkdir()
 
 
-def create_test_file(night, filename, index, count, dprtype=None):
+def create_test_file(night, filename, index, count, dprtype=None, sequence_id=None):
     hdu = fits.PrimaryHDU()
+    if sequence_id:
+        hdu.header['OCTOKEN'], hdu.header['OCEXPNUM'] = sequence_id
     if index:
         hdu.header['CMPLTEXP'] = index
     if count:
@@ -48,6 +50,25 @@ def generate_test_data(night):
     create_test_file(night, '15.fits', 1, 4)
 
 
+@pytest.fixture(scope='session')
+def shuffled_exposures(night):
+    # Two interleaved sequences, arriving out of order, the first of them repeated and an exposure of it redone
+    files = [
+        ('a1-3.fits', 3, 3, ('A', 1)),
+        ('b1-1.fits', 1, 2, ('B', 1)),
+        ('a1-1.fits', 1, 3, ('A', 1)),
+        ('b1-2.fits', 2, 2, ('B', 1)),
+        ('n-1.fits', 1, 1, None),
+        ('a1-2.fits', 2, 3, ('A', 1)),
+        ('a2-1.fits', 1, 3, ('A', 2)),
+        ('a2-1-redo.fits', 1, 3, ('A', 2)),
+        ('c1-1.fits', 1, 2, ('C', 1)),
+    ]
+    for filename, index, count, sequence_id in files:
+        create_test_file(night, filename, index, count, sequence_id=sequence_id)
+    return [Exposure(night, filename) for filename, *_ in files]
+
+
 @pytest.fixture(scope='session')
 def night():
     return 'test'
@@ -98,3 +119,52 @@ def test_find_sequences_without_incomplete(exposures):
         ['8.fits', '9.fits', '10.fits'],  # This is still returned even though an exposure was skipped... is that good?
         ['11.fits', '12.fits', '13.fits', '14.fits'],
     ]
+
+
+def test_find_sequences_by_id_in_any_order(shuffled_exposures):
+    sequences = BaseDrsTrigger.find_sequences(shuffled_exposures)
+    assert sequences_to_names(sequences) == [
+        ['a1-1.fits', 'a1-2.fits', 'a1-3.fits'],
+        ['b1-1.fits', 'b1-2.fits'],
+        ['n-1.fits'],
+        ['a2-1-redo.fits'],
+        ['c1-1.fits'],
+    ]
+
+
+def test_find_sequences_by_id_without_incomplete_last(shuffled_exposures, night):
+    sequences = BaseDrsTrigger.find_sequences(shuffled_exposures, ignore_incomplete_last=True)
+    # The last sequence may still be completed, but the repeated observation stopped once another arrived after it
+    assert sequences_to_names(sequences) == [
+        ['a1-1.fits', 'a1-2.fits', 'a1-3.fits'],
+        ['b1-1.fits', 'b1-2.fits'],
+        ['n-1.fits'],
+        ['a2-1-redo.fits'],
+    ]
+    create_test_file(night, 'a3-1.fits', 1, 3, sequence_id=('A', 3))
+    sequences = BaseDrsTrigger.find_sequences(shuffled_exposures + [Exposure(night, 'a3-1.fits')],
+                                              ignore_incomplete_last=True)
+    # Until another exposure arrives
+    assert sequences_to_names(sequences)[4:] == [['c1-1.fits']]
+
+
+@pytest.mark.parametrize('with_ids', [True, False])
+def test_find_sequences_stopped_short(night, with_ids):
+    # A polar sequence stopped after 2 of 4 exposures, followed by other targets
+    files = [
+        ('stop-{}-a1.fits', 1, 4, ('STOPA', 1)),
+        ('stop-{}-a2.fits', 2, 4, ('STOPA', 1)),
+        ('stop-{}-b1.fits', 1, 1, ('STOPB', 1)),
+        ('stop-{}-c1.fits', 1, 1, ('STOPC', 1)),
+    ]
+    exposures = []
+    for filename, index, count, sequence_id in files:
+        filename = filename.format(with_ids)
+        create_test_file(night, filename, index, count, sequence_id=sequence_id if with_ids else None)
+        exposures.append(Exposure(night, filename))
+    sequences = BaseDrsTrigger.find_sequences(exposures, ignore_incomplete_last=True)
+    assert sequences_to_names(sequences) == [[exposures[0].raw.name, exposures[1].raw.name],
+                                             [exposures[2].raw.name], [exposures[3].raw.name]]
+    # Still waiting on the rest of the sequence while nothing else has arrived
+    sequences = BaseDrsTrigger.find_sequences(exposures[:2], ignore_incomplete_last=True)
+    assert sequences == []
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+from astropy.io import fits
+
+from trigger.baseinterface.recipecosts import CostContext
+from trigger.common import DrsSteps, Exposure
+from trigger.common.drsconstants import RootDataDirectories
+from trigger.common.executionplan import ExecutionPlan, RecipeStage
+from trigger.common.recipecosts import RecipeCostStore
+from trigger.drstrigger import DrsTrigger
+from trigger.fileselector import FileSelectionFilters
+from trigger.headerchecker import RawSpirouHeaderChecker
+
+NIGHT = 'plan-night'
+
+# Raw calibration sequences in observing order, without DPRTYPE since they have not been preprocessed
+CALIBRATIONS = (
+    ('dark_int', 'd', 1, {'SBCCAS_P': 'pos_pk', 'SBCREF_P': 'pos_pk', 'SBCALI_P': 'P4'}),
+    ('dark_tel', 'd', 1, {'SBCCAS_P': 'pos_pk', 'SBCREF_P': 'pos_pk', 'SBCALI_P': 'P5'}),
+    ('flat_flat', 'f', 2, {'SBCCAS_P': 'pos_wl', 'SBCREF_P': 'pos_wl'}),
+    ('dark_flat', 'f', 1, {'SBCCAS_P': 'pos_pk', 'SBCREF_P': 'pos_wl'}),
+    ('flat_dark', 'f', 1, {'SBCCAS_P': 'pos_wl', 'SBCREF_P': 'pos_pk'}),
+    ('fp_fp', 'a', 1, {'SBCCAS_P': 'pos_fp', 'SBCREF_P': 'pos_fp'}),
+    ('hcone_hcone', 'c', 1, {'SBCCAS_P': 'pos_hc1', 'SBCREF_P': 'pos_hc1'}),
+)
+
+
+@pytest.fixture
+def raw_night(tmp_path):
+    # Read from the class dict, since getting an unset directory would load the DRS config
+    directories = {name: RootDataDirectories.__dict__[name] for name in ('input', 'tmp', 'reduced')}
+    RootDataDirectories.input = tmp_path.joinpath('raw')
+    RootDataDirectories.tmp = tmp_path.joinpath('tmp')
+    RootDataDirectories.reduced = tmp_path.joinpath('reduced')
+    RootDataDirectories.input.joinpath(NIGHT).mkdir(parents=True)
+    odometer = 1000000
+    for _, extension, count, keywords in CALIBRATIONS:
+        for index in range(1, count + 1):
+            odometer += 1
+            hdu = fits.PrimaryHDU()
+            hdu.header.update(keywords)
+            hdu.header.update({'OBSTYPE': 'CALIB', 'MJDATE': 59000 + odometer / 1e6, 'CMPLTEXP': index,
+                               'NEXP': count, 'EXPTIME': 10, 'EXPREQ': 10})
+            hdu.writeto(Exposure(NIGHT, '{}{}.fits'.format(odometer, extension)).raw)
+    yield
+    for name, directory in directories.items():
+        setattr(RootDataDirectories, name, directory)
+
+
+def test_raw_headers_give_dpr_type(raw_night):
+    dpr_types = [RawSpirouHeaderChecker(file).get_dpr_type()
+                 for file in sorted(RootDataDirectories.input.joinpath(NIGHT).iterdir())]
+    assert dpr_types == ['DARK_DARK_INT', 'DARK_DARK_TEL', 'FLAT_FLAT', 'FLAT_FLAT', 'DARK_FLAT', 'FLAT_DARK',
+                         'FP_FP', 'HCONE_HCONE']
+
+
+def test_plans_night_without_preprocessed_files(raw_night, tmp_path):
+    costs = RecipeCostStore(tmp_path.joinpath('costs'))
+    costs.record('cal_wave_night_spirou', CostContext('HCONE_HCONE'), 1000)
+    trigger = DrsTrigger(DrsSteps.all())
+    trigger.set_recipe_costs(costs)
+    plan = ExecutionPlan()
+    trigger.plan(plan)
+    trigger.reduce_night(NIGHT, FileSelectionFilters())
+
+    recipes = [recipe.recipe for recipe in plan.recipes]
+    assert recipes == ['cal_preprocess_spirou'] * 8 + [
+        'cal_badpix_spirou', 'cal_loc_spirou', 'cal_loc_spirou', 'cal_shape_spirou', 'cal_flat_spirou',
+        'cal_thermal_spirou', 'cal_thermal_spirou', 'cal_wave_night_spirou']
+    badpix = plan.recipes[8]
+    assert badpix.stage == RecipeStage.CALIBRATION
+    # Waits for the flats and dark it reads to be preprocessed
+    assert badpix.dependencies == [1, 2, 3]
+    wave = plan.recipes[-1]
+    assert wave.cost == 1000
+    # Waits for its own preprocessing, the FP shape and the last thermal
+    assert wave.dependencies == [7, 11, 14]
+    # Each calibration waits for the one before
+    assert [recipe.index for recipe in plan.critical_path()] == [1, *range(8, 16)]
+    assert plan.to_dict()['critical_path_cost'] == 60 * 8 + 1000
+    assert plan.makespan(1) == plan.total_cost == 60 * 15 + 1000
+    assert plan.makespan(4) == 60 * 8 + 1000
+    # Nothing was run
+    assert not RootDataDirectories.tmp.exists()
+    assert json.loads(json.dumps(plan.to_dict(4)))['wall_time'] == 60 * 8 + 1000
+
+
+def test_independent_nights_run_in_parallel():
+    plan = ExecutionPlan()
+    for night in ('a', 'b'):
+        plan.add('cal_preprocess_spirou', RecipeStage.PREPROCESS, [Exposure(night, '1o.fits')], '', 10)
+        plan.add('cal_extract_spirou', RecipeStage.OBJECT, [Exposure(night, '1o.fits')], '', 100)
+        plan.add('cal_preprocess_spirou', RecipeStage.PREPROCESS, [Exposure(night, '2o.fits')], '', 10)
+    assert [recipe.dependencies for recipe in plan.recipes] == [[], [0], [], [], [3], []]
+    assert plan.makespan(1) == 240
+    # The chains leading to the extractions start first, leaving the other preprocessing for the end
+    assert plan.makespan(2) == 120
+    assert plan.makespan(4) == 110
+    assert [recipe.index for recipe in plan.critical_path()] == [0, 1]
@@ -0,0 +1,41 @@
+import numpy as np
+from astropy.io import fits
+
+from trigger.processor.packager import fitsoperations as fits_op
+
+
+def create_headers():
+    primary_header = fits.Header()
+    primary_header['SIMPLE'] = True
+    primary_header['OBJECT'] = 'Gl699'
+    primary_header['EXPTIME'] = 200.0
+    primary_header['RUNID'] = '20AQ01'
+    primary_header['COMMENT'] = 'primary comment'
+    ext_header = fits.ImageHDU(np.zeros((2, 2))).header
+    ext_header['EXTNAME'] = 'FluxAB'
+    ext_header['OBJECT'] = 'Gl699'
+    ext_header['EXPTIME'] = 100.0
+    ext_header['RUNID'] = '20AQ01'
+    ext_header['EXTSN010'] = 42.0
+    return primary_header, ext_header
+
+
+def test_remove_duplicate_cards_matches_verify_and_remove():
+    primary_header, ext_header = create_headers()
+    expected_header = ext_header.copy()
+    expected_keys = fits_op.verify_duplicate_cards(expected_header, primary_header.items())
+    fits_op.remove_keys(expected_header, expected_keys)
+
+    dupe_keys = fits_op.remove_duplicate_cards(ext_header, primary_header.items())
+    assert dupe_keys == expected_keys == ['OBJECT', 'RUNID']
+    assert ext_header.tostring() == expected_header.tostring()
+    assert 'EXPTIME' in ext_header
+    assert 'EXTSN010' in ext_header
+    assert list(ext_header.keys())[:3] == ['XTENSION', 'BITPIX', 'NAXIS']
+
+
+def test_remove_duplicate_cards_no_duplicates():
+    primary_header, ext_header = create_headers()
+    original = ext_header.tostring()
+    assert fits_op.remove_duplicate_cards(ext_header, [('EXPTIME', 1.0)]) == []
+    assert ext_header.tostring() == original
@@ -0,0 +1,103 @@
+import pytest
+from astropy.io import fits
+
+from trigger.common import CalibrationStep, Exposure, ObjectStep, PreprocessStep, TargetType
+from trigger.common.drsconstants import RootDataDirectories
+from trigger.fileselector import FileSelectionFilters, FileSelector, SingleFileSelector
+from trigger.nighttable import NightTable
+
+NIGHT = 'table-night'
+SPECTROSCOPY = {'SBRHB1_P': 'P16', 'SBRHB2_P': 'P16'}
+POLAR = {'SBRHB1_P': 'P14', 'SBRHB2_P': 'P16'}
+
+# Exposures in the order they were written, which is not the order they were taken in
+EXPOSURES = (
+    ('1000005o.fits', 5, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_FP', 'OBJECT': 'Gl699', 'RUNID': '20AQ01',
+                          **SPECTROSCOPY}),
+    ('1000001d.fits', 1, {'OBSTYPE': 'CALIB', 'DPRTYPE': 'DARK_DARK_INT'}),
+    ('1000002f.fits', 2, {'OBSTYPE': 'CALIB', 'DPRTYPE': 'FLAT_FLAT'}),
+    ('1000003a.fits', 3, {'OBSTYPE': 'CALIB', 'DPRTYPE': 'FP_FP'}),
+    ('1000004o.fits', 4, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_DARK', 'OBJECT': 'HD 1', 'RUNID': '20AQ01',
+                          **SPECTROSCOPY}),
+    ('1000006o.fits', 6, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_DARK', 'OBJECT': 'sky_Gl699', 'RUNID': '20AQ02',
+                          **SPECTROSCOPY}),
+    ('1000007o.fits', 7, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_DARK', 'OBJECT': 'Gl699', 'RUNID': '20AQ02',
+                          **POLAR}),
+    ('1000008o.fits', 8, {'OBSTYPE': 'OBJECT', 'OBJECT': 'Gl699', **SPECTROSCOPY}),
+    ('1000009o.fits', 9, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_DARK', 'OBJECT': 'Gl699', 'RUNID': '20AQ01',
+                          'EXPTIME': 1, **SPECTROSCOPY}),
+    ('1000010o.fits', None, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_DARK', 'OBJECT': 'Gl699', 'RUNID': '20AQ01',
+                             **SPECTROSCOPY}),
+    ('1000011c.fits', 11, {'OBSTYPE': 'CALIB', 'DPRTYPE': 'HCONE_HCONE'}),
+    ('1000012o.fits', 12, {'OBSTYPE': 'OBJECT', 'DPRTYPE': 'OBJ_DARK', 'OBJECT': 'Gl15A', 'RUNID': '20AQ02',
+                           **SPECTROSCOPY}),
+)
+
+
+@pytest.fixture
+def table_night(tmp_path, monkeypatch):
+    monkeypatch.setattr('trigger.nighttable.get_telluric_standards', lambda: ['HD 1'])
+    monkeypatch.setattr('trigger.common.exposureconfig.get_telluric_standards', lambda: ['HD 1'])
+    # Read from the class dict, since getting an unset directory would load the DRS config
+    directories = {name: RootDataDirectories.__dict__[name] for name in ('input', 'tmp', 'reduced')}
+    RootDataDirectories.input = tmp_path.joinpath('raw')
+    RootDataDirectories.tmp = tmp_path.joinpath('tmp')
+    RootDataDirectories.reduced = tmp_path.joinpath('reduced')
+    RootDataDirectories.input.joinpath(NIGHT).mkdir(parents=True)
+    exposures = []
+    for filename, odometer, keywords in EXPOSURES:
+        hdu = fits.PrimaryHDU()
+        hdu.header.update({'EXPTIME': 100, 'EXPREQ': 100, 'CMPLTEXP': 1, 'NEXP': 1})
+        hdu.header.update(keywords)
+        if odometer:
+            hdu.header['MJDATE'] = 59000 + odometer / 100
+        exposure = Exposure(NIGHT, filename)
+        hdu.writeto(exposure.raw)
+        exposures.append(exposure)
+    yield exposures
+    for name, directory in directories.items():
+        setattr(RootDataDirectories, name, directory)
+
+
+def names(exposures):
+    return [exposure.raw.name for exposure in exposures]
+
+
+def select_one_at_a_time(exposures, steps, filters):
+    selected = {}
+    for exposure in exposures:
+        result = SingleFileSelector(exposure, steps).is_desired_file(filters)
+        if result and result[1].get_obs_date():
+            selected.setdefault(result[0], []).append((result[1].get_obs_date(), exposure))
+    return [names(exposure for _, exposure in sorted(selected.get(file_type, []), key=lambda item: item[0]))
+            for file_type in sorted(selected, key=lambda file_type: file_type.value)]
+
+
+def test_classifies_each_distinct_configuration_once(table_night):
+    table = NightTable.read(exposure.raw for exposure in table_night)
+    configs, config_indexes = table.exposure_configs()
+    assert len(configs) == 11
+    targets = [configs[index].object.target if configs[index].object else None for index in config_indexes]
+    assert targets == [TargetType.STAR, None, None, None, TargetType.TELLURIC_STANDARD, TargetType.SKY,
+                       TargetType.STAR, TargetType.STAR, TargetType.STAR, TargetType.STAR, None, TargetType.STAR]
+    assert configs[config_indexes[8]].is_aborted
+    # Stars only differing by name, RUNID and MJDATE share a configuration
+    assert config_indexes[9] == config_indexes[11]
+
+
+@pytest.mark.parametrize('steps', [
+    [PreprocessStep.PPCAL, PreprocessStep.PPOBJ, *CalibrationStep, ObjectStep.EXTRACT],
+    [CalibrationStep.WAVE, ObjectStep.LEAK, ObjectStep.POL],
+    [ObjectStep.FITTELLU],
+])
+@pytest.mark.parametrize('filters', [
+    FileSelectionFilters(),
+    FileSelectionFilters(runids=['20AQ01']),
+    FileSelectionFilters(targets=['Gl699']),
+])
+def test_selects_as_reading_one_header_at_a_time(table_night, steps, filters):
+    calibrations, objects = FileSelector().sort_and_filter_files_split(table_night, steps, filters)
+    expected = select_one_at_a_time(table_night, steps, filters)
+    assert [selected for selected in (names(calibrations), names(objects)) if selected] == expected
+    combined = FileSelector().sort_and_filter_files_combined(table_night, steps, filters)
+    assert sorted(names(combined)) == sorted(sum(expected, []))
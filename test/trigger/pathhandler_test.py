@@ -0,0 +1,30 @@
+import pickle
+from pathlib import Path
+
+from test.realtime.helpers import MockExposure
+from trigger.common.pathhandler import Exposure, Night
+
+
+def test_exposure_equality_and_hash():
+    exposure = Exposure('night', '/some/dir/2400000o.fits')
+    assert exposure == Exposure('night', '2400000o.fits')
+    assert exposure != Exposure('other', '2400000o.fits')
+    assert hash(exposure) == hash(Exposure('night', '2400000o.fits'))
+    mock_exposure = MockExposure(Path('/'), 'night', '2400000o.fits')
+    assert exposure == mock_exposure
+    assert hash(exposure) == hash(mock_exposure)
+
+
+def test_exposure_pickle():
+    exposure = Exposure('night', '2400000o.fits')
+    restored = pickle.loads(pickle.dumps(exposure))
+    assert restored == exposure
+    assert restored.night == 'night'
+    assert hash(restored) == hash(exposure)
+
+
+def test_exposure_restored_from_legacy_state():
+    exposure = Exposure.__new__(Exposure)
+    exposure.__setstate__({'_Exposure__night': Night('night'), '_Exposure__raw_filename': '2400000o.fits'})
+    assert exposure == Exposure('night', '2400000o.fits')
+    assert exposure.night == 'night'
@@ -0,0 +1,64 @@
+import json
+import os
+from types import SimpleNamespace
+
+from trigger.baseinterface.recipecosts import CostContext
+from trigger.common.recipecosts import RecipeCostStore, longest_first
+from trigger.processor.drswrapper.reciperunner import RecipeRunner
+
+
+def test_estimates_fall_back_to_less_specific_history(cache_dir):
+    store = RecipeCostStore(cache_dir.joinpath('fallback-costs'))
+    assert store.estimate('cal_extract_spirou', CostContext('OBJ_FP', 'SPECTROSCOPY')) is None
+    store.record('cal_extract_spirou', CostContext('OBJ_FP', 'SPECTROSCOPY'), 100)
+    store.record('cal_extract_spirou', CostContext('OBJ_FP', 'SPECTROSCOPY'), 200)
+    store.record('cal_extract_spirou', CostContext('OBJ_DARK', 'POLAR1'), 600)
+    assert store.estimate('cal_extract_spirou', CostContext('OBJ_FP', 'SPECTROSCOPY')) == 150
+    assert store.estimate('cal_extract_spirou', CostContext('OBJ_FP', 'POLAR2')) == 150
+    assert store.estimate('cal_extract_spirou', CostContext('FP_FP')) == 300
+    assert store.estimate('cal_ccf_spirou', CostContext('OBJ_FP', 'SPECTROSCOPY')) is None
+
+
+def test_history_is_shared_and_limited(cache_dir):
+    directory = cache_dir.joinpath('shared-costs')
+    writer = RecipeCostStore(directory)
+    for seconds in (1000, 10, 20):
+        writer.record('cal_wave_night_spirou', CostContext('HCONE_HCONE'), seconds)
+    other_host = RecipeCostStore(directory, history=2)
+    other_host.host = 'other'
+    assert other_host.estimate('cal_wave_night_spirou', CostContext('HCONE_HCONE')) == 15
+
+
+def test_only_newest_files_are_read(cache_dir):
+    directory = cache_dir.joinpath('bounded-costs')
+    old = directory.joinpath('old-host-20000101.jsonl')
+    directory.mkdir()
+    old.write_text(json.dumps({'recipe': 'cal_ccf_spirou', 'host': 'old-host', 'seconds': 1000, 'time': 1}) + '\n')
+    os.utime(old, (1, 1))
+    writer = RecipeCostStore(directory)
+    for seconds in (10, 20):
+        writer.record('cal_ccf_spirou', CostContext('OBJ_FP'), seconds)
+    # Records from one host on one day share a file
+    assert len(list(directory.glob('*.jsonl'))) == 2
+    assert RecipeCostStore(directory).estimate('cal_ccf_spirou', CostContext('OBJ_FP')) == 15
+    assert RecipeCostStore(directory).estimate('cal_ccf_spirou', CostContext(None)) == 1030 / 3
+    assert RecipeCostStore(directory, max_files=1).estimate('cal_ccf_spirou', CostContext(None)) == 15
+
+
+def test_longest_first_keeps_order_of_ties():
+    costs = {'a': 1, 'b': 5, 'c': 1, 'd': 3}
+    assert longest_first(['a', 'b', 'c', 'd'], costs.get) == ['b', 'd', 'a', 'c']
+
+
+def fast_recipe(night):
+    return {'success': True, 'passed': True}
+
+
+def test_recipe_runner_records_costs(cache_dir):
+    store = RecipeCostStore(cache_dir.joinpath('runner-costs'))
+    runner = RecipeRunner(log_command=False)
+    runner.costs = store
+    runner.cost_context = CostContext('FLAT_FLAT')
+    recipe = SimpleNamespace(__name__='apero.recipes.spirou.fast_recipe', __NAME__='fast_recipe', main=fast_recipe)
+    assert runner.run(recipe, 'night')
+    assert store.estimate('fast_recipe', CostContext('FLAT_FLAT')) >= 0
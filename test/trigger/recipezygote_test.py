@@ -0,0 +1,123 @@
+import os
+import signal
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from trigger.baseinterface.processor import IErrorHandler, WorkCancelled
+from trigger.processor.drswrapper.reciperunner import RecipeRunner
+from trigger.processor.drswrapper.recipezygote import RecipeZygote
+
+leaked = []
+
+
+def leaky_pid():
+    leaked.append(bytearray(1024))
+    return {'pid': os.getpid(), 'leaked': len(leaked)}
+
+
+def exiting():
+    raise SystemExit(1)
+
+
+def raising():
+    raise ValueError('bad data')
+
+
+def killed():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def hanging():
+    time.sleep(60)
+    return {}
+
+
+def fake_recipe_main(night, files, **kwargs):
+    params = {'PID': os.getpid()}
+    success = True
+    passed = kwargs.get('quicklook', False)
+    return locals()
+
+
+class RecordingErrorHandler(IErrorHandler):
+    def __init__(self):
+        self.failures = []
+
+    def handle_recipe_failure(self, error):
+        self.failures.append(error)
+
+
+@pytest.fixture
+def zygote():
+    zygote = RecipeZygote()
+    yield zygote
+    zygote.stop()
+
+
+def test_calls_run_in_fresh_children(zygote):
+    first = zygote.call(leaky_pid)
+    second = zygote.call(leaky_pid)
+    assert first['pid'] != os.getpid()
+    assert first['pid'] != second['pid']
+    # Whatever a call leaks goes away with its child
+    assert first['leaked'] == second['leaked'] == 1
+    assert not leaked
+
+
+def test_failures_are_returned(zygote):
+    assert zygote.call(exiting) == {'error': 'system exit'}
+    result = zygote.call(raising)
+    assert result['error'] == 'uncaught exception'
+    assert 'ValueError: bad data' in result['traceback']
+    result = zygote.call(killed)
+    assert result['error'] == 'recipe process died'
+    assert 'signal 9' in result['traceback']
+    # The zygote outlives its children
+    assert zygote.call(leaky_pid)['leaked'] == 1
+
+
+def test_recipe_runner_forks_recipes_with_kwargs():
+    error_handler = RecordingErrorHandler()
+    runner = RecipeRunner(log_command=False, error_handler=error_handler)
+    runner.forking = True
+    recipe = SimpleNamespace(__name__='recipes.fake_recipe', __NAME__='fake_recipe', main=fake_recipe_main)
+    try:
+        assert runner.run(recipe, 'night', ['a.fits'], quicklook=True)
+        assert not runner.run(recipe, 'night', ['a.fits'])
+        assert error_handler.failures[-1].reason == 'QC failure'
+        assert not runner.run(SimpleNamespace(__name__='exiting', __NAME__='exiting', main=exiting))
+        assert error_handler.failures[-1].reason == 'system exit'
+    finally:
+        runner.zygote.stop()
+
+
+def test_hung_calls_time_out(zygote):
+    start = time.monotonic()
+    result = zygote.call(hanging, timeout=0.5, poll_interval=0.1)
+    assert result['error'] == 'timeout'
+    assert time.monotonic() - start < 10
+    assert zygote.call(leaky_pid)['leaked'] == 1
+
+
+def test_calls_are_cancelled(zygote):
+    start = time.monotonic()
+    assert zygote.call(hanging, cancelled=lambda: time.monotonic() - start > 0.3, poll_interval=0.1) == {
+        'error': 'cancelled'}
+    assert time.monotonic() - start < 10
+
+
+def test_recipe_runner_reports_timeouts_and_cancels():
+    error_handler = RecordingErrorHandler()
+    runner = RecipeRunner(log_command=False, error_handler=error_handler)
+    runner.timeouts['hanging_recipe'] = 0.5
+    recipe = SimpleNamespace(__name__='recipes.hanging_recipe', __NAME__='hanging_recipe', main=hanging)
+    try:
+        assert not runner.run(recipe)
+        assert error_handler.failures[-1].reason == 'timeout'
+        runner.cancelled = lambda: True
+        with pytest.raises(WorkCancelled):
+            runner.run(recipe)
+    finally:
+        runner.zygote.stop()
@@ -1,12 +1,18 @@
 from pathlib import Path
-from typing import Collection, Dict, Iterable, Sequence
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
 
 from logger import log
+from .baseinterface.checkpoints import IStageCheckpoints, NoCheckpoints
 from .baseinterface.drstrigger import ICalibrationState, ICustomHandler, IDrsTrigger
+from .baseinterface.recipecosts import IRecipeCosts
 from .baseinterface.steps import Step
+from .common.executionplan import ExecutionPlan
+from .common.exposureconfig import ExposureConfig
 from .common.pathhandler import Exposure
 from .exposureconfig import SpirouExposureConfig
-from .headerchecker import SpirouHeaderChecker
+from .nighttable import NightTable
 from .processor import Processor
 
 
@@ -15,6 +21,8 @@ class BaseDrsTrigger(IDrsTrigger):
         self.steps = steps
         self.custom_handler: ICustomHandler = custom_handler
         self.processor = Processor(self.steps, trace, self.custom_handler)
+        self.checkpoints: IStageCheckpoints = NoCheckpoints()
+        self.execution_plan: Optional[ExecutionPlan] = None
 
     def reduce(self, exposures_in_order: Iterable[Exposure]):
         self.processor.reset_state()
@@ -34,24 +42,61 @@ class BaseDrsTrigger(IDrsTrigger):
             except:
                 log.error('Critical failure processing %s, skipping', sequence, exc_info=True)
 
+    def preload_recipes(self):
+        self.processor.preload_recipes()
+
+    def isolate_recipes(self):
+        self.processor.isolate_recipes()
+
+    def set_cancel_check(self, cancelled: Callable[[], bool]):
+        self.processor.set_cancel_check(cancelled)
+
+    def set_recipe_costs(self, costs: IRecipeCosts):
+        self.processor.set_recipe_costs(costs)
+
+    def plan(self, plan: ExecutionPlan):
+        """
+        Records the recipes a reduction would run to an execution plan instead of running them. Exposures which have
+        not been preprocessed yet are planned from their raw headers, and the custom handler is not called.
+        :param plan: The plan to record recipes to
+        """
+        self.execution_plan = plan
+        self.processor.plan(plan)
+
+    def estimate_cost(self, exposure: Exposure) -> float:
+        file = exposure.preprocessed if exposure.preprocessed.exists() else exposure.raw
+        try:
+            exposure_config = SpirouExposureConfig.from_file(file)
+        except (OSError, RuntimeError, ValueError) as err:
+            log.debug('Not estimating cost of %s due to %s', exposure, err)
+            return 0.0
+        return self.processor.estimate_exposure_cost(exposure_config)
+
+    def set_checkpoints(self, checkpoints: IStageCheckpoints):
+        self.checkpoints = checkpoints
+        self.processor.set_checkpoints(checkpoints)
+        if self.custom_handler:
+            self.custom_handler.checkpoints = checkpoints
+
     def preprocess(self, exposure: Exposure) -> bool:
         exposure_config = SpirouExposureConfig.from_file(exposure.raw)
-        if self.custom_handler:
-            self.custom_handler.exposure_pre_process(exposure)
-        result = self.processor.preprocess_exposure(exposure_config, exposure)
-        if self.custom_handler:
-            self.custom_handler.exposure_preprocess_done(exposure)
+        if self.__handler:
+            self.__handler.exposure_pre_process(exposure)
+        result = self.checkpoints.run(exposure, 'preprocess', self.processor.preprocess_exposure,
+                                      exposure_config, exposure)
+        if self.__handler:
+            self.__handler.exposure_preprocess_done(exposure)
         return result
 
     def process_file(self, exposure: Exposure) -> Dict:
         try:
-            exposure_config = SpirouExposureConfig.from_file(exposure.preprocessed)
+            exposure_config = self.__preprocessed_config(exposure)
         except FileNotFoundError as err:
             log.error('File %s not found, skipping processing', err.filename)
         else:
             result = self.processor.process_exposure(exposure_config, exposure)
-            if self.custom_handler:
-                self.custom_handler.exposure_post_process(exposure, result)
+            if self.__handler:
+                self.__handler.exposure_post_process(exposure, result)
             return result
 
     def process_sequence(self, exposures: Iterable[Exposure]) -> Dict:
@@ -60,9 +105,9 @@ class BaseDrsTrigger(IDrsTrigger):
         for exposure in exposures:
             try:
                 if sequence_config is None:
-                    sequence_config = SpirouExposureConfig.from_file(exposure.preprocessed)
+                    sequence_config = self.__preprocessed_config(exposure)
                 else:
-                    exposure_config = SpirouExposureConfig.from_file(exposure.preprocessed)
+                    exposure_config = self.__preprocessed_config(exposure)
                     assert exposure_config == sequence_config, 'Exposure type changed mid-sequence'
                 exposures_matching_config.append(exposure)
             except FileNotFoundError:
@@ -71,60 +116,136 @@ class BaseDrsTrigger(IDrsTrigger):
                 log.error(err.args)
         if exposures_matching_config:
             result = self.processor.process_sequence(sequence_config, exposures_matching_config)
-            if self.custom_handler:
-                self.custom_handler.sequence_post_process(exposures_matching_config, result)
+            if self.__handler:
+                self.__handler.sequence_post_process(exposures_matching_config, result)
             return result
         else:
             log.error('No files found in sequence, skipping')
 
+    @property
+    def __handler(self) -> Optional[ICustomHandler]:
+        # Nothing is run while planning, so there is nothing to distribute or update the database with
+        return None if self.execution_plan is not None else self.custom_handler
+
+    def __preprocessed_config(self, exposure: Exposure) -> ExposureConfig:
+        if self.execution_plan is not None and not exposure.preprocessed.exists():
+            return SpirouExposureConfig.from_raw_file(exposure.raw)
+        return SpirouExposureConfig.from_file(exposure.preprocessed)
+
     @staticmethod
     def find_sequences(exposures: Iterable[Exposure], **kwargs) -> Iterable[Sequence[Exposure]]:
-        finished_sequences = []
-        # TODO: should use OCTOKEN and OCEXPNUM if available
         """
-        - OCTOKEN should stay the same across exposures
-        - CMPLTEXP/NEXP can determine position in sequence
-        - OCEXPNUM will be the same for a repeated exposure, but different if the sequence is repeated
-            (e.g. increases when set up through the queue vs stays the same when RO does the repeat)
-        - In most cases probably want to take highest SNR exposure for a given exposure for a polar sequence
-            but have to consider the case with gaps between observations
+        Groups exposures into sequences by their OCTOKEN and OCEXPNUM, placing them with CMPLTEXP/NEXP, so that
+        sequences are found whatever order their exposures arrived in. Exposures without OCTOKEN or OCEXPNUM are
+        grouped by scanning them in order instead.
+        :param exposures: The exposures, in the order they were taken or arrived
+        :param kwargs: ignore_incomplete to leave out every incomplete sequence, or ignore_incomplete_last to leave
+                       out incomplete sequences which may still be completed by exposures to come, that is those no
+                       other exposure has arrived after
+        :return: The sequences, ordered by their earliest exposure
         """
-        fallback_exposures = exposures
-        if fallback_exposures:
-            exposure_order = {file: i for i, file in enumerate(exposures)}
-            finished_sequences.extend(BaseDrsTrigger.find_sequences_fallback(fallback_exposures, **kwargs))
-            finished_sequences.sort(key=lambda sequence: exposure_order[sequence[0]])
+        exposures = list(exposures)
+        exposure_order = {exposure: i for i, exposure in enumerate(exposures)}
+        table = NightTable.read(exposure.raw for exposure in exposures)
+        identified = np.flatnonzero(table.rows.has_sequence_id)
+        fallback = np.flatnonzero(~table.rows.has_sequence_id)
+        finished_sequences = []
+        if len(identified):
+            finished_sequences.extend(BaseDrsTrigger.__group_sequences_by_id(
+                [exposures[i] for i in identified], table[identified], identified.tolist(), len(exposures), **kwargs))
+        if len(fallback):
+            finished_sequences.extend(BaseDrsTrigger.__scan_sequences(
+                [exposures[i] for i in fallback], table[fallback], **kwargs))
+        finished_sequences.sort(key=lambda sequence: min(exposure_order[exposure] for exposure in sequence))
         return finished_sequences
 
     @staticmethod
     def find_sequences_fallback(exposures: Iterable[Exposure], **kwargs) -> Iterable[Sequence[Exposure]]:
+        exposures = list(exposures)
+        return BaseDrsTrigger.__scan_sequences(exposures, NightTable.read(exposure.raw for exposure in exposures),
+                                               **kwargs)
+
+    @staticmethod
+    def __group_sequences_by_id(exposures: Sequence[Exposure], table: NightTable, arrivals: Sequence[int],
+                                arrival_count: int, **kwargs) -> List[Sequence[Exposure]]:
+        """
+        :param arrivals: The position of each exposure among all the exposures arrived, with or without an id
+        :param arrival_count: The number of exposures arrived
+        """
         ignore_incomplete = kwargs.get('ignore_incomplete')
         ignore_incomplete_last = ignore_incomplete or kwargs.get('ignore_incomplete_last')
         finished_sequences = []
-        current_sequence = []
-        last_index = 0
-        for exposure in exposures:
-            header = SpirouHeaderChecker(exposure.raw)
-            exp_index, exp_total = header.get_exposure_index_and_total()
-            if exp_index < last_index + 1:
-                if exp_index == 1:
-                    log.warning('Exposure number reset mid-sequence, ending previous sequence early: %s',
-                                current_sequence)
-                    if not ignore_incomplete:
-                        finished_sequences.append(current_sequence.copy())
-                    current_sequence.clear()
-                else:
-                    log.error('Exposures appear to be out of order: %s', current_sequence)
-            elif exp_index > last_index + 1:
+        # Members of each sequence not complete yet by their CMPLTEXP, and the NEXP they were taken with
+        open_sequences: Dict[Tuple[str, int], Dict[int, Exposure]] = {}
+        totals: Dict[Tuple[str, int], int] = {}
+        # When each sequence last had an exposure
+        last_arrivals: Dict[Tuple[str, int], int] = {}
+        exp_indexes, exp_totals = table.exposure_indexes_and_totals()
+        for arrival, exposure, sequence_id, exp_index, exp_total in zip(
+                arrivals, exposures, table.sequence_ids(), exp_indexes.tolist(), exp_totals.tolist()):
+            # OCEXPNUM stays the same when RO repeats a single exposure, so a repeat replaces the earlier exposure.
+            # TODO: for polar sequences the highest SNR of the repeated exposures is probably the one to use
+            members = open_sequences.setdefault(sequence_id, {})
+            if exp_index in members:
+                log.warning('Exposure %s repeats %s in sequence, using the later one', exposure, members[exp_index])
+            members[exp_index] = exposure
+            totals[sequence_id] = exp_total
+            last_arrivals[sequence_id] = arrival
+            if all(index in members for index in range(1, exp_total + 1)):
+                finished_sequences.append([members[index] for index in range(1, exp_total + 1)])
+                del open_sequences[sequence_id]
+        for sequence_id, members in open_sequences.items():
+            # Like a reset when scanning, a sequence is taken to have stopped short once any other exposure arrives
+            # after it, whether its observation was repeated, another target observed or the sequence aborted
+            stopped = last_arrivals[sequence_id] < arrival_count - 1
+            if ignore_incomplete or (ignore_incomplete_last and not stopped):
+                continue
+            sequence = [members[index] for index in sorted(members)]
+            log.warning('Exposures missing from sequence of %i: %s', totals[sequence_id], sequence)
+            finished_sequences.append(sequence)
+        return finished_sequences
+
+    @staticmethod
+    def __scan_sequences(exposures: Sequence[Exposure], table: NightTable, **kwargs) -> List[Sequence[Exposure]]:
+        """
+        Splits exposures in the order they were taken into sequences, finding where each sequence starts from the
+        CMPLTEXP and NEXP columns rather than one exposure at a time.
+        """
+        ignore_incomplete = kwargs.get('ignore_incomplete')
+        ignore_incomplete_last = ignore_incomplete or kwargs.get('ignore_incomplete_last')
+        exp_indexes, exp_totals = table.exposure_indexes_and_totals()
+        count = len(exp_indexes)
+        if not count:
+            return []
+        completes = exp_indexes == exp_totals
+        # The CMPLTEXP before each exposure, or 0 if it starts a new sequence
+        last_indexes = np.zeros(count, dtype=int)
+        last_indexes[1:] = np.where(completes[:-1], 0, exp_indexes[:-1])
+        resets = (exp_indexes == 1) & (last_indexes > 0)
+        out_of_order = (exp_indexes <= last_indexes) & ~resets
+        skipped = exp_indexes > last_indexes + 1
+        starts_mask = resets.copy()
+        starts_mask[0] = True
+        starts_mask[1:] |= completes[:-1]
+        starts = np.flatnonzero(starts_mask)
+        for i in np.flatnonzero(resets | out_of_order | skipped):
+            # A reset starts a sequence, so it ends the one before
+            current_start = starts[np.searchsorted(starts, i, 'left' if resets[i] else 'right') - 1]
+            current_sequence = list(exposures[current_start:i])
+            if resets[i]:
+                log.warning('Exposure number reset mid-sequence, ending previous sequence early: %s',
+                            current_sequence)
+            elif out_of_order[i]:
+                log.error('Exposures appear to be out of order: %s', current_sequence)
+            else:
                 log.error('Exposure appears to be missing from sequence: %s', current_sequence)
-            last_index = exp_index
-            current_sequence.append(exposure)
-            if exp_index == exp_total:
-                finished_sequences.append(current_sequence.copy())
-                current_sequence.clear()
-                last_index = 0
-        if not ignore_incomplete_last and current_sequence:
-            finished_sequences.append(current_sequence.copy())
+        finished_sequences = []
+        for start, stop in zip(starts.tolist(), np.append(starts[1:], count).tolist()):
+            if not completes[stop - 1]:
+                # Ended early by the next exposure resetting the number, or still waiting on exposures to come
+                if ignore_incomplete if stop < count else ignore_incomplete_last:
+                    continue
+            finished_sequences.append(list(exposures[start:stop]))
         return finished_sequences
 
     @property
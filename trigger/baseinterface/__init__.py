@@ -1 +1 @@
-from . import drstrigger, headerchecker, processor, steps
+from . import checkpoints, drstrigger, headerchecker, processor, recipecosts, steps
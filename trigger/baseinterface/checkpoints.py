@@ -0,0 +1,74 @@
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Tuple, TypeVar
+
+from logger import log
+from .exposure import IExposure
+
+T = TypeVar('T')
+
+
+class IStageCheckpoints(ABC):
+    """
+    Record of the processing stages finished for each exposure, so that an exposure processed again after a crash
+    resumes from the last finished stage rather than being reduced from scratch.
+    """
+
+    @abstractmethod
+    def get(self, exposure: IExposure, stage: str) -> Tuple[bool, Any]:
+        """
+        :param exposure: The exposure being processed
+        :param stage: The name of the stage
+        :return: Whether the stage has finished for the exposure, and the result it finished with
+        """
+        pass
+
+    @abstractmethod
+    def record(self, exposure: IExposure, stage: str, result: Any):
+        """
+        Records that a stage has finished for an exposure.
+        :param exposure: The exposure being processed
+        :param stage: The name of the stage
+        :param result: The result of the stage, which must be JSON serializable
+        """
+        pass
+
+    @abstractmethod
+    def clear(self, exposure: IExposure):
+        """
+        Forgets every stage finished for an exposure, so it is processed from scratch next time.
+        """
+        pass
+
+    def run(self, exposure: IExposure, stage: str, operation: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Runs a stage for an exposure, unless it has already finished, in which case its recorded result is returned.
+        A stage which raises or returns False, as failed recipes do, is not recorded, so it is run again next time.
+        Any other result, including the None returned by product and distribution stages, records it as finished.
+        :param exposure: The exposure being processed
+        :param stage: The name of the stage
+        :param operation: The function running the stage
+        :return: The result of the stage
+        """
+        finished, result = self.get(exposure, stage)
+        if finished:
+            log.info('Skipping %s of %s, already finished', stage, exposure)
+            return result
+        result = operation(*args, **kwargs)
+        if result is not False:
+            self.record(exposure, stage, result)
+        return result
+
+
+class NoCheckpoints(IStageCheckpoints):
+    """
+    Runs every stage, without recording anything.
+    """
+
+    def get(self, exposure: IExposure, stage: str) -> Tuple[bool, Any]:
+        return False, None
+
+    def record(self, exposure: IExposure, stage: str, result: Any):
+        pass
+
+    def clear(self, exposure: IExposure):
+        pass
@@ -1,12 +1,17 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Dict, Iterable, Sequence
+from typing import Callable, Dict, Iterable, Sequence
 
+from .checkpoints import IStageCheckpoints, NoCheckpoints
 from .exposure import IExposure
 from .processor import IErrorHandler
+from .recipecosts import IRecipeCosts
 
 
 class ICustomHandler(IErrorHandler):
+    # Stages run by the handler are skipped if already finished for an exposure
+    checkpoints: IStageCheckpoints = NoCheckpoints()
+
     @abstractmethod
     def exposure_pre_process(self, exposure: IExposure):
         pass
@@ -71,3 +76,39 @@ class IDrsTrigger(ABC):
     @abstractmethod
     def exposure_from_path(self, path: Path) -> IExposure:
         pass
+
+    def preload_recipes(self):
+        """
+        Optionally loads everything needed to run the configured steps ahead of time.
+        """
+        pass
+
+    def isolate_recipes(self):
+        """
+        Optionally runs each recipe in a separate process, so leaks and crashes in a recipe don't affect the trigger.
+        """
+        pass
+
+    def set_cancel_check(self, cancelled: Callable[[], bool]):
+        """
+        Optionally checks for cancellation before and while running each recipe, raising WorkCancelled once cancelled.
+        """
+        pass
+
+    def set_recipe_costs(self, costs: IRecipeCosts):
+        """
+        Optionally records how long each recipe takes, and predicts the cost of exposures from the history.
+        """
+        pass
+
+    def estimate_cost(self, exposure: IExposure) -> float:
+        """
+        :return: The predicted running time in seconds of processing an exposure, 0 if unknown
+        """
+        return 0.0
+
+    def set_checkpoints(self, checkpoints: IStageCheckpoints):
+        """
+        Optionally records the stages finished for each exposure, and skips stages already finished.
+        """
+        pass
@@ -6,6 +6,8 @@ class IExposure(ABC):
     """
     Class representing a single input file and corresponding output files.
     """
+    __slots__ = ()
+
     def __repr__(self):
         return str(self.raw)
 
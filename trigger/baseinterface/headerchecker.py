@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 from astropy.io import fits
 
@@ -46,6 +46,10 @@ class HeaderChecker(ABC):
     def get_exposure_index_and_total(self) -> Tuple[int, int]:
         pass
 
+    @abstractmethod
+    def get_sequence_id(self) -> Optional[Tuple[str, int]]:
+        pass
+
     @abstractmethod
     def get_rhomb_positions(self) -> Tuple[str, str]:
         pass
@@ -35,6 +35,13 @@ class RecipeFailure(Exception):
         return RecipeFailure(self.reason, self.command_string, traceback_string)
 
 
+class WorkCancelled(Exception):
+    """
+    Raised when the exposure or sequence being processed has been cancelled, to abandon the rest of its processing.
+    """
+    pass
+
+
 class IErrorHandler(ABC):
     """
     A base class for handling recipe failures.
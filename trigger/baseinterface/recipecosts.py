@@ -0,0 +1,47 @@
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Optional
+
+
+class CostContext(NamedTuple):
+    """
+    What a recipe's running time depends on besides the recipe itself.
+    """
+    dpr_type: Optional[str] = None
+    instrument_mode: Optional[str] = None
+
+
+class IRecipeCosts(ABC):
+    """
+    History of how long recipes took to run, used to predict how long work will take.
+    """
+
+    @abstractmethod
+    def record(self, recipe: str, context: CostContext, seconds: float):
+        """
+        Records the running time of a recipe on this host.
+        :param recipe: The name of the recipe module
+        :param context: The type of exposure the recipe ran on
+        :param seconds: How long the recipe took to run
+        """
+        pass
+
+    @abstractmethod
+    def estimate(self, recipe: str, context: CostContext) -> Optional[float]:
+        """
+        :param recipe: The name of the recipe module
+        :param context: The type of exposure the recipe will run on
+        :return: The predicted running time in seconds, or None if the recipe has never been recorded
+        """
+        pass
+
+
+class NoRecipeCosts(IRecipeCosts):
+    """
+    Records nothing and has no predictions.
+    """
+
+    def record(self, recipe: str, context: CostContext, seconds: float):
+        pass
+
+    def estimate(self, recipe: str, context: CostContext) -> Optional[float]:
+        return None
@@ -1,7 +1,6 @@
 from . import drsconstants, exposureconfig, pathhandler, steps
 
 Fiber = drsconstants.Fiber
-TELLURIC_STANDARDS = drsconstants.TELLURIC_STANDARDS
 
 CalibrationType = exposureconfig.CalibrationType
 ExposureConfig = exposureconfig.ExposureConfig
@@ -18,3 +17,10 @@ CalibrationStep = steps.CalibrationStep
 ObjectStep = steps.ObjectStep
 PreprocessStep = steps.PreprocessStep
 DrsSteps = steps.DrsSteps
+
+
+def __getattr__(name: str):
+    # Resolved lazily since it requires loading the DRS config
+    if name == 'TELLURIC_STANDARDS':
+        return drsconstants.get_telluric_standards()
+    raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
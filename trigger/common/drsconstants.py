@@ -1,20 +1,66 @@
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, List, Optional
 
-from apero.core import constants
-from apero.science import telluric
 
-config = constants.load('SPIROU')
+# Values from the DRS config are only resolved when first used, so that importing the trigger (e.g. to print help or a
+# version string) does not pay for loading APERO.
+@lru_cache(maxsize=None)
+def get_config():
+    from apero.core import constants
+    return constants.load('SPIROU')
 
-DRS_VERSION: str = config['DRS_VERSION']
-TELLURIC_STANDARDS: List[str] = list(telluric.get_whitelist(config)[0])
+
+@lru_cache(maxsize=None)
+def get_drs_version() -> str:
+    return get_config()['DRS_VERSION']
+
+
+@lru_cache(maxsize=None)
+def get_telluric_standards() -> List[str]:
+    from apero.science import telluric
+    return list(telluric.get_whitelist(get_config())[0])
+
+
+def __getattr__(name: str):
+    # Module level DRS_VERSION and TELLURIC_STANDARDS, resolved on first access
+    if name == 'DRS_VERSION':
+        return get_drs_version()
+    if name == 'TELLURIC_STANDARDS':
+        return get_telluric_standards()
+    raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
+
+
+class ConfigValue:
+    """
+    Class attribute which is read from the DRS config on first access, then cached on the class.
+    """
+
+    def __init__(self, key: str, convert: Optional[Callable[[Any], Any]] = None):
+        """
+        :param key: The DRS config key
+        :param convert: Function applied to the config value before it is cached
+        """
+        self.key = key
+        self.convert = convert
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        value = get_config()[self.key]
+        if self.convert is not None:
+            value = self.convert(value)
+        setattr(owner, self.name, value)
+        return value
 
 
 class RootDataDirectories:
-    input: Path = Path(config['DRS_DATA_RAW'])
-    tmp: Path = Path(config['DRS_DATA_WORKING'])
-    reduced: Path = Path(config['DRS_DATA_REDUC'])
+    input: Path = ConfigValue('DRS_DATA_RAW', Path)
+    tmp: Path = ConfigValue('DRS_DATA_WORKING', Path)
+    reduced: Path = ConfigValue('DRS_DATA_REDUC', Path)
 
 
 class Fiber(Enum):
@@ -25,6 +71,6 @@ class Fiber(Enum):
 
 
 class CcfParams:
-    mask: str = config['CCF_DEFAULT_MASK']
-    width: float = config['CCF_DEFAULT_WIDTH']
-    step: float = config['CCF_DEFAULT_STEP']
+    mask: str = ConfigValue('CCF_DEFAULT_MASK')
+    width: float = ConfigValue('CCF_DEFAULT_WIDTH')
+    step: float = ConfigValue('CCF_DEFAULT_STEP')
@@ -0,0 +1,166 @@
+import heapq
+from enum import Enum, auto
+from typing import Dict, List, Optional, Sequence
+
+from .pathhandler import Exposure
+
+
+class RecipeStage(Enum):
+    PREPROCESS = auto()
+    CALIBRATION = auto()
+    OBJECT = auto()
+
+
+class PlannedRecipe:
+    def __init__(self, index: int, recipe: str, stage: RecipeStage, night: str, exposures: Sequence[Exposure],
+                 command: str, cost: float, dependencies: Sequence[int]):
+        """
+        :param index: Position of the recipe in the order the trigger would run it
+        :param recipe: The name of the recipe module
+        :param stage: Which stage of the reduction the recipe belongs to
+        :param night: The night directory the recipe runs on
+        :param exposures: The exposures the recipe reads
+        :param command: The command line equivalent of the recipe call
+        :param cost: The predicted running time in seconds
+        :param dependencies: Indexes of the recipes which must finish before this one can start
+        """
+        self.index = index
+        self.recipe = recipe
+        self.stage = stage
+        self.night = night
+        self.exposures = exposures
+        self.command = command
+        self.cost = cost
+        self.dependencies = dependencies
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.index,
+            'recipe': self.recipe,
+            'stage': self.stage.name.lower(),
+            'night': self.night,
+            'exposures': [exposure.raw.name for exposure in self.exposures],
+            'command': self.command,
+            'cost': self.cost,
+            'depends_on': list(self.dependencies),
+        }
+
+
+class ExecutionPlan:
+    """
+    The recipes a reduction would run, recorded in place of running them, as a graph of which recipe must wait for
+    which.
+
+    A recipe waits for the last recipe run on each of the exposures it reads. Calibration recipes also wait for the
+    previous calibration recipe of their night, since each adds to the calibration database the next one reads, and
+    object recipes wait for the calibrations of their night recorded before them. Nights only depend on themselves.
+    """
+
+    def __init__(self):
+        self.recipes: List[PlannedRecipe] = []
+        self.__last_by_exposure: Dict[Exposure, int] = {}
+        self.__last_calibration_by_night: Dict[str, int] = {}
+
+    def add(self, recipe: str, stage: RecipeStage, exposures: Sequence[Exposure], command: str, cost: float) -> bool:
+        """
+        Records a recipe call in place of running it.
+        :return: True, so the trigger carries on as if the recipe succeeded
+        """
+        index = len(self.recipes)
+        night = exposures[0].night
+        dependencies = {self.__last_by_exposure[exposure] for exposure in exposures
+                        if exposure in self.__last_by_exposure}
+        if stage != RecipeStage.PREPROCESS and night in self.__last_calibration_by_night:
+            dependencies.add(self.__last_calibration_by_night[night])
+        self.recipes.append(PlannedRecipe(index, recipe, stage, night, exposures, command, cost,
+                                          sorted(dependencies)))
+        for exposure in exposures:
+            self.__last_by_exposure[exposure] = index
+        if stage == RecipeStage.CALIBRATION:
+            self.__last_calibration_by_night[night] = index
+        return True
+
+    @property
+    def total_cost(self) -> float:
+        return sum(recipe.cost for recipe in self.recipes)
+
+    def critical_path(self) -> List[PlannedRecipe]:
+        """
+        :return: The chain of dependent recipes with the highest total cost, which no number of processes can finish
+                 faster than
+        """
+        finish: List[float] = []
+        previous: List[Optional[int]] = []
+        # Recipes are recorded after everything they depend on, so one pass in order finds the longest chains
+        for recipe in self.recipes:
+            before = max(recipe.dependencies, key=finish.__getitem__, default=None)
+            finish.append(recipe.cost + (finish[before] if before is not None else 0.0))
+            previous.append(before)
+        path = []
+        index = max(range(len(finish)), key=finish.__getitem__, default=None)
+        while index is not None:
+            path.append(self.recipes[index])
+            index = previous[index]
+        return path[::-1]
+
+    def makespan(self, processes: int) -> float:
+        """
+        Simulates running the plan on a number of processes, starting whichever ready recipe heads the longest
+        remaining chain whenever a process is free.
+        :param processes: The number of recipes that can run at once
+        :return: The predicted wall clock time in seconds
+        """
+        remaining = self.__remaining_chain_costs()
+        waiting_on = [len(recipe.dependencies) for recipe in self.recipes]
+        dependents: List[List[int]] = [[] for _ in self.recipes]
+        for recipe in self.recipes:
+            for dependency in recipe.dependencies:
+                dependents[dependency].append(recipe.index)
+        ready = [(-remaining[recipe.index], recipe.index) for recipe in self.recipes if not recipe.dependencies]
+        heapq.heapify(ready)
+        running = []
+        now = 0.0
+        while ready or running:
+            while ready and len(running) < processes:
+                _, index = heapq.heappop(ready)
+                heapq.heappush(running, (now + self.recipes[index].cost, index))
+            now, index = heapq.heappop(running)
+            for dependent in dependents[index]:
+                waiting_on[dependent] -= 1
+                if not waiting_on[dependent]:
+                    heapq.heappush(ready, (-remaining[dependent], dependent))
+        return now
+
+    def to_dict(self, processes: int = 1) -> Dict:
+        """
+        :param processes: The number of processes to predict the wall clock time for
+        :return: The plan as JSON serializable values
+        """
+        critical_path = self.critical_path()
+        critical_cost = sum(recipe.cost for recipe in critical_path)
+        total_cost = self.total_cost
+        return {
+            'recipes': [recipe.to_dict() for recipe in self.recipes],
+            'recipe_counts': self.__recipe_counts(),
+            'total_cost': total_cost,
+            'critical_path': [recipe.index for recipe in critical_path],
+            'critical_path_cost': critical_cost,
+            # The average number of recipes that can run at once given unlimited processes
+            'parallelism': total_cost / critical_cost if critical_cost else 0.0,
+            'processes': processes,
+            'wall_time': self.makespan(processes),
+        }
+
+    def __remaining_chain_costs(self) -> List[float]:
+        remaining = [recipe.cost for recipe in self.recipes]
+        for recipe in reversed(self.recipes):
+            for dependency in recipe.dependencies:
+                remaining[dependency] = max(remaining[dependency], self.recipes[dependency].cost
+                                            + remaining[recipe.index])
+        return remaining
+
+    def __recipe_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for recipe in self.recipes:
+            counts[recipe.recipe] = counts.get(recipe.recipe, 0) + 1
+        return counts
@@ -1,10 +1,10 @@
 from __future__ import annotations
 
 from enum import Enum, auto, EnumMeta
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 from logger import log
-from .drsconstants import TELLURIC_STANDARDS
+from .drsconstants import get_telluric_standards
 from ..baseinterface.headerchecker import HeaderChecker
 
 
@@ -139,25 +139,40 @@ class ExposureConfig:
     @classmethod
     def from_header_checker(cls, header_checker: HeaderChecker) -> ExposureConfig:
         is_aborted = header_checker.is_aborted()
+        try:
+            dpr_type = header_checker.get_dpr_type()
+        except RuntimeError:
+            dpr_type = None
         if header_checker.is_object():
-            instrument_mode = InstrumentMode.from_rhombs(header_checker.get_rhomb_positions())
+            rhombs = header_checker.get_rhomb_positions()
             if header_checker.is_sky():
                 target = TargetType.SKY
-            elif header_checker.get_object_name() in TELLURIC_STANDARDS:
+            elif header_checker.get_object_name() in get_telluric_standards():
                 target = TargetType.TELLURIC_STANDARD
             else:
                 target = TargetType.STAR
+            return cls.from_keywords(True, dpr_type, is_aborted, rhombs, target)
+        return cls.from_keywords(False, dpr_type, is_aborted)
+
+    @classmethod
+    def from_keywords(cls, is_object: bool, dpr_type: Optional[str], is_aborted: bool,
+                      rhombs: Tuple[str, str] = None, target: TargetType = None) -> ExposureConfig:
+        """
+        :param is_object: Whether the exposure is an object rather than a calibration
+        :param dpr_type: The DPRTYPE, or None if it is not known
+        :param is_aborted: Whether the exposure was aborted
+        :param rhombs: The rhomb positions, for objects
+        :param target: What was observed, for objects
+        """
+        if is_object:
+            instrument_mode = InstrumentMode.from_rhombs(rhombs)
             try:
-                dpr_type = header_checker.get_dpr_type()
-                object_type = ObjectType.from_dpr_type(dpr_type)
-                obj = ObjectConfig(instrument_mode, target, object_type)
-            except (ValueError, RuntimeError):
-                obj = ObjectConfig(instrument_mode, target)
-            return cls(obj=obj, is_aborted=is_aborted)
-        else:
-            try:
-                dpr_type = header_checker.get_dpr_type()
-                calibration = CalibrationType.from_dpr_type(dpr_type)
-            except (ValueError, RuntimeError):
-                calibration = True
-            return cls(calibration=calibration, is_aborted=is_aborted)
+                object_type = ObjectType.from_dpr_type(dpr_type) if dpr_type is not None else None
+            except ValueError:
+                object_type = None
+            return cls(obj=ObjectConfig(instrument_mode, target, object_type), is_aborted=is_aborted)
+        try:
+            calibration = CalibrationType.from_dpr_type(dpr_type) if dpr_type is not None else True
+        except ValueError:
+            calibration = True
+        return cls(calibration=calibration, is_aborted=is_aborted)
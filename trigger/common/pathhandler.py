@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 from enum import Enum
 from pathlib import Path
 from typing import Optional
@@ -52,27 +53,61 @@ class TelluSuffix(Enum):
 class Exposure(IExposure):
     """
     Class representing a single input file and corresponding output files.
+
+    Exposures are hashed and compared constantly while tracking sequences, so the (night, filename) key and its hash
+    are computed once, and paths are computed on first access then cached. Root directories are only read on first
+    access, so they can still be changed after exposures are created.
     """
+    __slots__ = ('__night', '__raw_filename', '__key', '__hash', '__raw', '__preprocessed', '__reduced_directory')
 
     def __init__(self, night: str, raw_file: str):
         """
         :param night: Path of the night directory relative to the root input directory
         :param raw_file: Name or path of the input file, which must be located directly in night directory
         """
-        self.__night = Night(night)
-        self.__raw_filename = Path(raw_file).name
+        self.__night = night
+        self.__raw_filename = os.path.basename(raw_file)
+        self.__key = (self.__night, self.__raw_filename)
+        self.__hash = hash(self.__key)
+        self.__raw: Optional[Path] = None
+        self.__preprocessed: Optional[Path] = None
+        self.__reduced_directory: Optional[Path] = None
+
+    def __eq__(self, other):
+        if isinstance(other, Exposure):
+            return self.__hash == other.__hash and self.__key == other.__key
+        return super().__eq__(other)
+
+    def __hash__(self):
+        return self.__hash
+
+    def __reduce__(self):
+        # Only the key is pickled, cached paths are recomputed in the receiving process
+        return Exposure, self.__key
+
+    def __setstate__(self, state):
+        # Exposures pickled before __slots__ was used (e.g. in a saved realtime cache) are restored from their __dict__
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        night = state['_Exposure__night']
+        self.__init__(getattr(night, 'night', night), state['_Exposure__raw_filename'])
 
     @property
     def night(self) -> str:
-        return self.__night.night
+        return self.__night
 
     @property
     def raw(self) -> Path:
-        return Path(self.input_directory, self.__raw_filename)
+        if self.__raw is None:
+            self.__raw = RootDataDirectories.input.joinpath(self.__night, self.__raw_filename)
+        return self.__raw
 
     @property
     def preprocessed(self) -> Path:
-        return Path(self.temp_directory, self.raw.name.replace('.fits', '_pp.fits'))
+        if self.__preprocessed is None:
+            self.__preprocessed = RootDataDirectories.tmp.joinpath(self.__night,
+                                                                   self.__raw_filename.replace('.fits', '_pp.fits'))
+        return self.__preprocessed
 
     def s1d(self, sample_space: SampleSpace, fiber: Fiber, tellu_suffix=TelluSuffix.NONE) -> Path:
         product_name = 's1d_' + sample_space.value
@@ -99,22 +134,24 @@ class Exposure(IExposure):
         return self.reduced(product + '_' + fiber.value)
 
     def reduced(self, product: str) -> Path:
-        return Path(self.reduced_directory, self.preprocessed.name.replace('.fits', '_' + product + '.fits'))
+        return self.reduced_directory.joinpath(self.preprocessed.name.replace('.fits', '_' + product + '.fits'))
 
     def final_product(self, letter: str) -> Path:
-        return Path(self.reduced_directory, self.raw.name.replace('o.fits', letter + '.fits'))
+        return self.reduced_directory.joinpath(self.__raw_filename.replace('o.fits', letter + '.fits'))
 
     @property
     def input_directory(self) -> Path:
-        return self.__night.input_directory
+        return self.raw.parent
 
     @property
     def temp_directory(self) -> Path:
-        return self.__night.temp_directory
+        return self.preprocessed.parent
 
     @property
     def reduced_directory(self) -> Path:
-        return self.__night.reduced_directory
+        if self.__reduced_directory is None:
+            self.__reduced_directory = RootDataDirectories.reduced.joinpath(self.__night)
+        return self.__reduced_directory
 
     @property
     def obsid(self) -> str:
@@ -0,0 +1,134 @@
+import json
+import socket
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from logger import log
+from .exposureconfig import ExposureConfig
+from ..baseinterface.recipecosts import CostContext, IRecipeCosts
+
+CostKey = Tuple[str, Optional[str], Optional[str], Optional[str]]
+T = TypeVar('T')
+
+
+class RecipeCostStore(IRecipeCosts):
+    """
+    Recipe running times stored in a directory, which can be shared by every process and host running recipes.
+
+    Records are appended as JSON lines to a file for each host and day, so hosts never contend and the number of files
+    only grows by one a day for each host however often worker processes are recycled. Estimates average the most
+    recent records across the newest files, so the history read stays bounded as it grows. Estimates fall back from the exact recipe, exposure type, instrument
+    mode and host to ever less specific matches, so a recipe which has only run on another host or another type of
+    exposure still has a prediction.
+    """
+
+    def __init__(self, directory: Path, history: int = 20, refresh_interval: float = 60.0, max_files: int = 14):
+        """
+        :param directory: The directory to store running times in
+        :param history: How many of the most recent running times to average for each match
+        :param refresh_interval: How long, in seconds, estimates are made without reading new records from other
+                                 processes
+        :param max_files: How many of the most recently written files to read records from
+        """
+        self.directory = directory
+        self.history = history
+        self.refresh_interval = refresh_interval
+        self.max_files = max_files
+        self.host = socket.gethostname()
+        self.__durations: Optional[Dict[CostKey, Deque[float]]] = None
+        self.__loaded_at = 0.0
+
+    def __getstate__(self):
+        return self.directory, self.history, self.refresh_interval, self.max_files
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def record(self, recipe: str, context: CostContext, seconds: float):
+        line = json.dumps({'recipe': recipe, 'dpr_type': context.dpr_type, 'mode': context.instrument_mode,
+                           'host': self.host, 'seconds': seconds, 'time': time.time()})
+        path = self.directory.joinpath('{}-{}.jsonl'.format(self.host, time.strftime('%Y%m%d', time.gmtime())))
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # A single append of a short line, so lines from processes on the same host don't interleave
+            with open(path, 'a') as file:
+                file.write(line + '\n')
+        except OSError as err:
+            log.warning('Failed to record recipe cost in %s due to %s', path, err)
+        if self.__durations is not None:
+            self.__add(recipe, context.dpr_type, context.instrument_mode, self.host, seconds)
+
+    def estimate(self, recipe: str, context: CostContext) -> Optional[float]:
+        if self.__durations is None or time.monotonic() - self.__loaded_at >= self.refresh_interval:
+            self.__load()
+        for key in fallback_keys(recipe, context.dpr_type, context.instrument_mode, self.host):
+            durations = self.__durations.get(key)
+            if durations:
+                return sum(durations) / len(durations)
+        return None
+
+    def __load(self):
+        records = []
+        for path in self.__newest_files():
+            try:
+                with open(path) as file:
+                    for line in file:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            # A line still being written by another process
+                            pass
+            except OSError as err:
+                log.warning('Failed to read recipe costs from %s due to %s', path, err)
+        self.__durations = defaultdict(lambda: deque(maxlen=self.history))
+        for record in sorted(records, key=lambda record: record.get('time', 0)):
+            self.__add(record['recipe'], record.get('dpr_type'), record.get('mode'), record.get('host'),
+                       record['seconds'])
+        self.__loaded_at = time.monotonic()
+
+    def __newest_files(self) -> List[Path]:
+        files = []
+        for path in self.directory.glob('*.jsonl'):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                pass
+        return [path for _, path in sorted(files, reverse=True)[:self.max_files]]
+
+    def __add(self, recipe: str, dpr_type: Optional[str], mode: Optional[str], host: str, seconds: float):
+        for key in fallback_keys(recipe, dpr_type, mode, host):
+            self.__durations[key].append(seconds)
+
+
+def fallback_keys(recipe: str, dpr_type: Optional[str], mode: Optional[str], host: str) -> Sequence[CostKey]:
+    """
+    :return: The keys running times are recorded under, from the most to the least specific
+    """
+    keys = ((recipe, dpr_type, mode, host), (recipe, dpr_type, mode, None), (recipe, dpr_type, None, None),
+            (recipe, None, None, None))
+    return tuple(dict.fromkeys(keys))
+
+
+def cost_context(config: ExposureConfig) -> CostContext:
+    """
+    :param config: The configuration of an exposure, or of every exposure in a sequence
+    :return: The exposure type and instrument mode recipe running times are recorded under
+    """
+    if config.object:
+        object_type = config.object.object_type.name if config.object.object_type else None
+        return CostContext(object_type, config.object.instrument_mode.name)
+    calibration = getattr(config.calibration, 'name', None)
+    return CostContext(calibration)
+
+
+def longest_first(items: Iterable[T], cost: Callable[[T], float]) -> List[T]:
+    """
+    Orders independent work so the most expensive starts first, which keeps a single long job from starting last and
+    leaving a long tail after everything else has finished. Work with equal cost keeps its order.
+    :param items: The work to order
+    :param cost: Predicts the cost of an item of work
+    :return: The work, most expensive first
+    """
+    return sorted(items, key=cost, reverse=True)
@@ -5,7 +5,8 @@ from logger import log
 from .basedrstrigger import BaseDrsTrigger
 from .baseinterface.steps import Step
 from .common import Exposure, Night
-from .common.drsconstants import DRS_VERSION, RootDataDirectories
+from .common.drsconstants import RootDataDirectories, get_drs_version
+from .common.recipecosts import longest_first
 from .fileselector import FileSelectionFilters, FileSelector
 
 
@@ -15,7 +16,7 @@ class DrsTrigger(BaseDrsTrigger):
 
     @staticmethod
     def drs_version() -> str:
-        return DRS_VERSION
+        return get_drs_version()
 
     def reduce_all_nights(self, filters: FileSelectionFilters, num_processes: int = None):
         nights = self.__find_nights('*')
@@ -27,9 +28,11 @@ class DrsTrigger(BaseDrsTrigger):
 
     def reduce_nights(self, nights: Iterable[str], filters: FileSelectionFilters, num_processes: int = None):
         if num_processes:
+            # Start the nights predicted to take longest first, one at a time, so none is left running on its own
+            nights = longest_first(nights, self.__estimate_night_cost)
             pool = Pool(num_processes)
             combined = [(item, filters) for item in nights]
-            pool.starmap(self.reduce_night, combined)
+            pool.starmap(self.reduce_night, combined, chunksize=1)
         else:
             for night in nights:
                 self.reduce_night(night, filters)
@@ -46,6 +49,11 @@ class DrsTrigger(BaseDrsTrigger):
         if subrange:
             self.reduce(subrange)
 
+    def __estimate_night_cost(self, night: str) -> float:
+        cost = sum(self.estimate_cost(exposure) for exposure in self.__find_exposures(night))
+        log.info('Night %s predicted to take %.0f s', night, cost)
+        return cost
+
     @staticmethod
     def __find_nights(night_pattern: str) -> Sequence[str]:
         night_root = RootDataDirectories.input
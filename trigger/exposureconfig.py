@@ -3,7 +3,7 @@ from __future__ import annotations
 from pathlib import Path
 
 from .common.exposureconfig import ExposureConfig
-from .headerchecker import SpirouHeaderChecker
+from .headerchecker import RawSpirouHeaderChecker, SpirouHeaderChecker
 
 
 class SpirouExposureConfig(ExposureConfig):
@@ -11,3 +11,11 @@ class SpirouExposureConfig(ExposureConfig):
     def from_file(cls, file: Path) -> ExposureConfig:
         header_checker = SpirouHeaderChecker(file)
         return cls.from_header_checker(header_checker)
+
+    @classmethod
+    def from_raw_file(cls, file: Path) -> ExposureConfig:
+        """
+        :param file: A raw file, which does not need to have been preprocessed yet
+        """
+        header_checker = RawSpirouHeaderChecker(file)
+        return cls.from_header_checker(header_checker)
@@ -3,13 +3,16 @@ from __future__ import annotations
 from collections import defaultdict
 from enum import Enum, auto
 from pathlib import Path
-from typing import Collection, Dict, Iterable, Optional, Sequence, Tuple, Union
+from typing import Collection, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 
 from logger import log
-from .baseinterface.headerchecker import DateTime
 from .baseinterface.steps import Step
-from .common import CalibrationStep, Exposure, ExposureConfig, ObjectStep, PreprocessStep, TELLURIC_STANDARDS
+from .common import CalibrationStep, Exposure, ExposureConfig, ObjectStep, PreprocessStep
+from .common.drsconstants import get_telluric_standards
 from .headerchecker import HeaderChecker, SpirouHeaderChecker
+from .nighttable import NightTable
 from .processor import Processor
 
 
@@ -25,32 +28,45 @@ class FileSelector:
 
     def sort_and_filter_files_split(self, exposures: Iterable[Exposure], steps: Collection[Step],
                                     filters: FileSelectionFilters) -> Tuple[Sequence[Exposure], Sequence[Exposure]]:
-        date_by_file_by_type = self.__filter_files(exposures, steps, filters, True)
-        return (sorted(date_by_file_by_type[FileType.CALIBRATION], key=date_by_file_by_type[FileType.CALIBRATION].get),
-                sorted(date_by_file_by_type[FileType.OBJECT], key=date_by_file_by_type[FileType.OBJECT].get))
+        files_by_type = self.__filter_files(exposures, steps, filters, True)
+        return files_by_type[FileType.CALIBRATION], files_by_type[FileType.OBJECT]
 
     def sort_and_filter_files_combined(self, exposures: Iterable[Exposure], steps: Collection[Step],
                                        filters: FileSelectionFilters) -> Sequence[Exposure]:
-        date_by_file_by_type = self.__filter_files(exposures, steps, filters, False)
-        return sorted(date_by_file_by_type[FileType.ALL], key=date_by_file_by_type[FileType.ALL].get)
+        return self.__filter_files(exposures, steps, filters, False)[FileType.ALL]
 
     def __filter_files(self, exposures: Iterable[Exposure], steps: Collection[Step], filters: FileSelectionFilters,
-                       split_by_type: bool) -> Dict[FileType, Dict[Exposure, DateTime]]:
-        date_by_file_by_type = defaultdict(dict)
+                       split_by_type: bool) -> Dict[FileType, List[Exposure]]:
+        """
+        Reads the headers of the night into a table once, then selects and sorts the exposures on its columns.
+        :return: The exposures of each type a step uses and the filters match, sorted by observation date
+        """
+        files_by_type = defaultdict(list)
+        candidates = []
         for exposure in exposures:
             selector = self.single_file_selector(exposure, steps)
-            desired_file_check = selector.is_desired_file(filters)
-            if not desired_file_check:
-                continue
-            desired_file_type, checker = desired_file_check
-            if not split_by_type:
-                desired_file_type = FileType.ALL
-            sort_key = checker.get_obs_date()
-            if not sort_key:
-                log.warning('File %s missing observation date info, skipping.', checker.file)
-            else:
-                date_by_file_by_type[desired_file_type][exposure] = sort_key
-        return date_by_file_by_type
+            file_used = selector.file_used_by_a_step(exposure, steps)
+            if file_used:
+                candidates.append((exposure, selector, *file_used))
+        if not candidates:
+            return files_by_type
+        candidate_exposures, selectors, file_types, files = zip(*candidates)
+        table = NightTable.read(files)
+        configs, config_indexes = table.exposure_configs()
+        # Whether any step uses each configuration, checked with the selector of its first exposure
+        first_exposures = np.unique(config_indexes, return_index=True)[1]
+        config_used = np.array([any(selectors[first].is_exposure_config_used_for_step(config, step) for step in steps)
+                                for config, first in zip(configs, first_exposures)], dtype=bool)
+        selected = np.flatnonzero(config_used[config_indexes])
+        selected = selected[filters.matches_all_filters_in_table(table[selected])]
+        dates = table.rows.mjdate[selected]
+        missing_date = np.isnan(dates) | (dates == 0)
+        for i in selected[missing_date]:
+            log.warning('File %s missing observation date info, skipping.', files[i])
+        selected = selected[~missing_date]
+        for i in selected[np.argsort(table.rows.mjdate[selected], kind='stable')]:
+            files_by_type[file_types[i] if split_by_type else FileType.ALL].append(candidate_exposures[i])
+        return files_by_type
 
 
 class SingleFileSelector:
@@ -65,6 +81,20 @@ class SingleFileSelector:
 
     @classmethod
     def a_step_uses_file(cls, exposure: Exposure, steps: Collection[Step]) -> Optional[Tuple[FileType, HeaderChecker]]:
+        file_used = cls.file_used_by_a_step(exposure, steps)
+        if not file_used:
+            return
+        file_type, file = file_used
+        checker = SpirouHeaderChecker(file)
+        exposure_config = ExposureConfig.from_header_checker(checker)
+        if any(cls.is_exposure_config_used_for_step(exposure_config, step) for step in steps):
+            return file_type, checker
+
+    @classmethod
+    def file_used_by_a_step(cls, exposure: Exposure, steps: Collection[Step]) -> Optional[Tuple[FileType, Path]]:
+        """
+        :return: The type of the exposure and the file to read its header from, if any step is for its type
+        """
         file = exposure.raw
         if cls.has_calibration_extension(exposure.raw):
             if not any(cls.is_calibration_step(step) for step in steps):
@@ -82,10 +112,7 @@ class SingleFileSelector:
                     file = exposure.preprocessed
         else:
             return
-        checker = SpirouHeaderChecker(file)
-        exposure_config = ExposureConfig.from_header_checker(checker)
-        if any(cls.is_exposure_config_used_for_step(exposure_config, step) for step in steps):
-            return file_type, checker
+        return file_type, file
 
     @staticmethod
     def is_exposure_config_used_for_step(exposure_config: ExposureConfig, step: Step):
@@ -117,6 +144,30 @@ class FileSelectionFilters:
     def matches_all_filters(self, checker: HeaderChecker) -> bool:
         return self.is_desired_runid(checker) and self.is_desired_target(checker)
 
+    def matches_all_filters_in_table(self, table: NightTable) -> np.ndarray:
+        """
+        :return: Whether each exposure in the table matches all filters
+        """
+        matches = self.desired_runids_in_table(table)
+        matches[matches] = self.desired_targets_in_table(table[matches])
+        return matches
+
+    def desired_runids_in_table(self, table: NightTable) -> np.ndarray:
+        if self.runids is None:
+            return np.ones(len(table), dtype=bool)
+        missing = table.rows.runid == ''
+        for i in np.flatnonzero(missing):
+            log.warning('File %s missing RUNID keyword, skipping.', table.files[i])
+        return ~missing & np.isin(table.rows.runid, list(self.runids))
+
+    def desired_targets_in_table(self, table: NightTable) -> np.ndarray:
+        if self.targets is None:
+            return np.ones(len(table), dtype=bool)
+        missing = ~table.rows.has_object
+        for i in np.flatnonzero(missing):
+            log.warning('File %s missing OBJECT keyword, skipping.', table.files[i])
+        return ~missing & np.isin(table.rows.object, list(self.targets))
+
     def is_desired_runid(self, checker: HeaderChecker) -> bool:
         if self.runids is None:
             return True
@@ -147,4 +198,4 @@ class FileSelectionFilters:
 
     @classmethod
     def telluric_standards(cls) -> FileSelectionFilters:
-        return cls(targets=TELLURIC_STANDARDS)
+        return cls(targets=get_telluric_standards())
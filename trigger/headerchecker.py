@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Optional, Tuple
 
 from logger import log
 from .baseinterface.headerchecker import DateTime, HeaderChecker
@@ -32,6 +32,12 @@ class SpirouHeaderChecker(HeaderChecker):
         else:
             return self.header['CMPLTEXP'], self.header['NEXP']
 
+    def get_sequence_id(self) -> Optional[Tuple[str, int]]:
+        # OCTOKEN is shared by every exposure of an observation, and OCEXPNUM changes when the sequence is repeated
+        if 'OCTOKEN' not in self.header or 'OCEXPNUM' not in self.header:
+            return None
+        return str(self.header['OCTOKEN']), self.header['OCEXPNUM']
+
     def get_rhomb_positions(self) -> Tuple[str, str]:
         if 'SBRHB1_P' not in self.header:
             raise RuntimeError('Object file missing SBRHB1_P keyword', self.file)
@@ -50,3 +56,40 @@ class SpirouHeaderChecker(HeaderChecker):
             log.warning('%s missing EXPTIME/EXPREQ in header, assuming not an aborted exposure', self.file)
             return False
         return self.header['EXPTIME'] / self.header['EXPREQ'] < self.MIN_EXP_TIME_RATIO_THRESHOLD
+
+
+class RawSpirouHeaderChecker(SpirouHeaderChecker):
+    """
+    Header checker for exposures which may not have been preprocessed yet, which works out the DPRTYPE from the
+    calibration unit positions in the raw header the same way preprocessing does.
+    """
+    FIBER_BY_POSITION = {
+        'pos_pk': 'DARK',
+        'pos_wl': 'FLAT',
+        'pos_fp': 'FP',
+        'pos_hc1': 'HCONE',
+        'pos_hc2': 'HCTWO',
+    }
+    DARK_SOURCE_BY_CALIBRATION_WHEEL = {
+        'P4': 'INT',
+        'P5': 'TEL',
+    }
+
+    def get_dpr_type(self) -> str:
+        if 'DPRTYPE' in self.header and self.header['DPRTYPE'] != 'None':
+            return self.header['DPRTYPE']
+        reference_fiber = self.FIBER_BY_POSITION.get(self.header.get('SBCREF_P'))
+        if reference_fiber is None:
+            raise RuntimeError('File missing DPRTYPE and SBCREF_P keywords', self.file)
+        if self.is_object():
+            return 'OBJ_' + reference_fiber
+        science_fiber = self.FIBER_BY_POSITION.get(self.header.get('SBCCAS_P'))
+        if science_fiber is None:
+            raise RuntimeError('File missing DPRTYPE and SBCCAS_P keywords', self.file)
+        dpr_type = science_fiber + '_' + reference_fiber
+        if dpr_type == 'DARK_DARK':
+            source = self.DARK_SOURCE_BY_CALIBRATION_WHEEL.get(self.header.get('SBCALI_P'))
+            if source is None:
+                raise RuntimeError('Dark file missing SBCALI_P keyword', self.file)
+            dpr_type += '_' + source
+        return dpr_type
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from astropy.io import fits
+
+from logger import log
+from .common.drsconstants import get_telluric_standards
+from .common.exposureconfig import ExposureConfig, TargetType
+from .headerchecker import SpirouHeaderChecker
+
+
+class NightTable:
+    """
+    The header keywords used to select exposures and group them into sequences, read once for each exposure of a night
+    into a NumPy record array, so that classification, filtering, sorting and sequence finding work on whole columns
+    rather than one header at a time.
+
+    Missing string keywords are stored as '', missing numbers as NaN or 0.
+    """
+    COLUMNS = (
+        ('mjdate', float),
+        ('obstype', str),
+        ('dpr_type', str),
+        ('cmpltexp', int),
+        ('nexp', int),
+        ('rhomb1', str),
+        ('rhomb2', str),
+        ('runid', str),
+        ('object', str),
+        ('has_object', bool),
+        ('trgtype', str),
+        ('exptime', float),
+        ('expreq', float),
+        ('octoken', str),
+        ('ocexpnum', int),
+        ('has_sequence_id', bool),
+    )
+
+    def __init__(self, files: Sequence[Path], rows: np.recarray):
+        """
+        :param files: The file each row was read from
+        :param rows: The keywords of each file, with the fields in COLUMNS
+        """
+        self.files = files
+        self.rows = rows
+
+    @classmethod
+    def read(cls, files: Iterable[Path]) -> NightTable:
+        files = list(files)
+        rows = [cls.__row(fits.getheader(file)) for file in files]
+        columns = zip(*rows) if rows else [()] * len(cls.COLUMNS)
+        arrays = [np.array(column, dtype=dtype) for column, (_, dtype) in zip(columns, cls.COLUMNS)]
+        return cls(files, np.rec.fromarrays(arrays, names=[name for name, _ in cls.COLUMNS]))
+
+    @staticmethod
+    def __row(header: fits.Header) -> Tuple:
+        def value(keyword: str, missing):
+            found = header.get(keyword)
+            return missing if found is None else found
+
+        has_object = 'OBJECT' in header or 'OBJNAME' in header
+        object_name = header['OBJECT'] if 'OBJECT' in header else header.get('OBJNAME', '')
+        dpr_type = str(value('DPRTYPE', ''))
+        has_sequence_id = 'OCTOKEN' in header and 'OCEXPNUM' in header
+        return (
+            value('MJDATE', np.nan),
+            str(value('OBSTYPE', '')),
+            '' if dpr_type == 'None' else dpr_type,
+            value('CMPLTEXP', 0),
+            value('NEXP', 0),
+            str(value('SBRHB1_P', '')),
+            str(value('SBRHB2_P', '')),
+            str(value('RUNID', '')),
+            str(object_name),
+            has_object,
+            str(value('TRGTYPE', '')),
+            value('EXPTIME', np.nan),
+            value('EXPREQ', np.nan),
+            str(value('OCTOKEN', '')),
+            value('OCEXPNUM', 0),
+            has_sequence_id,
+        )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, selection: Union[np.ndarray, Sequence[int]]) -> NightTable:
+        """
+        :param selection: The indexes of the rows to keep, or a boolean mask over the rows
+        """
+        indexes = np.flatnonzero(selection) if np.asarray(selection).dtype == bool else np.asarray(selection, int)
+        return NightTable([self.files[i] for i in indexes], self.rows[indexes])
+
+    def is_object(self) -> np.ndarray:
+        return self.rows.obstype == 'OBJECT'
+
+    def exposure_indexes_and_totals(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: The CMPLTEXP and NEXP of each exposure, with exposures missing either treated as single exposures
+        """
+        missing = (self.rows.cmpltexp == 0) | (self.rows.nexp == 0)
+        for i in np.flatnonzero(missing):
+            log.warning('%s missing CMPLTEXP/NEXP in header, treating sequence as single exposure', self.files[i])
+        return np.where(missing, 1, self.rows.cmpltexp), np.where(missing, 1, self.rows.nexp)
+
+    def sequence_ids(self) -> List[Optional[Tuple[str, int]]]:
+        """
+        :return: The OCTOKEN and OCEXPNUM of each exposure, or None for exposures missing either
+        """
+        return [(token, number) if has_id else None for token, number, has_id
+                in zip(self.rows.octoken.tolist(), self.rows.ocexpnum.tolist(), self.rows.has_sequence_id.tolist())]
+
+    def is_aborted(self) -> np.ndarray:
+        missing = np.isnan(self.rows.exptime) | np.isnan(self.rows.expreq)
+        for i in np.flatnonzero(missing):
+            log.warning('%s missing EXPTIME/EXPREQ in header, assuming not an aborted exposure', self.files[i])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = self.rows.exptime / self.rows.expreq
+        return ~missing & (ratio < SpirouHeaderChecker.MIN_EXP_TIME_RATIO_THRESHOLD)
+
+    def targets(self) -> np.ndarray:
+        """
+        :return: The TargetType value of each object, and 0 for calibrations
+        """
+        rows = self.rows
+        is_object = self.is_object()
+        names = rows.object
+        is_sky = is_object & ((rows.trgtype == 'SKY')
+                              | (np.char.lower(names) == 'sky')
+                              | np.char.startswith(names, 'sky_')
+                              | np.char.endswith(names, '_sky'))
+        is_telluric = is_object & ~is_sky
+        # Only load the DRS config when there are stars to check
+        if is_telluric.any():
+            is_telluric &= np.isin(names, get_telluric_standards())
+        targets = np.where(is_sky, TargetType.SKY.value,
+                           np.where(is_telluric, TargetType.TELLURIC_STANDARD.value, TargetType.STAR.value))
+        return np.where(is_object, targets, 0)
+
+    def exposure_configs(self) -> Tuple[List[ExposureConfig], np.ndarray]:
+        """
+        Classifies the exposures once for each distinct combination of the keywords their configuration depends on,
+        since a night only has a handful, rather than once for each exposure.
+        :return: The distinct exposure configurations, and for each exposure the index of its configuration
+        """
+        rows = self.rows
+        is_object = self.is_object()
+        # Fail the same way reading the headers one at a time would
+        self.__require(is_object & (rows.rhomb1 == ''), 'Object file missing SBRHB1_P keyword')
+        self.__require(is_object & (rows.rhomb2 == ''), 'Object file missing SBRHB2_P keyword')
+        self.__require(is_object & ~rows.has_object, 'Object file missing OBJECT and OBJNAME keywords')
+        keys = np.rec.fromarrays([
+            is_object,
+            rows.dpr_type,
+            np.where(is_object, rows.rhomb1, ''),
+            np.where(is_object, rows.rhomb2, ''),
+            self.targets(),
+            self.is_aborted(),
+        ], names=['is_object', 'dpr_type', 'rhomb1', 'rhomb2', 'target', 'is_aborted'])
+        unique_keys, config_indexes = np.unique(keys, return_inverse=True)
+        configs = [ExposureConfig.from_keywords(bool(key['is_object']), str(key['dpr_type']) or None,
+                                                bool(key['is_aborted']), (str(key['rhomb1']), str(key['rhomb2'])),
+                                                TargetType(int(key['target'])) if key['is_object'] else None)
+                   for key in unique_keys]
+        return configs, config_indexes.reshape(-1)
+
+    def __require(self, missing: np.ndarray, message: str):
+        if missing.any():
+            raise RuntimeError(message, self.files[int(np.argmax(missing))])
@@ -1,42 +1,156 @@
-from typing import Sequence
+import importlib
+import sys
+from functools import lru_cache
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Collection, Dict, Optional, Sequence, Tuple
 
-from apero.recipes.spirou import cal_badpix_spirou, cal_ccf_spirou, cal_extract_spirou, cal_flat_spirou, \
-    cal_leak_spirou, cal_loc_spirou, cal_preprocess_spirou, cal_shape_spirou, cal_thermal_spirou, \
-    cal_wave_night_spirou, obj_fit_tellu_spirou
-
-from .reciperunner import RecipeRunner
+from logger import log
+from .reciperunner import RecipeRunner, command_string
 from ...baseinterface.processor import IErrorHandler
-from ...common.drsconstants import Fiber
+from ...baseinterface.recipecosts import CostContext, IRecipeCosts
+from ...baseinterface.steps import Step
+from ...common.drsconstants import Fiber, get_config
+from ...common.executionplan import ExecutionPlan, RecipeStage
 from ...common.pathhandler import Exposure, TelluSuffix
+from ...common.steps import CalibrationStep, ObjectStep, PreprocessStep
+
+RECIPE_PACKAGE = 'apero.recipes.spirou'
+POL_RECIPE = 'spirou_pol'
+
+# Recipe modules used by each step, so that only the recipes for the configured steps need to be imported
+STEP_RECIPES: Dict[Step, Tuple[str, ...]] = {
+    PreprocessStep.PPCAL: ('cal_preprocess_spirou',),
+    PreprocessStep.PPOBJ: ('cal_preprocess_spirou',),
+    CalibrationStep.BADPIX: ('cal_badpix_spirou',),
+    CalibrationStep.LOC: ('cal_loc_spirou',),
+    CalibrationStep.SHAPE: ('cal_shape_spirou',),
+    CalibrationStep.FLAT: ('cal_flat_spirou',),
+    CalibrationStep.THERMAL: ('cal_thermal_spirou',),
+    CalibrationStep.WAVE: ('cal_wave_night_spirou',),
+    ObjectStep.SNRONLY: ('cal_extract_spirou',),
+    ObjectStep.EXTRACT: ('cal_extract_spirou',),
+    ObjectStep.LEAK: ('cal_leak_spirou',),
+    ObjectStep.FITTELLU: ('obj_fit_tellu_spirou',),
+    ObjectStep.CCF: ('cal_ccf_spirou',),
+    ObjectStep.POL: (POL_RECIPE,),
+}
+
+# Stage of the reduction each recipe belongs to, which decides what it waits for in an execution plan
+RECIPE_STAGES: Dict[str, RecipeStage] = {
+    recipe: (RecipeStage.PREPROCESS if isinstance(step, PreprocessStep)
+             else RecipeStage.CALIBRATION if isinstance(step, CalibrationStep) else RecipeStage.OBJECT)
+    for step, recipes in STEP_RECIPES.items() for recipe in recipes
+}
+
+# Wall clock limits in seconds for recipes known to hang on bad data, which are killed and reported as a timeout failure
+RECIPE_TIMEOUTS: Dict[str, float] = {
+    'cal_wave_night_spirou': 2 * 60 * 60,
+    POL_RECIPE: 60 * 60,
+}
+
+# Predicted running time in seconds of a recipe with no recorded history
+DEFAULT_RECIPE_COST = 60.0
+
+
+def load_recipe(name: str) -> ModuleType:
+    """
+    Imports a DRS recipe module the first time it is needed. Later calls return the module already in sys.modules.
+    :param name: The name of the recipe module in the APERO SPIRou recipes package
+    :return: The recipe module
+    """
+    return importlib.import_module(RECIPE_PACKAGE + '.' + name)
 
-try:
-    import sys
-    from pathlib import Path
-    from apero.core import constants
-    from logger import log
-    config = constants.load('SPIROU')
-    polar_root = Path(config['DRS_ROOT']).parent.parent.joinpath('spirou-polarimetry')
+
+@lru_cache(maxsize=None)
+def get_spirou_pol():
+    """
+    :return: The spirou_pol module from the spirou-polarimetry checkout next to the DRS, imported on first use, or None
+             if it is not available
+    """
+    polar_root = Path(get_config()['DRS_ROOT']).parent.parent.joinpath('spirou-polarimetry')
     sys.path.append(str(polar_root))
-    import spirou_pol
-except ModuleNotFoundError:
-    spirou_pol = None
-    log.warning('Failed to import spirou_pol, polarimetry recipe will not be able to run')
+    try:
+        import spirou_pol
+    except ModuleNotFoundError:
+        log.warning('Failed to import spirou_pol, polarimetry recipe will not be able to run')
+        return None
+    return spirou_pol
 
 
 class DRS:
     def __init__(self, trace=False, log_command=True, error_handler: IErrorHandler = None):
         self.runner = RecipeRunner(trace=trace, log_command=log_command, error_handler=error_handler)
+        self.runner.timeouts = dict(RECIPE_TIMEOUTS)
+        self.execution_plan: Optional[ExecutionPlan] = None
 
     @property
     def trace(self):
         return self.runner.trace
 
+    def preload(self, steps: Collection[Step]):
+        """
+        Imports the recipe modules used by a set of steps ahead of time, e.g. when a worker starts up, so the first
+        recipe run does not pay the import cost.
+        :param steps: The steps that will be run
+        """
+        recipes = {recipe for step in steps for recipe in STEP_RECIPES.get(step, ())}
+        for recipe in sorted(recipes):
+            if recipe == POL_RECIPE:
+                get_spirou_pol()
+            else:
+                load_recipe(recipe)
+        log.debug('Preloaded recipes %s', ', '.join(sorted(recipes)))
+
+    def isolate_recipes(self):
+        """
+        Runs each recipe in a child forked from a zygote process, rather than in the calling process.
+        """
+        self.runner.forking = True
+
+    def set_recipe_timeout(self, recipe: str, timeout: float):
+        """
+        :param recipe: The name of the recipe module, e.g. cal_extract_spirou
+        :param timeout: Wall clock time in seconds after which the recipe is killed, or None for no limit
+        """
+        if timeout is None:
+            self.runner.timeouts.pop(recipe, None)
+        else:
+            self.runner.timeouts[recipe] = timeout
+
+    def set_cancel_check(self, cancelled: Callable[[], bool]):
+        self.runner.cancelled = cancelled
+
+    def set_recipe_costs(self, costs: IRecipeCosts):
+        self.runner.costs = costs
+
+    def set_cost_context(self, context: CostContext):
+        self.runner.cost_context = context
+
+    def estimate_cost(self, steps: Collection[Step], context: CostContext) -> float:
+        """
+        :param steps: The steps which will run
+        :param context: The type of exposure the steps will run on
+        :return: The predicted running time in seconds of the recipes used by the steps
+        """
+        return sum(self.__estimate_recipe_cost(recipe, context)
+                   for step in steps for recipe in STEP_RECIPES.get(step, ()))
+
+    def plan(self, plan: ExecutionPlan):
+        """
+        Records each recipe call to an execution plan instead of running it. Recipes are not imported, and every call
+        is treated as successful, like in trace mode.
+        :param plan: The plan to record recipes to
+        """
+        self.execution_plan = plan
+        self.runner.trace = True
+
     def cal_preprocess(self, exposure: Exposure) -> bool:
         """
         :param exposure: Any exposure
         :return: Whether the recipe completed successfully
         """
-        return self.runner.run(cal_preprocess_spirou, exposure.night, exposure.raw.name)
+        return self.__run('cal_preprocess_spirou', [exposure], exposure.night, exposure.raw.name)
 
     def cal_badpix(self, flat_exposures: Sequence[Exposure], dark_exposures: Sequence[Exposure]) -> bool:
         """
@@ -46,35 +160,36 @@ class DRS:
         """
         flat_files = [flat.preprocessed.name for flat in flat_exposures]
         dark_files = [dark.preprocessed.name for dark in dark_exposures]
-        return self.runner.run(cal_badpix_spirou, flat_exposures[0].night, flat_files, dark_files)
+        return self.__run('cal_badpix_spirou', [*flat_exposures, *dark_exposures], flat_exposures[0].night,
+                          flat_files, dark_files)
 
     def cal_loc(self, exposures: Sequence[Exposure]) -> bool:
         """
         :param exposures: FLAT_DARK or DARK_FLAT sequence
         :return: Whether the recipe completed successfully
         """
-        return self.__run_sequence(cal_loc_spirou, exposures)
+        return self.__run_sequence('cal_loc_spirou', exposures)
 
     def cal_shape(self, exposures: Sequence[Exposure]) -> bool:
         """
         :param exposures: FP_FP sequence
         :return: Whether the recipe completed successfully
         """
-        return self.__run_sequence(cal_shape_spirou, exposures)
+        return self.__run_sequence('cal_shape_spirou', exposures)
 
     def cal_flat(self, exposures: Sequence[Exposure]) -> bool:
         """
         :param exposures: FLAT_FLAT sequence 
         :return: Whether the recipe completed successfully
         """
-        return self.__run_sequence(cal_flat_spirou, exposures)
+        return self.__run_sequence('cal_flat_spirou', exposures)
 
     def cal_thermal(self, exposures: Sequence[Exposure]) -> bool:
         """
         :param exposures: DARK_DARK_INT or DARK_DARK_TEL sequence
         :return: Whether the recipe completed successfully
         """
-        return self.__run_sequence(cal_thermal_spirou, exposures)
+        return self.__run_sequence('cal_thermal_spirou', exposures)
 
     def cal_wave(self, hc_exposures, fp_exposures) -> bool:
         """
@@ -84,28 +199,29 @@ class DRS:
         """
         hc_files = [flat.preprocessed.name for flat in hc_exposures]
         fp_files = [dark.preprocessed.name for dark in fp_exposures]
-        return self.runner.run(cal_wave_night_spirou, hc_exposures[0].night, hc_files, fp_files)
+        return self.__run('cal_wave_night_spirou', [*hc_exposures, *fp_exposures], hc_exposures[0].night, hc_files,
+                          fp_files)
 
     def cal_extract(self, exposure: Exposure, **kwargs) -> bool:
         """
         :param exposure: Any exposure that has been preprocessed
         :return: Whether the recipe completed successfully
         """
-        return self.runner.run(cal_extract_spirou, exposure.night, exposure.preprocessed.name, **kwargs)
+        return self.__run('cal_extract_spirou', [exposure], exposure.night, exposure.preprocessed.name, **kwargs)
 
     def cal_leak(self, exposure: Exposure) -> bool:
         """
         :param exposure: OBJ_FP exposure that has been extracted
         :return: Whether the recipe completed successfully
         """
-        return self.runner.run(cal_leak_spirou, exposure.night, exposure.e2ds(Fiber.AB).name)
+        return self.__run('cal_leak_spirou', [exposure], exposure.night, exposure.e2ds(Fiber.AB).name)
 
     def obj_fit_tellu(self, exposure: Exposure) -> bool:
         """
         :param exposure: OBJ_DARK or OBJ_FP exposure that has been extracted
         :return: Whether the recipe completed successfully
         """
-        return self.runner.run(obj_fit_tellu_spirou, exposure.night, exposure.e2ds(Fiber.AB).name)
+        return self.__run('obj_fit_tellu_spirou', [exposure], exposure.night, exposure.e2ds(Fiber.AB).name)
 
     def cal_ccf(self, exposure: Exposure, telluric_corrected=True) -> bool:
         """
@@ -114,17 +230,32 @@ class DRS:
         :return: Whether the recipe completed successfully
         """
         file = exposure.e2ds(Fiber.AB, TelluSuffix.tcorr(telluric_corrected)).name
-        return self.runner.run(cal_ccf_spirou, exposure.night, file)
+        return self.__run('cal_ccf_spirou', [exposure], exposure.night, file)
 
     def pol(self, exposures: Sequence[Exposure]) -> bool:
         """
         :param exposures OBJ_* sequence that has been extracted
         :return: Whether the recipe completed successfully
         """
-        if spirou_pol is None:
-            return False
-        input_files = (str(exposure.final_product('e')) for exposure in exposures)
-        return self.runner.run(spirou_pol, *input_files, output=str(exposures[0].final_product('p')))
+        input_files = [str(exposure.final_product('e')) for exposure in exposures]
+        return self.__run(POL_RECIPE, exposures, *input_files, output=str(exposures[0].final_product('p')))
+
+    def __run_sequence(self, recipe: str, exposures: Sequence[Exposure]) -> bool:
+        return self.__run(recipe, exposures, exposures[0].night, [exposure.preprocessed.name for exposure in exposures])
+
+    def __run(self, recipe: str, exposures: Sequence[Exposure], *args, **kwargs) -> bool:
+        if self.execution_plan is not None:
+            command = command_string(recipe, *args, **kwargs)
+            cost = self.__estimate_recipe_cost(recipe, self.runner.cost_context)
+            return self.execution_plan.add(recipe, RECIPE_STAGES[recipe], exposures, command, cost)
+        if recipe == POL_RECIPE:
+            module = get_spirou_pol()
+            if module is None:
+                return False
+        else:
+            module = load_recipe(recipe)
+        return self.runner.run(module, *args, **kwargs)
 
-    def __run_sequence(self, module, exposures: Sequence[Exposure]) -> bool:
-        return self.runner.run(module, exposures[0].night, [exposure.preprocessed.name for exposure in exposures])
+    def __estimate_recipe_cost(self, recipe: str, context: CostContext) -> float:
+        estimate = self.runner.costs.estimate(recipe, context)
+        return DEFAULT_RECIPE_COST if estimate is None else estimate
@@ -1,10 +1,12 @@
-import collections
+import collections.abc
 import sys
+import time
 import typing
-from multiprocessing import Pool
 
 from logger import log
-from ...baseinterface.processor import IErrorHandler, RecipeFailure
+from .recipezygote import RecipeZygote
+from ...baseinterface.processor import IErrorHandler, RecipeFailure, WorkCancelled
+from ...baseinterface.recipecosts import CostContext, IRecipeCosts, NoRecipeCosts
 
 
 def flatten(items: typing.Iterable) -> typing.Iterable:
@@ -12,39 +14,59 @@ def flatten(items: typing.Iterable) -> typing.Iterable:
     Takes a nested iterable structure and recursively flattens it to a 1d iterable.
     """
     for x in items:
-        if isinstance(x, collections.Iterable) and not isinstance(x, str):
+        if isinstance(x, collections.abc.Iterable) and not isinstance(x, str):
             yield from flatten(x)
         else:
             yield x
 
 
+def command_string(name: str, *args, **kwargs) -> str:
+    """
+    :return: A string representation of a recipe call, ideally matching what the command line call would be
+    """
+    arg_strings = map(str, flatten(args))
+    kwarg_strings = tuple('--{}={}'.format(k, v) for k, v in kwargs.items())
+    return ' '.join((name, *arg_strings, *kwarg_strings))
+
+
+def never_cancelled() -> bool:
+    return False
+
+
 class RecipeRunner:
     def __init__(self, trace: bool = False, log_command: bool = True, error_handler: IErrorHandler = None):
         self.trace = trace
         self.log_command = log_command
         self.error_handler = error_handler
-        # Could set this true for offline processing to avoid memory leaks?
+        # Whether to run each recipe in its own process forked from a zygote, isolating the trigger from leaks and exits
         self.forking = False
+        self.zygote = RecipeZygote()
+        # Wall clock limits in seconds by recipe module name, recipes with a limit are forked so they can be killed
+        self.timeouts: typing.Dict[str, float] = {}
+        # Checked before each recipe and while forked recipes run, to abandon cancelled work
+        self.cancelled: typing.Callable[[], bool] = never_cancelled
+        # Running times of recipes which ran to completion are recorded under the type of exposure being processed
+        self.costs: IRecipeCosts = NoRecipeCosts()
+        self.cost_context = CostContext()
 
     def run(self, module, *args, **kwargs) -> bool:
-        # Get a string representation of the command, ideally matching what the command line call would be
-        arg_strings = map(str, flatten(args))
-        kwarg_strings = tuple('--{}={}'.format(k, v) for k, v in kwargs.items())
-        command_string = ' '.join((module.__NAME__, *arg_strings, *kwarg_strings))
+        command = command_string(module.__NAME__, *args, **kwargs)
         if self.log_command:
-            log.info(command_string)
+            log.info(command)
         try:
             return self.__run(module, *args, **kwargs)
+        except WorkCancelled:
+            raise
         except RecipeFailure as e:
-            failure = e.from_command(command_string)
+            failure = e.from_command(command)
             log.error(failure.full_string())
             self.__handle_error(failure)
         except SystemExit:
-            failure = RecipeFailure('system exit', command_string)
+            failure = RecipeFailure('system exit', command)
             log.error(failure)
             self.__handle_error(failure)
         except Exception as e:
-            failure = RecipeFailure('uncaught exception', command_string)
+            failure = RecipeFailure('uncaught exception', command)
             log.error(failure, exc_info=e)
             self.__handle_error(failure)
         return False
@@ -53,10 +75,21 @@ class RecipeRunner:
         if self.trace:
             return True
         else:
-            if self.forking:
-                result = fork_recipe(module.main, *args, **kwargs)
+            if self.cancelled():
+                raise WorkCancelled(module.__NAME__)
+            recipe = module.__name__.rpartition('.')[2]
+            timeout = self.timeouts.get(recipe)
+            start = time.monotonic()
+            if self.forking or timeout is not None:
+                result = self.zygote.call(call_recipe, (module.main, *args), kwargs, timeout, self.cancelled)
             else:
                 result = call_recipe(module.main, *args, **kwargs)
+            if not result.get('error'):
+                self.costs.record(recipe, self.cost_context, time.monotonic() - start)
+            if result.get('error') == 'cancelled':
+                raise WorkCancelled(module.__NAME__)
+            if result.get('error'):
+                raise RecipeFailure(result.get('error'), traceback_string=result.get('traceback'))
             if not result.get('success'):
                 traceback = result.get('traceback')
                 if traceback:
@@ -84,8 +117,3 @@ def call_recipe(function, *args, **kwargs):
     }
     return result
 
-
-def fork_recipe(function, *args, **kwargs):
-    with Pool(1, maxtasksperchild=1) as pool:
-        result = pool.apply(call_recipe, (function, *args), **kwargs)
-    return result
@@ -0,0 +1,164 @@
+import gc
+import os
+import pickle
+import signal
+import sys
+import time
+import traceback
+from multiprocessing.connection import Connection, Pipe
+from typing import Callable, Dict, Optional, Sequence
+
+
+class RecipeZygote:
+    """
+    A process forked from the trigger once the recipe modules are imported, which forks a fresh child for each recipe
+    call. A recipe which leaks memory or calls sys.exit only affects its own child, and isolating it only costs a fork,
+    not the interpreter startup and DRS imports a new process would need.
+
+    The zygote freezes everything imported into the permanent GC generation, so the garbage collector in each child
+    never touches (and copies) the pages shared with the zygote.
+
+    The zygote and its children are forked with os.fork rather than multiprocessing, so that they can be used from
+    daemonic processes such as realtime workers. They don't log, the outcome of each call is returned instead.
+    """
+
+    def __init__(self):
+        self.pid: Optional[int] = None
+        self.owner: Optional[int] = None
+        self.connection: Optional[Connection] = None
+
+    def __getstate__(self):
+        # Only the process which started a zygote can use it, a copy in another process starts its own
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def call(self, function: Callable[..., Dict], args: Sequence = (), kwargs: Optional[Dict] = None,
+             timeout: Optional[float] = None, cancelled: Optional[Callable[[], bool]] = None,
+             poll_interval: float = 1.0) -> Dict:
+        """
+        Calls a function in a child of the zygote, starting the zygote if needed. Functions are sent by reference, so
+        they must be defined at the top level of a module, which the zygote imports if it hasn't already.
+        :param function: A function returning a picklable dict, e.g. call_recipe
+        :param args: Positional arguments for the function
+        :param kwargs: Keyword arguments for the function
+        :param timeout: Wall clock time in seconds after which the child is killed, or None for no limit
+        :param cancelled: Checked every poll_interval seconds while the child runs, which is killed once it is true
+        :param poll_interval: How often, in seconds, to check whether the child should be cancelled
+        :return: The result of the function, or a dict with an error reason and a traceback if the function raised,
+                 its child died, it timed out or it was cancelled
+        """
+        if self.owner != os.getpid():
+            # Not started yet, or started by the process this one was forked from
+            self.__start()
+        # The module search path is sent along, since recipes like spirou_pol are found through paths added later
+        request = (sys.path, pickle.dumps((function, tuple(args), kwargs or {})))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.connection.send(request)
+            child = self.connection.recv()
+            while not self.connection.poll(poll_interval if deadline is None
+                                           else min(poll_interval, max(deadline - time.monotonic(), 0))):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return self.__kill(child, {'error': 'timeout',
+                                               'traceback': 'Recipe killed after {:.0f} s'.format(timeout)})
+                if cancelled and cancelled():
+                    return self.__kill(child, {'error': 'cancelled'})
+            return self.connection.recv()
+        except (EOFError, OSError):
+            self.stop()
+            return {'error': 'zygote died'}
+
+    def __kill(self, child: Optional[int], result: Dict) -> Dict:
+        if child is not None:
+            try:
+                os.kill(child, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        # The zygote reports the child dying (or its result, if it finished just in time), which is superseded
+        self.connection.recv()
+        return result
+
+    def stop(self):
+        if self.owner != os.getpid():
+            return
+        self.connection.close()
+        try:
+            os.waitpid(self.pid, 0)
+        except ChildProcessError:
+            pass
+        self.pid = self.owner = self.connection = None
+
+    def __start(self):
+        connection, zygote_connection = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            try:
+                serve_zygote(zygote_connection)
+            finally:
+                os._exit(0)
+        zygote_connection.close()
+        self.pid, self.owner, self.connection = pid, os.getpid(), connection
+
+
+def serve_zygote(connection: Connection):
+    gc.freeze()
+    while True:
+        try:
+            path, call = connection.recv()
+        except EOFError:
+            # The process which started the zygote has exited
+            return
+        modules = len(sys.modules)
+        sys.path[:] = path
+        try:
+            function, args, kwargs = pickle.loads(call)
+        except Exception:
+            connection.send(None)
+            connection.send({'error': 'import failure', 'traceback': traceback.format_exc()})
+            continue
+        if len(sys.modules) != modules:
+            # Share newly imported modules with every later child too
+            gc.freeze()
+        reader, writer = Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            reader.close()
+            connection.close()
+            try:
+                result = run_isolated(function, args, kwargs)
+                try:
+                    writer.send(result)
+                except Exception:
+                    writer.send({'error': 'unpicklable result', 'traceback': traceback.format_exc()})
+            finally:
+                os._exit(0)
+        writer.close()
+        # The caller needs the pid of the child to kill it
+        connection.send(pid)
+        try:
+            result = reader.recv()
+        except EOFError:
+            result = None
+        reader.close()
+        _, status = os.waitpid(pid, 0)
+        if result is None:
+            result = {'error': 'recipe process died', 'traceback': describe_exit(status)}
+        connection.send(result)
+
+
+def run_isolated(function: Callable[..., Dict], args, kwargs) -> Dict:
+    try:
+        return function(*args, **kwargs)
+    except SystemExit:
+        return {'error': 'system exit'}
+    except BaseException:
+        return {'error': 'uncaught exception', 'traceback': traceback.format_exc()}
+
+
+def describe_exit(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return 'Recipe process killed by signal {}'.format(os.WTERMSIG(status))
+    return 'Recipe process exited with code {} without a result'.format(os.WEXITSTATUS(status))
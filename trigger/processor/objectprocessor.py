@@ -3,6 +3,7 @@ from typing import Collection, Dict, Sequence, Tuple
 
 from . import packager
 from .drswrapper import DRS
+from ..baseinterface.checkpoints import IStageCheckpoints, NoCheckpoints
 from ..baseinterface.steps import Step
 from ..common import Exposure, Fiber, ObjectConfig, ObjectStep, ObjectType, TargetType, TelluSuffix
 
@@ -11,19 +12,21 @@ class ObjectProcessor:
     def __init__(self, steps: Collection[Step], drs: DRS):
         self.steps = steps
         self.drs = drs
+        self.checkpoints: IStageCheckpoints = NoCheckpoints()
 
     def process_object_exposure(self, object_config: ObjectConfig, exposure: Exposure) -> Dict:
         extracted_path = self.__extract_object(exposure)
         if object_config.object_type == ObjectType.OBJ_FP:
             if ObjectStep.LEAK in self.steps:
-                self.drs.cal_leak(exposure)
+                self.checkpoints.run(exposure, 'leak', self.drs.cal_leak, exposure)
         if ObjectStep.PRODUCTS in self.steps and not self.drs.trace:
-            packager.create_2d_spectra_product(exposure)
+            self.checkpoints.run(exposure, '2d products', packager.create_2d_spectra_product, exposure)
         if object_config.target == TargetType.STAR:
             is_telluric_corrected = self.__telluric_correction(exposure)
             is_ccf_calculated, ccf_path = self.__ccf(exposure, is_telluric_corrected)
             if ObjectStep.PRODUCTS in self.steps and not self.drs.trace:
-                packager.create_1d_spectra_product(exposure, is_telluric_corrected)
+                self.checkpoints.run(exposure, '1d products', packager.create_1d_spectra_product, exposure,
+                                     is_telluric_corrected)
             return {
                 'extracted_path': extracted_path,
                 'ccf_path': ccf_path if is_ccf_calculated else None,
@@ -31,7 +34,7 @@ class ObjectProcessor:
                 'is_telluric_corrected': is_telluric_corrected,
             }
         if ObjectStep.PRODUCTS in self.steps and not self.drs.trace:
-            packager.create_1d_spectra_product(exposure)
+            self.checkpoints.run(exposure, '1d products', packager.create_1d_spectra_product, exposure)
         return {'extracted_path': extracted_path}
 
     def process_object_sequence(self, object_config: ObjectConfig, exposures: Sequence[Exposure]) -> Dict:
@@ -53,29 +56,31 @@ class ObjectProcessor:
 
     def __extract_object(self, exposure: Exposure) -> Path:
         if ObjectStep.SNRONLY in self.steps:
-            self.drs.cal_extract(exposure, fiber=Fiber.AB.value, quicklook=True)
+            self.checkpoints.run(exposure, 'quicklook extract', self.drs.cal_extract, exposure, fiber=Fiber.AB.value,
+                                 quicklook=True)
             return exposure.q2ds(Fiber.AB)
         if ObjectStep.EXTRACT in self.steps:
-            self.drs.cal_extract(exposure)
+            self.checkpoints.run(exposure, 'extract', self.drs.cal_extract, exposure)
         return exposure.e2ds(Fiber.AB)
 
     def __telluric_correction(self, exposure: Exposure) -> bool:
         if ObjectStep.FITTELLU in self.steps:
-            telluric_corrected = self.drs.obj_fit_tellu(exposure)
+            telluric_corrected = self.checkpoints.run(exposure, 'tellu', self.drs.obj_fit_tellu, exposure)
         else:
             telluric_corrected = exposure.e2ds(Fiber.AB, TelluSuffix.TCORR).exists()
         if ObjectStep.PRODUCTS in self.steps and not self.drs.trace:
-            packager.create_tell_product(exposure)
+            self.checkpoints.run(exposure, 'tellu product', packager.create_tell_product, exposure)
         return telluric_corrected
 
     def __ccf(self, exposure: Exposure, telluric_corrected: bool) -> Tuple[bool, Path]:
         ccf_path = exposure.ccf(tellu_suffix=TelluSuffix.tcorr(telluric_corrected))
         if ObjectStep.CCF in self.steps:
-            ccf_calculated = self.drs.cal_ccf(exposure, telluric_corrected)
+            ccf_calculated = self.checkpoints.run(exposure, 'ccf', self.drs.cal_ccf, exposure, telluric_corrected)
         else:
             ccf_calculated = ccf_path.exists()
         if ObjectStep.PRODUCTS in self.steps and not self.drs.trace:
-            packager.create_ccf_product(exposure, Fiber.AB, telluric_corrected=telluric_corrected)
+            self.checkpoints.run(exposure, 'ccf product', packager.create_ccf_product, exposure, Fiber.AB,
+                                 telluric_corrected=telluric_corrected)
         return ccf_calculated, ccf_path
 
     def __process_polar_sequence(self, exposures: Sequence[Exposure]) -> Dict:
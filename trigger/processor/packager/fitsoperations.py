@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Any, Collection, Iterable, Tuple, Union
+from typing import Any, Collection, Dict, Iterable, List, Tuple, Union
 
 from astropy.io import fits
 
@@ -8,6 +8,9 @@ from logger import log
 ExtensionHDU = Union[fits.ImageHDU, fits.BinTableHDU]
 HDU = Union[fits.PrimaryHDU, ExtensionHDU]
 
+NON_DUPLICATE_KEYS = ('SIMPLE', 'EXTEND', 'NEXTEND')
+COMMENTARY_KEYS = ('COMMENT', 'HISTORY', '')
+
 
 def get_card(header: fits.Header, keyword: str) -> Tuple[str, Any, str]:
     """
@@ -39,7 +42,7 @@ def verify_duplicate_cards(header: fits.Header, cards: Iterable[Tuple[str, Any,
     dupe_keys = []
     for card in cards:
         key, value = card[0], card[1]  # Split up so it still works if len(card) is 3
-        if key in ('SIMPLE', 'EXTEND', 'NEXTEND'):
+        if key in NON_DUPLICATE_KEYS:
             continue
         if header.get(key) == value:
             dupe_keys.append(key)
@@ -49,6 +52,54 @@ def verify_duplicate_cards(header: fits.Header, cards: Iterable[Tuple[str, Any,
     return dupe_keys
 
 
+def index_header(header: fits.Header) -> Dict[str, Tuple[int, Any]]:
+    """
+    Builds a lookup table from a fits header, mapping each keyword to the position and value of its first card.
+    :param header: The fits header to index
+    :return: The (index, value) of the first card for each keyword in the header
+    """
+    header_index = {}
+    for i, card in enumerate(header.cards):
+        header_index.setdefault(card.keyword, (i, card.value))
+    return header_index
+
+
+def remove_duplicate_cards(header: fits.Header, cards: Iterable[Tuple[str, Any, str]]) -> List[str]:
+    """
+    Removes expected duplicate cards from a fits header, and logs a warning for any which were not found.
+    This is equivalent to calling remove_keys with the result of verify_duplicate_cards, but uses a single indexed pass
+    over the header rather than a search and a removal for each card.
+    :param header: The fits header to update
+    :param cards: The cards expected to be found in the header
+    :return: The expected cards which were actually found (and removed) from the header
+    """
+    header_index = index_header(header)
+    dupe_keys = []
+    dupe_indices = set()
+    extname = None
+    for card in cards:
+        key, value = card[0], card[1]  # Split up so it still works if len(card) is 3
+        if key in NON_DUPLICATE_KEYS:
+            continue
+        index, header_value = header_index.get(key, (None, None))
+        if key in COMMENTARY_KEYS:
+            # Commentary keywords can repeat, so compare against all of them like header.get does
+            header_value = header.get(key)
+        if header_value == value:
+            dupe_keys.append(key)
+            if index is not None:
+                dupe_indices.add(index)
+        else:
+            if extname is None:
+                extname = header.get('EXTNAME')
+            log.warning('Header key %s expected to be duplicate in extension %s but was not', key, extname)
+    if dupe_indices:
+        kept_cards = [card for i, card in enumerate(header.cards) if i not in dupe_indices]
+        header.clear()
+        header.extend(kept_cards, strip=False, end=True)
+    return dupe_keys
+
+
 def create_hdu_list(hdus: Collection[HDU]) -> fits.HDUList:
     """
     Takes a collection of fits HDUs and converts into an HDUList ready to be saved to a file
@@ -309,8 +309,7 @@ def product_header_update(hdu_list: fits.HDUList):
             primary_header['MJDATE'] = (ext_header['MJDATE'], 'Modified Julian Date at middle of sequence')
         if ext_name.startswith('Wave') or ext_name.startswith('Blaze') or ext_name.endswith('Err'):
             continue
-        dupe_keys = fits_op.verify_duplicate_cards(ext_header, primary_header.items())
-        fits_op.remove_keys(ext_header, dupe_keys)
+        fits_op.remove_duplicate_cards(ext_header, primary_header.items())
     description = 'This file contains the following extensions: ' + ', '.join(ext_names)
     for line in textwrap.wrap(description, 71):
         primary_header.insert('FILENAME', ('COMMENT', line))
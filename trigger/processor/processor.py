@@ -1,11 +1,15 @@
-from typing import Collection, Dict, Sequence
+from typing import Callable, Collection, Dict, Sequence
 
 from .calibrationprocessor import CalibrationProcessor
 from .drswrapper import DRS
 from .objectprocessor import ObjectProcessor
+from ..baseinterface.checkpoints import IStageCheckpoints
 from ..baseinterface.processor import IErrorHandler
+from ..baseinterface.recipecosts import IRecipeCosts
 from ..baseinterface.steps import Step
 from ..common import CalibrationStep, Exposure, ExposureConfig, ObjectStep, PreprocessStep
+from ..common.executionplan import ExecutionPlan
+from ..common.recipecosts import cost_context
 
 
 class Processor:
@@ -16,6 +20,7 @@ class Processor:
         self.object_processor = ObjectProcessor(steps, self.drs)
 
     def preprocess_exposure(self, config: ExposureConfig, exposure: Exposure) -> bool:
+        self.drs.set_cost_context(cost_context(config))
         if (config.object and PreprocessStep.PPOBJ in self.steps
                 or config.calibration and PreprocessStep.PPCAL in self.steps):
             if config.is_aborted:
@@ -25,10 +30,12 @@ class Processor:
             return exposure.preprocessed.exists()
 
     def process_exposure(self, config: ExposureConfig, exposure: Exposure) -> Dict:
+        self.drs.set_cost_context(cost_context(config))
         if config.object:
             return self.object_processor.process_object_exposure(config.object, exposure)
 
     def process_sequence(self, config: ExposureConfig, exposures: Sequence[Exposure]) -> Dict:
+        self.drs.set_cost_context(cost_context(config))
         if config.calibration:
             self.calibration_processor.add_sequence_to_queue(exposures, config.calibration)
             return self.calibration_processor.attempt_processing_queue()
@@ -38,6 +45,31 @@ class Processor:
     def reset_state(self):
         self.calibration_processor.reset_state(partial=False)
 
+    def preload_recipes(self):
+        self.drs.preload(self.steps)
+
+    def isolate_recipes(self):
+        self.drs.isolate_recipes()
+
+    def set_cancel_check(self, cancelled: Callable[[], bool]):
+        self.drs.set_cancel_check(cancelled)
+
+    def set_checkpoints(self, checkpoints: IStageCheckpoints):
+        self.object_processor.checkpoints = checkpoints
+
+    def set_recipe_costs(self, costs: IRecipeCosts):
+        self.drs.set_recipe_costs(costs)
+
+    def plan(self, plan: ExecutionPlan):
+        self.drs.plan(plan)
+
+    def estimate_exposure_cost(self, config: ExposureConfig) -> float:
+        """
+        :return: The predicted running time in seconds of the recipes the configured steps run for an exposure
+        """
+        steps = [step for step in self.steps if self.is_exposure_config_used_for_step(config, step)]
+        return self.drs.estimate_cost(steps, cost_context(config))
+
     @staticmethod
     def is_exposure_config_used_for_step(config: ExposureConfig, step: Step) -> bool:
         if config.calibration and step == PreprocessStep.PPCAL or config.object and step == PreprocessStep.PPOBJ: